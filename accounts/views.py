@@ -21,7 +21,7 @@ from django.views.decorators.csrf import csrf_protect
 from django.views.decorators.debug import sensitive_post_parameters
 from django.views.generic import FormView, RedirectView
 
-from djangoblog.utils import send_email, get_sha256, get_current_site, generate_code, delete_sidebar_cache
+from djangoblog.utils import send_email, get_sha256, get_current_site, generate_code
 from . import utils
 from .forms import RegisterForm, LoginForm, ForgetPasswordForm, ForgetPasswordCodeForm
 from .models import BlogUser
@@ -88,7 +88,6 @@ class LogoutView(RedirectView):
 
     def get(self, request, *args, **kwargs):
         logout(request)
-        delete_sidebar_cache()
         return super(LogoutView, self).get(request, *args, **kwargs)
 
 
@@ -116,7 +115,6 @@ class LoginView(FormView):
         form = AuthenticationForm(data=self.request.POST, request=self.request)
 
         if form.is_valid():
-            delete_sidebar_cache()
             logger.info(self.redirect_field_name)
 
             auth.login(self.request, form.get_user())
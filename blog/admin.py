@@ -110,3 +110,10 @@ class SideBarAdmin(admin.ModelAdmin):
 
 class BlogSettingsAdmin(admin.ModelAdmin):
     pass
+
+
+class ArticleEnrichmentJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'article', 'kind', 'status', 'attempts', 'run_after', 'last_modify_time')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('article', 'kind', 'revision', 'attempts', 'locked_at', 'locked_by', 'last_error',
+                       'creation_time', 'last_modify_time')
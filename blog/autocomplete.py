@@ -0,0 +1,256 @@
+"""
+Search-as-you-type suggestions from an in-process prefix index.
+
+PrefixIndex keeps the suggestion keys of published article titles, tag and
+category names in one sorted list, so a keystroke is a bisect to the first
+key starting with the typed prefix and a short scan, without the database or
+the search backend.  The keys of a name are the name itself, its words and
+jieba segments, and the pinyin of the Chinese ones, spelled out and as
+initials, as text_unidecode romanizes them.
+
+The index is built on the first request of a process.  Saves and deletes
+update the index of the saving process one object at a time once committed,
+and increment a version counter in the cache; the other processes compare it
+at most every AUTOCOMPLETE_REFRESH_INTERVAL seconds and, when it changed,
+rebuild in one background thread while the old index keeps answering.
+"""
+import bisect
+import logging
+import random
+import re
+import threading
+import time
+import unicodedata
+
+import jieba
+from django.conf import settings
+from django.db import connection, transaction
+from text_unidecode import unidecode
+
+from blog.models import Article, Category, Tag
+from djangoblog.utils import cache
+
+logger = logging.getLogger(__name__)
+
+VERSION_CACHE_KEY = 'autocomplete_version'
+
+chinese_chars = re.compile(r"[\u4E00-\u9FD5]")
+
+
+def normalize(text):
+    return ' '.join(unicodedata.normalize('NFKC', text).lower().split())
+
+
+def get_keys(name):
+    """
+    :return: dict of key to rank, 0 for the whole name, 1 for its parts
+    """
+    name = normalize(name)
+    keys = {name: 0}
+    parts = set(name.split())
+    parts.update(w.strip() for w in jieba.cut_for_search(name))
+    parts.discard('')
+    if chinese_chars.search(name):
+        parts.add(name)
+    for part in parts:
+        keys.setdefault(part, 1)
+        if chinese_chars.search(part):
+            syllables = unidecode(part).lower().split()
+            keys.setdefault(''.join(syllables), 1)
+            keys.setdefault(''.join(s[0] for s in syllables), 1)
+    return keys
+
+
+class PrefixIndex(object):
+    kinds = {
+        'article': lambda: Article.objects.filter(status='p', type='a').only('id', 'title', 'creation_time'),
+        'tag': lambda: Tag.objects.only('id', 'name', 'slug'),
+        'category': lambda: Category.objects.only('id', 'name', 'slug'),
+    }
+    # how far past the first match a lookup scans before ranking
+    max_scan = 200
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # held for a whole build, so one runs at a time
+        self.build_lock = threading.Lock()
+        # sorted (key, rank, kind, id)
+        self.entries = []
+        # (kind, id) -> (suggestion, keys)
+        self.items = {}
+        self.built = False
+        self.version = None
+        self.checked = 0
+
+    @staticmethod
+    def get_kind(instance):
+        if isinstance(instance, Article):
+            return 'article'
+        if isinstance(instance, Tag):
+            return 'tag'
+        if isinstance(instance, Category):
+            return 'category'
+        return None
+
+    @staticmethod
+    def get_suggestion(kind, obj):
+        text = obj.title if kind == 'article' else obj.name
+        return {'text': text, 'type': kind, 'url': obj.get_absolute_url()}
+
+    def build(self):
+        with self.build_lock:
+            self._build()
+
+    def _build(self):
+        # taken first: a change while loading leaves the index out of date
+        version = get_version()
+        entries = []
+        items = {}
+        for kind, queryset in self.kinds.items():
+            for obj in queryset():
+                suggestion = self.get_suggestion(kind, obj)
+                keys = get_keys(suggestion['text'])
+                items[(kind, obj.id)] = (suggestion, keys)
+                entries.extend((key, rank, kind, obj.id) for key, rank in keys.items())
+        entries.sort()
+        with self.lock:
+            self.entries = entries
+            self.items = items
+            self.version = version
+            self.built = True
+            self.checked = time.monotonic()
+        logger.info('autocomplete index built with %d keys', len(entries))
+
+    def rebuild_in_background(self):
+        """
+        Rebuild in a thread unless one is running already, lookups keep using
+        the current index meanwhile
+        """
+        if not self.build_lock.acquire(blocking=False):
+            return
+        if settings.TESTING:
+            try:
+                self._build()
+            finally:
+                self.build_lock.release()
+            return
+
+        def run():
+            try:
+                self._build()
+            except Exception as e:
+                logger.error('autocomplete index rebuild failed: %s' % e)
+            finally:
+                self.build_lock.release()
+                # the connection of this thread
+                connection.close()
+
+        threading.Thread(target=run, name='autocomplete-rebuild', daemon=True).start()
+
+    def ensure_current(self):
+        if not self.built:
+            # nothing to answer from yet, the other requests wait for this build
+            with self.build_lock:
+                if not self.built:
+                    self._build()
+            return
+        now = time.monotonic()
+        if now - self.checked < settings.AUTOCOMPLETE_REFRESH_INTERVAL:
+            return
+        self.checked = now
+        if get_version() != self.version:
+            self.rebuild_in_background()
+
+    def _remove(self, item_key):
+        item = self.items.pop(item_key, None)
+        if item is None:
+            return
+        kind, id = item_key
+        for key, rank in item[1].items():
+            entry = (key, rank, kind, id)
+            i = bisect.bisect_left(self.entries, entry)
+            if i < len(self.entries) and self.entries[i] == entry:
+                del self.entries[i]
+
+    def update(self, instance):
+        kind = self.get_kind(instance)
+        if kind is None or not self.built:
+            return
+        if kind == 'article' and not (instance.status == 'p' and instance.type == 'a'):
+            self.remove(instance)
+            return
+        suggestion = self.get_suggestion(kind, instance)
+        keys = get_keys(suggestion['text'])
+        with self.lock:
+            self._remove((kind, instance.id))
+            self.items[(kind, instance.id)] = (suggestion, keys)
+            for key, rank in keys.items():
+                bisect.insort(self.entries, (key, rank, kind, instance.id))
+
+    def remove(self, instance):
+        kind = self.get_kind(instance)
+        if kind is None or not self.built:
+            return
+        with self.lock:
+            self._remove((kind, instance.id))
+
+    def lookup(self, prefix, limit=10):
+        """
+        :return: suggestions whose name, words or pinyin start with prefix,
+        whole name matches first, then shorter names
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        self.ensure_current()
+        with self.lock:
+            i = bisect.bisect_left(self.entries, (prefix,))
+            matches = {}
+            for key, rank, kind, id in self.entries[i:i + self.max_scan]:
+                if not key.startswith(prefix):
+                    break
+                if matches.get((kind, id), 2) > rank:
+                    matches[(kind, id)] = rank
+            suggestions = [(rank, self.items[item_key][0]) for item_key, rank in matches.items()]
+        suggestions.sort(key=lambda s: (s[0], len(s[1]['text']), s[1]['text']))
+        return [suggestion for rank, suggestion in suggestions[:limit]]
+
+
+def get_version():
+    version = cache.get(VERSION_CACHE_KEY)
+    if version is None:
+        # a random start: an evicted counter doesn't come back at a version a process holds
+        cache.add(VERSION_CACHE_KEY, random.randrange(1 << 62), None)
+        version = cache.get(VERSION_CACHE_KEY)
+    return version
+
+
+prefix_index = PrefixIndex()
+
+
+def apply_change(instance, deleted):
+    if deleted:
+        prefix_index.remove(instance)
+    else:
+        prefix_index.update(instance)
+    try:
+        version = cache.incr(VERSION_CACHE_KEY)
+    except ValueError:
+        # the counter was evicted, every process rebuilds
+        get_version()
+        return
+    with prefix_index.lock:
+        # still current only if no other process changed the index since this one loaded it,
+        # otherwise ensure_current rebuilds
+        if prefix_index.version == version - 1:
+            prefix_index.version = version
+
+
+def object_changed(instance, deleted=False):
+    """
+    Called by the post_save and post_delete handlers in djangoblog/blog_signals.py,
+    applied once the change is committed
+    """
+    if prefix_index.get_kind(instance) is None:
+        return
+    transaction.on_commit(lambda: apply_change(instance, deleted))
@@ -0,0 +1,137 @@
+"""
+Pre-render validators for conditional GET.
+
+The newest last_modify_time of each scope (an article, a category, a tag,
+an author, the whole site) is cached under the scope's dependency tags, so an
+unchanged page is answered 304 before any template or Markdown work.  Drafts
+count, an article leaving a list is a change of it.  The ETag also carries the
+generation of the scope's tags (see djangoblog.cache_dependency), which moves
+on deletes and removed tags that leave no newer last_modify_time behind.
+Layout parts such as the sidebar are not part of the validators.
+"""
+from functools import wraps
+
+from django.contrib.auth import get_user_model
+from django.db.models import Max
+from django.utils import translation
+from django.views.decorators.http import condition
+
+from blog.models import Article, Category, Tag
+from blog.viewcount import record_view
+from comments.models import Comment
+from djangoblog.cache_dependency import get_dependency_version
+from djangoblog.utils import get_or_compute_cache, get_sha256
+
+LAST_MODIFIED_TIMEOUT = 60 * 60 * 10
+
+
+def _newest(*values):
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+def get_validator(scope, compute, depends_on):
+    """
+    :param scope: cache key suffix, e.g. 'article_5'
+    :param compute: returns the newest datetime of the scope or None
+    :param depends_on: dependencies invalidating the scope
+    :return: (newest datetime or None, generation of depends_on)
+    """
+    version = get_dependency_version(*depends_on)
+    return get_or_compute_cache('last_modified_' + scope, compute, LAST_MODIFIED_TIMEOUT,
+                                depends_on=depends_on), version
+
+
+def article_validator(request, article_id, **kwargs):
+    def compute():
+        article = Article.objects.filter(pk=article_id).values_list('last_modify_time', flat=True).first()
+        comment = Comment.objects.filter(article_id=article_id, is_enable=True).aggregate(
+            newest=Max('last_modify_time'))['newest']
+        return _newest(article, comment)
+
+    return get_validator('article_{id}'.format(id=article_id), compute,
+                         ['blog.article:pk={id}'.format(id=article_id),
+                          'comments.comment:article_id={id}'.format(id=article_id)])
+
+
+def category_validator(request, category_name, **kwargs):
+    def compute():
+        category = Category.objects.filter(slug=category_name).first()
+        if category is None:
+            return None
+        newest = category.get_subtree_articles().aggregate(
+            newest=Max('last_modify_time'))['newest']
+        return _newest(category.last_modify_time, newest)
+
+    return get_validator('category_' + get_sha256(category_name), compute, [Article, Category])
+
+
+def tag_validator(request, tag_name, **kwargs):
+    def compute():
+        tag = Tag.objects.filter(slug=tag_name).first()
+        if tag is None:
+            return None
+        newest = Article.objects.filter(tags=tag).aggregate(
+            newest=Max('last_modify_time'))['newest']
+        return _newest(tag.last_modify_time, newest)
+
+    return get_validator('tag_' + get_sha256(tag_name), compute, [Article, Tag])
+
+
+def author_validator(request, author_name, **kwargs):
+    def compute():
+        return Article.objects.filter(author__username=author_name).aggregate(
+            newest=Max('last_modify_time'))['newest']
+
+    return get_validator('author_' + get_sha256(author_name), compute, [Article, get_user_model()])
+
+
+def site_validator(request, *args, **kwargs):
+    def compute():
+        return _newest(
+            Article.objects.aggregate(newest=Max('last_modify_time'))['newest'],
+            Category.objects.aggregate(newest=Max('last_modify_time'))['newest'],
+            Tag.objects.aggregate(newest=Max('last_modify_time'))['newest'],
+            # the index and the feed show comment counts
+            Comment.objects.aggregate(newest=Max('last_modify_time'))['newest'])
+
+    return get_validator('site', compute, [Article, Category, Tag, Comment])
+
+
+def conditional_page(validator_func):
+    """
+    condition() with an ETag derived from the scope's last modified time and
+    generation, the page and who is looking at it
+    :param validator_func: one of the *_validator functions above
+    """
+
+    def last_modified_func(request, *args, **kwargs):
+        return validator_func(request, *args, **kwargs)[0]
+
+    def etag_func(request, *args, **kwargs):
+        last_modified, version = validator_func(request, *args, **kwargs)
+        if last_modified is None:
+            return None
+        user = request.user.pk if request.user.is_authenticated else ''
+        return get_sha256('{path}|{lang}|{user}|{time}|{version}'.format(
+            path=request.get_full_path(), lang=translation.get_language(), user=user,
+            time=last_modified.isoformat(), version=version))
+
+    conditional = condition(etag_func=etag_func, last_modified_func=last_modified_func)
+    if validator_func is not article_validator:
+        return conditional
+
+    def decorator(view):
+        view = conditional(view)
+
+        @wraps(view)
+        def inner(request, *args, **kwargs):
+            response = view(request, *args, **kwargs)
+            if response.status_code == 304:
+                # the view is skipped, keep counting the read
+                record_view(int(kwargs['article_id']))
+            return response
+
+        return inner
+
+    return decorator
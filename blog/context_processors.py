@@ -2,15 +2,16 @@ import logging
 
 from django.utils import timezone
 
-from djangoblog.utils import cache, get_blog_setting
-from .models import Category, Article
+from djangoblog.cache_dependency import get_cache, set_cache
+from djangoblog.utils import get_blog_setting
+from .models import Category, Article, BlogSettings
 
 logger = logging.getLogger(__name__)
 
 
 def seo_processor(requests):
     key = 'seo_processor'
-    value = cache.get(key)
+    value = get_cache(key)
     if value:
         return value
     else:
@@ -25,7 +26,7 @@ def seo_processor(requests):
             'SITE_KEYWORDS': setting.site_keywords,
             'SITE_BASE_URL': requests.scheme + '://' + requests.get_host() + '/',
             'ARTICLE_SUB_LENGTH': setting.article_sub_length,
-            'nav_category_list': Category.objects.all(),
+            'nav_category_tree': Category.objects.get_tree(),
             'nav_pages': Article.objects.filter(
                 type='p',
                 status='p'),
@@ -39,5 +40,5 @@ def seo_processor(requests):
             "GLOBAL_FOOTER": setting.global_footer,
             "COMMENT_NEED_REVIEW": setting.comment_need_review,
         }
-        cache.set(key, value, 60 * 60 * 10)
+        set_cache(key, value, 60 * 60 * 10, depends_on=[BlogSettings, Category, Article])
         return value
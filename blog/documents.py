@@ -1,12 +1,18 @@
+import logging
+import queue
+import threading
 import time
 
 import elasticsearch.client
 from django.conf import settings
+from django.db.models import QuerySet
 from elasticsearch_dsl import Document, InnerDoc, Date, Integer, Long, Text, Object, GeoPoint, Keyword, Boolean
 from elasticsearch_dsl.connections import connections
 
 from blog.models import Article
 
+logger = logging.getLogger(__name__)
+
 ELASTICSEARCH_ENABLED = hasattr(settings, 'ELASTICSEARCH_DSL')
 
 if ELASTICSEARCH_ENABLED:
@@ -83,23 +89,29 @@ class ElapsedTimeDocument(Document):
 
 
 class ElaspedTimeDocumentManager:
+    # index existence is checked once per process
+    _index_ready = False
+
     @staticmethod
     def build_index():
+        if ElaspedTimeDocumentManager._index_ready:
+            return
         from elasticsearch import Elasticsearch
         client = Elasticsearch(settings.ELASTICSEARCH_DSL['default']['hosts'])
         res = client.indices.exists(index="performance")
         if not res:
             ElapsedTimeDocument.init()
+        ElaspedTimeDocumentManager._index_ready = True
 
     @staticmethod
     def delete_index():
         from elasticsearch import Elasticsearch
         es = Elasticsearch(settings.ELASTICSEARCH_DSL['default']['hosts'])
         es.indices.delete(index='performance', ignore=[400, 404])
+        ElaspedTimeDocumentManager._index_ready = False
 
     @staticmethod
-    def create(url, time_taken, log_datetime, useragent, ip):
-        ElaspedTimeDocumentManager.build_index()
+    def build_document(url, time_taken, log_datetime, useragent, ip):
         ua = UserAgent()
         ua.browser = UserAgentBrowser()
         ua.browser.Family = useragent.browser.family
@@ -116,23 +128,110 @@ class ElaspedTimeDocumentManager:
         ua.string = useragent.ua_string
         ua.is_bot = useragent.is_bot
 
-        doc = ElapsedTimeDocument(
-            meta={
-                'id': int(
-                    round(
-                        time.time() *
-                        1000))
-            },
+        # no id, elasticsearch assigns one: a batch is built within the same millisecond
+        return ElapsedTimeDocument(
             url=url,
             time_taken=time_taken,
             log_datetime=log_datetime,
             useragent=ua, ip=ip)
+
+    @staticmethod
+    def create(url, time_taken, log_datetime, useragent, ip):
+        ElaspedTimeDocumentManager.build_index()
+        doc = ElaspedTimeDocumentManager.build_document(url, time_taken, log_datetime, useragent, ip)
         doc.save(pipeline="geoip")
 
 
+class ElapsedTimeShipper:
+    """
+    Ships ElapsedTimeDocuments from a bounded in-process queue to
+    Elasticsearch in bulk on a background thread. Requests only pay for a
+    put_nowait; when the queue is full the record is dropped.
+    """
+    QUEUE_SIZE = getattr(settings, 'ELASTICSEARCH_PERFORMANCE_QUEUE_SIZE', 10000)
+    BATCH_SIZE = getattr(settings, 'ELASTICSEARCH_PERFORMANCE_BATCH_SIZE', 500)
+    FLUSH_INTERVAL = getattr(settings, 'ELASTICSEARCH_PERFORMANCE_FLUSH_INTERVAL', 5)
+
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, url, time_taken, log_datetime, useragent, ip):
+        """
+        :param useragent: raw User-Agent header, parsed on the shipper thread
+        :return: False if the record was dropped
+        """
+        self._ensure_thread()
+        try:
+            self.queue.put_nowait((url, time_taken, log_datetime, useragent, ip))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='performance-shipper', daemon=True)
+                self._thread.start()
+
+    def drain(self, block=True):
+        """
+        Take up to BATCH_SIZE records, waiting at most FLUSH_INTERVAL for the first one
+        """
+        records = []
+        deadline = time.time() + self.FLUSH_INTERVAL
+        while len(records) < self.BATCH_SIZE:
+            timeout = deadline - time.time()
+            try:
+                if block and timeout > 0:
+                    records.append(self.queue.get(timeout=timeout))
+                else:
+                    records.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return records
+
+    def ship(self, records):
+        from elasticsearch.helpers import bulk
+        from user_agents import parse
+        ElaspedTimeDocumentManager.build_index()
+        actions = []
+        for url, time_taken, log_datetime, useragent, ip in records:
+            doc = ElaspedTimeDocumentManager.build_document(url, time_taken, log_datetime, parse(useragent), ip)
+            actions.append(doc.to_dict(include_meta=True))
+        success, errors = bulk(connections.get_connection(), actions, pipeline='geoip', raise_on_error=False)
+        if errors:
+            logger.error('ship performance documents failed: %s' % errors[:1])
+        return success
+
+    def _run(self):
+        while True:
+            records = self.drain()
+            if not records:
+                continue
+            try:
+                self.ship(records)
+            except Exception as e:
+                logger.error('ship performance documents failed: %s' % e)
+            if self.dropped:
+                logger.warning('performance queue full, dropped %d records' % self.dropped)
+                self.dropped = 0
+
+
+elapsed_time_shipper = ElapsedTimeShipper()
+
+
 class ArticleDocument(Document):
     body = Text(analyzer='ik_max_word', search_analyzer='ik_smart')
     title = Text(analyzer='ik_max_word', search_analyzer='ik_smart')
+    # plain text start of the body, highlighted and shown by the search page
+    excerpt = Text(analyzer='ik_max_word', search_analyzer='ik_smart')
+    url = Keyword(index=False)
     author = Object(properties={
         'nickname': Text(analyzer='ik_max_word', search_analyzer='ik_smart'),
         'id': Integer()
@@ -165,49 +264,136 @@ class ArticleDocument(Document):
 
 
 class ArticleDocumentManager():
+    # `blog` is an alias; full rebuilds fill a fresh index and swap the alias
+    ALIAS = ArticleDocument.Index.name
+    CHUNK_SIZE = getattr(settings, 'ELASTICSEARCH_BULK_CHUNK_SIZE', 500)
+    THREAD_COUNT = getattr(settings, 'ELASTICSEARCH_BULK_THREAD_COUNT', 4)
 
     def __init__(self):
         self.create_index()
 
     def create_index(self):
-        ArticleDocument.init()
+        # Document.init() cannot sync settings through an alias
+        if not connections.get_connection().indices.exists(index=self.ALIAS):
+            ArticleDocument.init()
 
     def delete_index(self):
         from elasticsearch import Elasticsearch
         es = Elasticsearch(settings.ELASTICSEARCH_DSL['default']['hosts'])
+        if es.indices.exists_alias(name=self.ALIAS):
+            for index in es.indices.get_alias(name=self.ALIAS).keys():
+                es.indices.delete(index=index, ignore=[400, 404])
         es.indices.delete(index='blog', ignore=[400, 404])
 
+    @staticmethod
+    def get_queryset(articles=None):
+        articles = Article.objects.all() if articles is None else articles
+        if isinstance(articles, QuerySet):
+            articles = articles.select_related('author', 'category').prefetch_related('tags')
+        return articles
+
+    def iter_docs(self, articles, chunk_size=None):
+        articles = self.get_queryset(articles)
+        if isinstance(articles, QuerySet):
+            articles = articles.iterator(chunk_size=chunk_size or self.CHUNK_SIZE)
+        for article in articles:
+            yield self.article_to_doc(article)
+
+    @staticmethod
+    def article_to_doc(article):
+        return ArticleDocument(
+            meta={
+                'id': article.id},
+            body=article.body,
+            title=article.title,
+            excerpt=article.get_excerpt(),
+            url=article.get_absolute_url(),
+            author={
+                'nickname': article.author.username,
+                'id': article.author.id},
+            category={
+                'name': article.category.name,
+                'id': article.category.id},
+            tags=[
+                {
+                    'name': t.name,
+                    'id': t.id} for t in article.tags.all()],
+            pub_time=article.pub_time,
+            status=article.status,
+            comment_status=article.comment_status,
+            type=article.type,
+            views=article.views,
+            article_order=article.article_order)
+
     def convert_to_doc(self, articles):
-        return [
-            ArticleDocument(
-                meta={
-                    'id': article.id},
-                body=article.body,
-                title=article.title,
-                author={
-                    'nickname': article.author.username,
-                    'id': article.author.id},
-                category={
-                    'name': article.category.name,
-                    'id': article.category.id},
-                tags=[
-                    {
-                        'name': t.name,
-                        'id': t.id} for t in article.tags.all()],
-                pub_time=article.pub_time,
-                status=article.status,
-                comment_status=article.comment_status,
-                type=article.type,
-                views=article.views,
-                article_order=article.article_order) for article in articles]
-
-    def rebuild(self, articles=None):
-        ArticleDocument.init()
-        articles = articles if articles else Article.objects.all()
-        docs = self.convert_to_doc(articles)
-        for doc in docs:
-            doc.save()
+        return list(self.iter_docs(articles))
+
+    def bulk_index(self, docs, index=None, chunk_size=None, thread_count=None):
+        """
+        Index documents with the parallel bulk helper
+        :param docs: iterable of ArticleDocument
+        :param index: target index, defaults to the alias
+        :return: (indexed count, failed count)
+        """
+        from elasticsearch.helpers import parallel_bulk
+
+        def actions():
+            for doc in docs:
+                action = doc.to_dict(include_meta=True)
+                action['_index'] = index or self.ALIAS
+                yield action
+
+        success, failed = 0, 0
+        for ok, info in parallel_bulk(
+                connections.get_connection(),
+                actions(),
+                chunk_size=chunk_size or self.CHUNK_SIZE,
+                thread_count=thread_count or self.THREAD_COUNT,
+                raise_on_error=False):
+            if ok:
+                success += 1
+            else:
+                failed += 1
+                logger.error('bulk index failed: %s' % info)
+        return success, failed
+
+    def rebuild(self, articles=None, chunk_size=None, thread_count=None):
+        """
+        Index articles. A full rebuild (articles is None) writes a new index and
+        then points the alias at it, so searches keep hitting the old index
+        until the new one is complete.
+        """
+        if articles is not None:
+            self.create_index()
+            return self.bulk_index(self.iter_docs(articles, chunk_size),
+                                   chunk_size=chunk_size, thread_count=thread_count)
+
+        es = connections.get_connection()
+        new_index = '{alias}-{ts}'.format(alias=self.ALIAS, ts=int(time.time() * 1000))
+        ArticleDocument._index.clone(name=new_index).create()
+        # refreshing is pointless while the index is not searchable yet
+        es.indices.put_settings(index=new_index, body={'index': {'refresh_interval': '-1'}})
+        result = self.bulk_index(self.iter_docs(None, chunk_size), index=new_index,
+                                 chunk_size=chunk_size, thread_count=thread_count)
+        es.indices.put_settings(index=new_index, body={'index': {'refresh_interval': None}})
+        es.indices.refresh(index=new_index)
+        self.swap_alias(new_index)
+        return result
+
+    def swap_alias(self, new_index):
+        es = connections.get_connection()
+        actions = [{'add': {'index': new_index, 'alias': self.ALIAS}}]
+        old_indices = []
+        if es.indices.exists_alias(name=self.ALIAS):
+            old_indices = list(es.indices.get_alias(name=self.ALIAS).keys())
+            actions.extend({'remove': {'index': i, 'alias': self.ALIAS}} for i in old_indices)
+        elif es.indices.exists(index=self.ALIAS):
+            # a concrete `blog` index from before aliases were used
+            actions.insert(0, {'remove_index': {'index': self.ALIAS}})
+        es.indices.update_aliases(body={'actions': actions})
+        for index in old_indices:
+            if index != new_index:
+                es.indices.delete(index=index, ignore=[400, 404])
 
     def update_docs(self, docs):
-        for doc in docs:
-            doc.save()
+        return self.bulk_index(docs)
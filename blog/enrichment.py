@@ -0,0 +1,115 @@
+"""
+Background enrichment of articles.
+
+Article.save only enqueues an ArticleEnrichmentJob keyed by the sha256 of the
+body, so saving the same revision twice queues one job.  The worker
+(manage.py run_enrichment_worker) claims due jobs in batches, calls the
+summary client outside of any request and writes the result with an UPDATE,
+which neither re-enqueues nor regenerates anything.  Failed jobs are retried
+with an exponential backoff up to ENRICHMENT_MAX_ATTEMPTS.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from django.utils.timezone import now
+
+from djangoblog.cache_dependency import invalidate_instance
+from djangoblog.utils import claim_due_rows, get_retry_delay, get_sha256
+
+logger = logging.getLogger(__name__)
+
+
+class StubSummaryClient(object):
+    """
+    Offline client: the first words of the body, for tests and development
+    """
+    words = 60
+
+    def summarize(self, text):
+        words = text.split()
+        summary = ' '.join(words[:self.words])
+        return summary + '...' if len(words) > self.words else summary
+
+
+class OpenAISummaryClient(object):
+    model = 'gpt-4'
+
+    def __init__(self):
+        from openai import OpenAI
+        self.client = OpenAI(api_key=settings.OPENAI_API_KEY)
+
+    def summarize(self, text):
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system",
+                 "content": "You are a helpful assistant that generates concise summaries (50-100 words) for blog posts."},
+                {"role": "user", "content": f"Summarize this blog post content in 50-100 words:\n\n{text}"}
+            ],
+            max_tokens=150,
+            temperature=0.5,
+            timeout=settings.ENRICHMENT_CLIENT_TIMEOUT
+        )
+        return response.choices[0].message.content.strip()
+
+
+def get_summary_client():
+    return import_string(settings.ARTICLE_SUMMARY_CLIENT)()
+
+
+def get_revision(article):
+    return get_sha256(article.body)
+
+
+def enqueue_summary(article):
+    """
+    Queue a summary job for the current body of the article, once per revision
+    :return: the job
+    """
+    from blog.models import ArticleEnrichmentJob
+    job, created = ArticleEnrichmentJob.objects.get_or_create(
+        article=article, kind=ArticleEnrichmentJob.SUMMARY, revision=get_revision(article))
+    if created:
+        logger.info('queued summary of article:{id}'.format(id=article.id))
+    return job
+
+
+def process_jobs(batch_size=10, client=None):
+    """
+    Run one batch of due jobs
+    :return: number of jobs claimed
+    """
+    from blog.models import ArticleEnrichmentJob
+    jobs = claim_due_rows(ArticleEnrichmentJob.objects.select_related('article'), batch_size,
+                          settings.ENRICHMENT_LEASE, ArticleEnrichmentJob.PENDING, ArticleEnrichmentJob.RUNNING)
+    if not jobs:
+        return 0
+    client = client or get_summary_client()
+    for job in jobs:
+        article = job.article
+        if get_revision(article) != job.revision:
+            # the body changed since, the job of the new revision takes over
+            job.finish(ArticleEnrichmentJob.SKIPPED)
+            continue
+        try:
+            summary = client.summarize(article.body)
+        except Exception as e:
+            logger.warning('summary of article:{id} failed, attempt {n}: {e}'.format(
+                id=article.id, n=job.attempts, e=e))
+            if job.attempts >= settings.ENRICHMENT_MAX_ATTEMPTS:
+                job.finish(ArticleEnrichmentJob.FAILED, error=str(e))
+            else:
+                job.retry(now() + get_retry_delay(job.attempts, settings.ENRICHMENT_RETRY_DELAY,
+                                                  settings.ENRICHMENT_MAX_RETRY_DELAY), error=str(e))
+            continue
+        with transaction.atomic():
+            # a newer last_modify_time moves the Last-Modified of the pages showing the summary
+            updated = type(article).objects.filter(pk=article.pk, body=article.body).update(
+                summary=summary, last_modify_time=now())
+            job.finish(ArticleEnrichmentJob.DONE if updated else ArticleEnrichmentJob.SKIPPED)
+        if updated:
+            invalidate_instance(article)
+            logger.info('summarized article:{id}'.format(id=article.id))
+    return len(jobs)
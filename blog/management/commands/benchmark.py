@@ -0,0 +1,219 @@
+import json
+import os
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from blog.models import Article, Tag
+from djangoblog.instrumentation import QueryRecorder
+from djangoblog.utils import cache
+
+try:
+    import resource
+except ImportError:  # not available on windows
+    resource = None
+
+ENDPOINTS = ['index', 'detail', 'category', 'tag', 'search', 'autocomplete', 'feed', 'sitemap', 'comment_post']
+
+
+def percentile(values, pct):
+    """
+    nearest-rank percentile of a non empty list
+    """
+    values = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def get_rss_kb():
+    """
+    current resident set size, peak rss where /proc is missing
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 1024
+    except (OSError, ValueError, AttributeError):
+        if resource is None:
+            return None
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Command(BaseCommand):
+    help = 'measure latency, queries and memory of the hot endpoints through the test client'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help='run create_testdata before measuring')
+        parser.add_argument('--articles', type=int, default=2000, help='articles to seed')
+        parser.add_argument('--tags', type=int, default=200, help='tags to seed')
+        parser.add_argument('--categories', type=int, default=10, help='top level categories to seed')
+        parser.add_argument('--category-depth', type=int, default=3, help='category levels to seed')
+        parser.add_argument('--comments', type=int, default=5, help='comments per article to seed')
+        parser.add_argument('--requests', type=int, default=50, help='measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests per endpoint')
+        parser.add_argument('--cold', action='store_true', help='clear the cache before every request')
+        parser.add_argument('--endpoint', action='append', choices=ENDPOINTS, dest='endpoints',
+                            help='endpoint to measure, repeatable, all by default')
+        parser.add_argument('--baseline', help='json file of a previous run to compare with')
+        parser.add_argument('--save-baseline', help='write the results to this json file')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='allowed slowdown against the baseline, 0.2 is 20%%')
+        parser.add_argument('--first-search', action='store_true',
+                            help='also measure the first search of a new worker, with and without preloading jieba')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            call_command('create_testdata', articles=options['articles'], tags=options['tags'],
+                         categories=options['categories'], category_depth=options['category_depth'],
+                         comments=options['comments'], stdout=self.stdout)
+        article = Article.objects.filter(type='a', status='p').order_by('-id').first()
+        if article is None:
+            raise CommandError('no published article, run with --seed')
+        tag = Tag.objects.filter(article__isnull=False).first()
+        user = get_user_model().objects.filter(is_active=True).order_by('id').first()
+        urls = {
+            'index': reverse('blog:index'),
+            'detail': article.get_absolute_url(),
+            'category': article.category.get_absolute_url(),
+            'tag': tag.get_absolute_url() if tag else None,
+            'search': reverse('search') + '?' + urlencode({'q': article.title.split()[0]}),
+            'autocomplete': reverse('blog:autocomplete') + '?' + urlencode({'q': article.title[:3]}),
+            'feed': '/feed/',
+            'sitemap': reverse('sitemap_section', kwargs={'section': 'blog'}),
+            'comment_post': reverse('comment:postcomment', kwargs={'article_id': article.pk}),
+        }
+        client = Client()
+        results = {}
+        for endpoint in options['endpoints'] or ENDPOINTS:
+            url = urls[endpoint]
+            if url is None:
+                self.stdout.write(self.style.WARNING('skipped {endpoint}: no data'.format(endpoint=endpoint)))
+                continue
+            if endpoint == 'comment_post':
+                client.force_login(user)
+                request = lambda n: self.rolled_back(client.post, url, {'body': 'benchmark comment ' + str(n)})
+            else:
+                client.logout()
+                request = lambda n: client.get(url)
+            results[endpoint] = self.measure(request, options['requests'], options['warmup'], options['cold'])
+        client.logout()
+
+        self.report(results)
+        if options['first_search']:
+            self.report_first_search(client, urls['search'])
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS('saved baseline to ' + options['save_baseline']))
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = self.compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('regressions against {path}:\n{lines}'.format(
+                    path=options['baseline'], lines='\n'.join(regressions)))
+            self.stdout.write(self.style.SUCCESS('no regression against ' + options['baseline']))
+
+    def measure(self, request, count, warmup, cold):
+        for n in range(warmup):
+            self.consume(request(n))
+        latencies = []
+        queries = []
+        statuses = set()
+        rss_before = get_rss_kb()
+        for n in range(count):
+            if cold:
+                cache.clear()
+            with QueryRecorder() as recorder:
+                start = time.perf_counter()
+                response = request(warmup + n)
+                self.consume(response)
+                latencies.append((time.perf_counter() - start) * 1000)
+            queries.append(recorder.query_count)
+            statuses.add(response.status_code)
+        rss_after = get_rss_kb()
+        return {
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'queries': round(sum(queries) / float(len(queries)), 2),
+            'rss_kb': rss_after,
+            'rss_growth_kb': rss_after - rss_before if rss_after is not None else None,
+            'statuses': sorted(statuses),
+        }
+
+    @staticmethod
+    def rolled_back(func, *args):
+        """
+        Run a write request in a transaction that is rolled back, with mail
+        kept in memory, so the benchmark leaves no comments and sends nothing
+        """
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                               EMAIL_OUTBOX_EAGER=False), transaction.atomic():
+            response = func(*args)
+            transaction.set_rollback(True)
+        return response
+
+    @staticmethod
+    def consume(response):
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+
+    def report(self, results):
+        self.stdout.write('{:<14}{:>10}{:>10}{:>10}{:>12}  {}'.format(
+            'endpoint', 'p50 ms', 'p99 ms', 'queries', 'rss kb', 'status'))
+        for endpoint, r in results.items():
+            self.stdout.write('{:<14}{:>10}{:>10}{:>10}{:>12}  {}'.format(
+                endpoint, r['p50_ms'], r['p99_ms'], r['queries'], r['rss_kb'] or '-',
+                ','.join(str(s) for s in r['statuses'])))
+
+    def report_first_search(self, client, url):
+        """
+        Time the first search of a worker that loads jieba lazily, the boot
+        and first search of one that preloads it, then a repeated query
+        """
+        import jieba
+        from djangoblog.whoosh_cn_backend import cached_jieba_tokens, preload_jieba
+
+        def reset():
+            # what a new worker starts from, the index itself stays open
+            jieba.dt.initialized = False
+            cached_jieba_tokens.cache_clear()
+            cache.clear()
+
+        def timed(func):
+            start = time.perf_counter()
+            func()
+            return round((time.perf_counter() - start) * 1000, 2)
+
+        client.get(url)
+        reset()
+        lazy = timed(lambda: client.get(url))
+        reset()
+        boot = timed(preload_jieba)
+        preloaded = timed(lambda: client.get(url))
+        cache.clear()
+        repeated = timed(lambda: client.get(url))
+        self.stdout.write('first search ms: lazy {lazy}, preloaded {preloaded} after {boot} at boot, '
+                          'repeated query {repeated}'.format(lazy=lazy, preloaded=preloaded, boot=boot,
+                                                             repeated=repeated))
+
+    @staticmethod
+    def compare(results, baseline, tolerance):
+        regressions = []
+        for endpoint, r in results.items():
+            base = baseline.get(endpoint)
+            if not base:
+                continue
+            for metric in ('p50_ms', 'p99_ms'):
+                if r[metric] > base[metric] * (1 + tolerance):
+                    regressions.append('{endpoint} {metric}: {old} -> {new}'.format(
+                        endpoint=endpoint, metric=metric, old=base[metric], new=r[metric]))
+            if r['queries'] > base['queries']:
+                regressions.append('{endpoint} queries: {old} -> {new}'.format(
+                    endpoint=endpoint, old=base['queries'], new=r['queries']))
+        return regressions
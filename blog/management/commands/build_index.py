@@ -2,17 +2,26 @@ from django.core.management.base import BaseCommand
 
 from blog.documents import ElapsedTimeDocument, ArticleDocumentManager, ElaspedTimeDocumentManager, \
     ELASTICSEARCH_ENABLED
+from djangoblog.search_cache import bump_generation
 
 
-# TODO 参数化
 class Command(BaseCommand):
     help = 'build search index'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='documents per bulk request and rows per database chunk')
+        parser.add_argument('--threads', type=int, default=None,
+                            help='parallel bulk threads')
+
     def handle(self, *args, **options):
         if ELASTICSEARCH_ENABLED:
             ElaspedTimeDocumentManager.build_index()
             manager = ElapsedTimeDocument()
             manager.init()
             manager = ArticleDocumentManager()
-            manager.delete_index()
-            manager.rebuild()
+            # the new index replaces the old one through an alias swap, no delete needed
+            success, failed = manager.rebuild(chunk_size=options['chunk_size'],
+                                              thread_count=options['threads'])
+            bump_generation()
+            self.stdout.write(self.style.SUCCESS('indexed %d articles, %d failed\n' % (success, failed)))
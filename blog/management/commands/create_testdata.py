@@ -1,40 +1,124 @@
+import random
+from datetime import timedelta
+
 from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import make_password
 from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils.timezone import now
+from uuslug import slugify
 
 from blog.models import Article, Tag, Category
+from comments.models import Comment
+
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
 
 class Command(BaseCommand):
     help = 'create test datas'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--articles', type=int, default=19, help='number of articles')
+        parser.add_argument('--tags', type=int, default=19, help='number of tags besides the base tag')
+        parser.add_argument('--tags-per-article', type=int, default=2, help='tags of each article, base tag included')
+        parser.add_argument('--categories', type=int, default=1, help='number of top level categories')
+        parser.add_argument('--category-depth', type=int, default=2,
+                            help='levels of categories under each top level category, itself included')
+        parser.add_argument('--comments', type=int, default=0, help='comments per article')
+        parser.add_argument('--users', type=int, default=1, help='number of authors')
+        parser.add_argument('--seed', type=int, default=0, help='random seed, same seed gives the same data')
+        parser.add_argument('--batch-size', type=int, default=1000, help='rows per INSERT')
+
     def handle(self, *args, **options):
-        user = get_user_model().objects.get_or_create(
-            email='test@test.com', username='测试用户', password=make_password('test!q@w#eTYU'))[0]
-
-        pcategory = Category.objects.get_or_create(
-            name='我是父类目', parent_category=None)[0]
-
-        category = Category.objects.get_or_create(
-            name='子类目', parent_category=pcategory)[0]
-
-        category.save()
-        basetag = Tag()
-        basetag.name = "标签"
-        basetag.save()
-        for i in range(1, 20):
-            article = Article.objects.get_or_create(
-                category=category,
-                title='nice title ' + str(i),
-                body='nice content ' + str(i),
-                author=user)[0]
-            tag = Tag()
-            tag.name = "标签" + str(i)
-            tag.save()
-            article.tags.add(tag)
-            article.tags.add(basetag)
-            article.save()
+        # bulk_create skips Model.save and the signals: no summary generation,
+        # no search index update and no cache invalidation per row
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size'] = max(options['batch_size'], 1)
+
+        users = self.create_users(options['users'], batch_size)
+        categories = self.create_categories(options['categories'], options['category_depth'])
+        basetag = Tag.objects.get_or_create(name="标签")[0]
+        tags = self.create_tags(options['tags'], batch_size)
+
+        created = 0
+        start = now()
+        titles = ['nice title ' + str(i) for i in range(1, options['articles'] + 1)]
+        for batch in chunks(titles, batch_size):
+            with transaction.atomic():
+                created += self.create_articles(batch, rng, start, users, categories, basetag, tags, options)
 
         from djangoblog.utils import cache
         cache.clear()
-        self.stdout.write(self.style.SUCCESS('created test datas \n'))
+        self.stdout.write(self.style.SUCCESS(
+            'created {count} articles, run rebuild_index to index them for search\n'.format(count=created)))
+
+    def create_users(self, count, batch_size):
+        user_model = get_user_model()
+        password = make_password('test!q@w#eTYU')
+        user = user_model.objects.get_or_create(
+            username='测试用户', defaults={'email': 'test@test.com', 'password': password})[0]
+        names = ['testuser' + str(i) for i in range(1, count)]
+        user_model.objects.bulk_create(
+            [user_model(username=name, email=name + '@test.com', password=password) for name in names],
+            batch_size=batch_size, ignore_conflicts=True)
+        return [user.pk] + list(user_model.objects.filter(username__in=names).values_list('pk', flat=True))
+
+    def create_categories(self, count, depth):
+        """
+        categories are few and go through save, which maintains the closure table
+        :return: the leaf categories, articles are spread over them
+        """
+        leaves = []
+        for i in range(1, max(count, 1) + 1):
+            category = None
+            for level in range(1, max(depth, 1) + 1):
+                name = '我是父类目' if i == 1 and level == 1 else '类目{i}-{level}'.format(i=i, level=level)
+                if i == 1 and level == 2:
+                    name = '子类目'
+                category = Category.objects.get_or_create(name=name, parent_category=category)[0]
+            leaves.append(category.pk)
+        return leaves
+
+    def create_tags(self, count, batch_size):
+        names = ['标签' + str(i) for i in range(1, count + 1)]
+        Tag.objects.bulk_create([Tag(name=name, slug=slugify(name)) for name in names],
+                                batch_size=batch_size, ignore_conflicts=True)
+        return list(Tag.objects.filter(name__in=names).values_list('pk', flat=True))
+
+    def create_articles(self, titles, rng, start, users, categories, basetag, tags, options):
+        existing = set(Article.objects.filter(title__in=titles).values_list('title', flat=True))
+        articles = []
+        for title in titles:
+            if title in existing:
+                continue
+            number = title.rsplit(' ', 1)[-1]
+            pub_time = start - timedelta(seconds=rng.randint(0, 3 * 365 * 24 * 3600))
+            articles.append(Article(
+                title=title, body='nice content ' + number, summary='nice summary ' + number,
+                author_id=rng.choice(users), category_id=rng.choice(categories),
+                pub_time=pub_time, creation_time=pub_time, last_modify_time=pub_time))
+        if not articles:
+            return 0
+        # primary keys are not set by bulk_create on every backend, read them back
+        Article.objects.bulk_create(articles)
+        ids = list(Article.objects.filter(title__in=[a.title for a in articles]).order_by('pk').values_list('pk', 'pub_time'))
+
+        through = Article.tags.through
+        links = []
+        comments = []
+        tags_per_article = min(max(options['tags_per_article'] - 1, 0), len(tags))
+        for article_id, pub_time in ids:
+            links.append(through(article_id=article_id, tag_id=basetag.pk))
+            for tag_id in rng.sample(tags, tags_per_article):
+                links.append(through(article_id=article_id, tag_id=tag_id))
+            for j in range(options['comments']):
+                comment_time = pub_time + timedelta(seconds=rng.randint(60, 30 * 24 * 3600))
+                comments.append(Comment(
+                    body='nice comment ' + str(j), author_id=rng.choice(users), article_id=article_id,
+                    is_enable=True, creation_time=comment_time, last_modify_time=comment_time))
+        through.objects.bulk_create(links, batch_size=options['batch_size'])
+        Comment.objects.bulk_create(comments, batch_size=options['batch_size'])
+        return len(ids)
@@ -0,0 +1,20 @@
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from blog.models import Article
+from blog.viewcount import flush_view_counts
+
+
+class Command(BaseCommand):
+    help = 'write buffered article view counts to the database, needs a cache shared between processes'
+
+    def handle(self, *args, **options):
+        if isinstance(caches['default'], (LocMemCache, DummyCache)):
+            # the counters live in the memory of the web processes, this one starts without any
+            self.stderr.write(self.style.WARNING(
+                'the default cache is local to each process, only the web processes can flush their views'))
+        ids = Article.objects.values_list('id', flat=True).iterator()
+        total = flush_view_counts(ids)
+        self.stdout.write(self.style.SUCCESS('flushed %d views\n' % total))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from blog.enrichment import process_jobs
+
+
+class Command(BaseCommand):
+    help = 'process queued article enrichment jobs such as summaries'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10, help='jobs claimed at once')
+        parser.add_argument('--sleep', type=float, default=5, help='seconds to wait when no job is due')
+        parser.add_argument('--once', action='store_true', help='exit when no job is due')
+
+    def handle(self, *args, **options):
+        total = 0
+        try:
+            while True:
+                count = process_jobs(options['batch_size'])
+                total += count
+                if count:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS('processed %d jobs\n' % total))
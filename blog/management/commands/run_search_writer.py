@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from djangoblog.search_queue import SearchWriter
+
+
+class Command(BaseCommand):
+    help = 'index the objects queued by saves, as the only writer of the search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='queue rows per batch, SEARCH_QUEUE_BATCH_SIZE by default')
+        parser.add_argument('--sleep', type=float, default=1, help='seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='exit when the queue is empty')
+        parser.add_argument('--optimize', action='store_true', help='merge the index into one segment on exit')
+
+    def handle(self, *args, **options):
+        total = 0
+        with SearchWriter(batch_size=options['batch_size']) as writer:
+            try:
+                while True:
+                    total += writer.drain()
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+            except KeyboardInterrupt:
+                pass
+        if options['optimize'] and hasattr(writer.backend, 'optimize'):
+            writer.backend.optimize()
+        self.stdout.write(self.style.SUCCESS('indexed %d queued objects\n' % total))
@@ -1,15 +1,25 @@
 import logging
+import random
 import time
 
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils import translation
+from django.utils.cache import patch_cache_control
 from ipware import get_client_ip
-from user_agents import parse
 
-from blog.documents import ELASTICSEARCH_ENABLED, ElaspedTimeDocumentManager
+from blog.documents import ELASTICSEARCH_ENABLED, elapsed_time_shipper
+from djangoblog.cache_dependency import get_cache, page_path_tag, set_cache
+from djangoblog.instrumentation import QueryRecorder, add_server_timing, remember_request
+from djangoblog.utils import get_sha256
 
 logger = logging.getLogger(__name__)
 
 
 class OnlineMiddleware(object):
+    # fraction of requests whose render time is shipped to Elasticsearch
+    sample_rate = getattr(settings, 'ELASTICSEARCH_PERFORMANCE_SAMPLE_RATE', 1.0)
+
     def __init__(self, get_response=None):
         self.get_response = get_response
         super().__init__()
@@ -18,25 +28,145 @@ class OnlineMiddleware(object):
         ''' page render time '''
         start_time = time.time()
         response = self.get_response(request)
-        http_user_agent = request.META.get('HTTP_USER_AGENT', '')
-        ip, _ = get_client_ip(request)
-        user_agent = parse(http_user_agent)
         if not response.streaming:
             try:
                 cast_time = time.time() - start_time
-                if ELASTICSEARCH_ENABLED:
+                if ELASTICSEARCH_ENABLED and random.random() < self.sample_rate:
                     time_taken = round((cast_time) * 1000, 2)
                     url = request.path
+                    ip, _ = get_client_ip(request)
                     from django.utils import timezone
-                    ElaspedTimeDocumentManager.create(
+                    elapsed_time_shipper.submit(
                         url=url,
                         time_taken=time_taken,
                         log_datetime=timezone.now(),
-                        useragent=user_agent,
+                        useragent=request.META.get('HTTP_USER_AGENT', ''),
                         ip=ip)
-                response.content = response.content.replace(
-                    b'<!!LOAD_TIMES!!>', str.encode(str(cast_time)[:5]))
+                # a header instead of patching the body keeps the content, and its ETag, stable
+                add_server_timing(response, 'app', cast_time)
             except Exception as e:
                 logger.error("Error OnlineMiddleware: %s" % e)
 
         return response
+
+
+class PageCacheMiddleware(object):
+    """
+    Full-page cache for anonymous GET requests of the blog pages.
+
+    Views tag the page with add_surrogate_keys; the cached page is stamped
+    with those dependency tags and the layout ones every page shares, so
+    saving a model purges the pages showing it. The tags are also sent as Surrogate-Key for a CDN, the nginx
+    front only honours the short s-maxage (see deploy/nginx.conf).
+    Requests carrying a session or messages cookie always reach the view.
+    """
+    cached_url_names = {
+        'index', 'index_page', 'detailbyid', 'category_detail', 'category_detail_page',
+        'author_detail', 'author_detail_page', 'tag_detail', 'tag_detail_page', 'archives', 'links'
+    }
+    bypass_cookies = (settings.SESSION_COOKIE_NAME, 'messages')
+    # layout shared by every page: settings, sidebar, links and the category nav, and
+    # the recent articles, tag cloud, recent comments and prev/next links, so any
+    # article, tag or comment change purges every page
+    base_surrogate_keys = ['blog.blogsettings', 'blog.sidebar', 'blog.links', 'blog.category',
+                           'blog.article', 'blog.tag', 'comments.comment']
+    timeout = getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 10)
+    shared_max_age = getattr(settings, 'PAGE_CACHE_SHARED_MAX_AGE', 60)
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        super().__init__()
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if getattr(request, 'page_cache_key', None):
+            self.store(request, response)
+        elif getattr(request, 'page_cache_bypass', False):
+            patch_cache_control(response, private=True)
+        return response
+
+    def is_cached_url(self, request):
+        match = request.resolver_match
+        return match is not None and match.namespace == 'blog' and match.url_name in self.cached_url_names
+
+    def get_cache_key(self, request):
+        return 'page_cache_' + get_sha256('{host}|{path}|{lang}'.format(
+            host=request.get_host(), path=request.get_full_path(), lang=translation.get_language()))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method != 'GET' or not self.is_cached_url(request):
+            return None
+        if any(name in request.COOKIES for name in self.bypass_cookies):
+            request.page_cache_bypass = True
+            return None
+        key = self.get_cache_key(request)
+        entry = get_cache(key)
+        if entry is None:
+            request.page_cache_key = key
+            return None
+        if request.resolver_match.url_name == 'detailbyid':
+            # the view is skipped, keep counting the read
+            from blog.viewcount import record_view
+            record_view(int(view_kwargs['article_id']))
+        response = HttpResponse(entry['content'], status=entry['status'])
+        for header, value in entry['headers'].items():
+            response[header] = value
+        response['X-Page-Cache'] = 'HIT'
+        return response
+
+    def store(self, request, response):
+        if response.status_code != 200 or response.streaming or response.cookies or \
+                request.META.get('CSRF_COOKIE_NEEDS_UPDATE'):
+            # rendered a csrf token or set a cookie: the page is per user
+            patch_cache_control(response, private=True)
+            return
+        keys = self.base_surrogate_keys + getattr(request, 'surrogate_keys', []) + [page_path_tag(request.path)]
+        response['Surrogate-Key'] = ' '.join(keys)
+        patch_cache_control(response, public=True, max_age=0, s_maxage=self.shared_max_age)
+        headers = {header: response[header] for header in
+                   ('Content-Type', 'Content-Language', 'Cache-Control', 'Surrogate-Key', 'Last-Modified', 'ETag')
+                   if response.has_header(header)}
+        set_cache(request.page_cache_key,
+                  {'content': response.content, 'status': response.status_code, 'headers': headers},
+                  self.timeout, depends_on=keys)
+        response['X-Page-Cache'] = 'MISS'
+
+
+class QueryBudgetMiddleware(object):
+    """
+    Records the queries of every request, see djangoblog.instrumentation.
+    Query totals and the slowest template tags go out as Server-Timing,
+    repeated statements (likely N+1) and exceeded QUERY_BUDGETS are logged,
+    and the summary is kept for the admin query budget page.
+    """
+    duplicate_threshold = getattr(settings, 'QUERY_DUPLICATE_THRESHOLD', 5)
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        super().__init__()
+
+    def __call__(self, request):
+        if not getattr(settings, 'QUERY_INSTRUMENTATION', False):
+            return self.get_response(request)
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+        try:
+            match = request.resolver_match
+            view_name = match.view_name if match else ''
+            summary = recorder.summary(request.path, view_name)
+            add_server_timing(response, 'db', recorder.query_time,
+                              '{count} queries'.format(count=recorder.query_count))
+            for name, calls, total, queries in summary['tags'][:5]:
+                add_server_timing(response, 'tag-' + name, total / 1000,
+                                  '{calls} calls, {queries} queries'.format(calls=calls, queries=queries))
+            if summary['budget'] is not None and recorder.query_count > summary['budget']:
+                logger.warning('query budget exceeded on {path} ({view}): {count} > {budget}'.format(
+                    path=request.path, view=view_name, count=recorder.query_count, budget=summary['budget']))
+            for sql, count in recorder.get_duplicates(self.duplicate_threshold):
+                logger.warning('possible N+1 on {path}: {count}x {sql}'.format(
+                    path=request.path, count=count, sql=sql))
+            if not view_name.startswith('admin:'):
+                remember_request(summary)
+        except Exception as e:
+            logger.error("Error QueryBudgetMiddleware: %s" % e)
+        return response
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.8 on 2026-10-18 09:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0009_categoryclosure'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['status', 'type', 'article_order', 'pub_time', 'id'], name='blog_articl_status_dc6713_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['category', 'status', 'article_order', 'pub_time', 'id'], name='blog_articl_categor_319533_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='article',
+            index=models.Index(fields=['author', 'status', 'type', 'article_order', 'pub_time', 'id'], name='blog_articl_author__52b6fd_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.1.8 on 2026-10-18 09:41
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_article_list_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArticleEnrichmentJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('s', 'Summary')], default='s', max_length=1, verbose_name='kind')),
+                ('revision', models.CharField(max_length=64, verbose_name='revision')),
+                ('status', models.CharField(choices=[('p', 'Pending'), ('r', 'Running'), ('d', 'Done'), ('f', 'Failed'), ('k', 'Skipped')], default='p', max_length=1, verbose_name='status')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='attempts')),
+                ('run_after', models.DateTimeField(default=django.utils.timezone.now, verbose_name='run after')),
+                ('locked_at', models.DateTimeField(blank=True, null=True, verbose_name='locked at')),
+                ('locked_by', models.CharField(blank=True, default='', max_length=32, verbose_name='locked by')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='last error')),
+                ('creation_time', models.DateTimeField(default=django.utils.timezone.now, verbose_name='creation time')),
+                ('last_modify_time', models.DateTimeField(default=django.utils.timezone.now, verbose_name='modify time')),
+                ('article', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='blog.article', verbose_name='article')),
+            ],
+            options={
+                'verbose_name': 'article enrichment job',
+                'verbose_name_plural': 'article enrichment job',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['status', 'run_after'], name='blog_articl_status_af8798_idx')],
+                'constraints': [models.UniqueConstraint(fields=('article', 'kind', 'revision'), name='unique_enrichment_revision')],
+            },
+        ),
+    ]
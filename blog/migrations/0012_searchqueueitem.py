@@ -0,0 +1,28 @@
+# Generated by Django 5.1.8 on 2026-10-18 09:45
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0011_articleenrichmentjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchQueueItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=100, verbose_name='model')),
+                ('object_id', models.CharField(max_length=64, verbose_name='object id')),
+                ('creation_time', models.DateTimeField(default=django.utils.timezone.now, verbose_name='creation time')),
+            ],
+            options={
+                'verbose_name': 'search queue item',
+                'verbose_name_plural': 'search queue item',
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.8 on 2026-10-18 10:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0012_searchqueueitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchGeneration',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('using', models.CharField(max_length=100, unique=True, verbose_name='connection')),
+                ('generation', models.PositiveBigIntegerField(default=0, verbose_name='generation')),
+            ],
+            options={
+                'verbose_name': 'search generation',
+                'verbose_name_plural': 'search generation',
+            },
+        ),
+    ]
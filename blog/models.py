@@ -1,20 +1,23 @@
+import html
 import logging
 from abc import abstractmethod
-from openai import OpenAI
 from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
 from django.urls import reverse
+from django.utils.html import strip_tags
+from django.utils.text import Truncator
 from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 from mdeditor.fields import MDTextField
 from uuslug import slugify
 
-from djangoblog.utils import cache_decorator, cache
+from djangoblog.cache_dependency import get_cache, get_many_cache, set_cache, set_many_cache
+from djangoblog.utils import cache_decorator, get_or_compute_cache, CommonMarkdown
 from djangoblog.utils import get_current_site
 
 logger = logging.getLogger(__name__)
-client = OpenAI(api_key=settings.OPENAI_API_KEY )
+
 
 class LinkShowType(models.TextChoices):
     I = ('i', _('index'))
@@ -36,6 +39,8 @@ class BaseModel(models.Model):
         if is_update_views:
             Article.objects.filter(pk=self.pk).update(views=self.views)
         else:
+            # drives Last-Modified of the pages showing this object
+            self.last_modify_time = now()
             if 'slug' in self.__dict__:
                 slug = getattr(
                     self, 'title') if 'title' in self.__dict__ else getattr(
@@ -57,6 +62,36 @@ class BaseModel(models.Model):
         pass
 
 
+class ArticleManager(models.Manager):
+    OBJECT_CACHE_PREFIX = 'article_object_'
+    OBJECT_CACHE_TIMEOUT = 60 * 60 * 10
+
+    def get_cached_in_bulk(self, ids):
+        """
+        Articles by id through the per-article object cache, misses are
+        loaded with one in_bulk query
+        :param ids: article ids, the result keeps their order
+        :return: list of articles
+        """
+        keys = {self.OBJECT_CACHE_PREFIX + str(i): i for i in ids}
+        articles = {keys[k]: v for k, v in get_many_cache(keys.keys()).items()}
+        missing = [i for i in ids if i not in articles]
+        if missing:
+            loaded = self.select_related('category', 'author').prefetch_related('tags').annotate(
+                comment_count=models.Count('comment', filter=models.Q(comment__is_enable=True))).in_bulk(missing)
+            values = {}
+            depends_on = {}
+            for article_id, article in loaded.items():
+                key = self.OBJECT_CACHE_PREFIX + str(article_id)
+                values[key] = article
+                depends_on[key] = [article, 'blog.category:pk={id}'.format(id=article.category_id),
+                                   'accounts.bloguser:pk={id}'.format(id=article.author_id), 'blog.tag',
+                                   'comments.comment:article_id={id}'.format(id=article_id)]
+            set_many_cache(values, self.OBJECT_CACHE_TIMEOUT, depends_on=depends_on)
+            articles.update(loaded)
+        return [articles[i] for i in ids if i in articles]
+
+
 class Article(BaseModel):
     """Article"""
     STATUS_CHOICES = (
@@ -84,39 +119,8 @@ class Article(BaseModel):
     show_toc = models.BooleanField(_('show toc'), blank=False, null=False, default=False)
     category = models.ForeignKey('Category', verbose_name=_('category'), on_delete=models.CASCADE, blank=False, null=False)
     tags = models.ManyToManyField('Tag', verbose_name=_('tag'), blank=True)
-    def generate_summary(self):
-        """Generate a summary using OpenAI API."""
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that generates concise summaries (50-100 words) for blog posts."},
-                    {"role": "user", "content": f"Summarize this blog post content in 50-100 words:\n\n{self.body}"}
-                ],
-                max_tokens=150,
-                temperature=0.5
-            )
-            summary = response.choices[0].message.content.strip()
-            logger.info(f"Generated summary for article: {self.title}")
-            return summary
-        except Exception as e:
-            logger.error(f"Error generating summary: {e}", exc_info=True)
-            return "Summary generation failed."
 
-    def save(self, *args, **kwargs):
-        """Override save to generate summary if content is updated."""
-        if not self.summary or self._state.adding:
-            if self.body:  # Only generate summary if body exists
-                self.summary = self.generate_summary()
-        super().save(*args, **kwargs)
-    def viewed(self):
-        """Existing method to track views (unchanged)."""
-        # Add your existing view tracking logic here
-        pass
-
-    def comment_list(self):
-        """Existing method to get comments (unchanged)."""
-        return self.comments.all()
+    objects = ArticleManager()
 
     def __str__(self):
         return self.title
@@ -124,14 +128,17 @@ class Article(BaseModel):
     def body_to_string(self):
         return self.body
 
-    def __str__(self):
-        return self.title
-
     class Meta:
         ordering = ['-article_order', '-pub_time']
         verbose_name = _('article')
         verbose_name_plural = verbose_name
         get_latest_by = 'id'
+        # cover the list filters plus the keyset ordering, see blog.pagination
+        indexes = [
+            models.Index(fields=['status', 'type', 'article_order', 'pub_time', 'id']),
+            models.Index(fields=['category', 'status', 'article_order', 'pub_time', 'id']),
+            models.Index(fields=['author', 'status', 'type', 'article_order', 'pub_time', 'id']),
+        ]
 
     def get_absolute_url(self):
         return reverse('blog:detailbyid', kwargs={
@@ -141,46 +148,183 @@ class Article(BaseModel):
             'day': self.creation_time.day
         })
 
-    @cache_decorator(60 * 60 * 10)
+    def get_excerpt(self):
+        """
+        Plain text start of the rendered body, stored in the search index
+        """
+        text = html.unescape(strip_tags(CommonMarkdown.get_markdown(self.body)))
+        return Truncator(' '.join(text.split())).chars(settings.SEARCH_EXCERPT_LENGTH)
+
+    @cache_decorator(60 * 60 * 10, depends_on=['blog.category'])
     def get_category_tree(self):
         tree = self.category.get_category_tree()
         names = list(map(lambda c: (c.name, c.get_absolute_url()), tree))
         return names
 
     def save(self, *args, **kwargs):
+        adding = self._state.adding
         super().save(*args, **kwargs)
+        if self.body and (adding or not self.summary):
+            # the summary is generated by manage.py run_enrichment_worker
+            from blog.enrichment import enqueue_summary
+            enqueue_summary(self)
 
     def viewed(self):
-        self.views += 1
-        self.save(update_fields=['views'])
+        from blog.viewcount import record_view
+        pending = record_view(self.id)
+        self.views += pending
 
     def comment_list(self):
         cache_key = 'article_comments_{id}'.format(id=self.id)
-        value = cache.get(cache_key)
+        value = get_cache(cache_key)
         if value:
             logger.info('get article comments:{id}'.format(id=self.id))
             return value
         else:
-            comments = self.comment_set.filter(is_enable=True).order_by('-id')
-            cache.set(cache_key, comments, 60 * 100)
+            comments = self.comment_set.filter(is_enable=True).select_related('author').order_by('-id')
+            set_cache(cache_key, comments, 60 * 100,
+                      depends_on=['comments.comment:article_id={id}'.format(id=self.id)])
             logger.info('set article comments:{id}'.format(id=self.id))
             return comments
 
+    def get_comment_count(self):
+        """
+        Enabled comments, annotated on articles from ArticleManager.get_cached_in_bulk
+        """
+        if hasattr(self, 'comment_count'):
+            return self.comment_count
+        return len(self.comment_list())
+
     def get_admin_url(self):
         info = (self._meta.app_label, self._meta.model_name)
         return reverse('admin:%s_%s_change' % info, args=(self.pk,))
 
-    @cache_decorator(expiration=60 * 100)
+    @cache_decorator(expiration=60 * 100, depends_on=['blog.article'])
     def next_article(self):
         # Next article
         return Article.objects.filter(id__gt=self.id, status='p').order_by('id').first()
 
-    @cache_decorator(expiration=60 * 100)
+    @cache_decorator(expiration=60 * 100, depends_on=['blog.article'])
     def prev_article(self):
         # Previous article
         return Article.objects.filter(id__lt=self.id, status='p').first()
 
 
+
+class ArticleEnrichmentJob(models.Model):
+    """Queued background work on an article, see blog/enrichment.py"""
+    SUMMARY = 's'
+    KIND_CHOICES = (
+        (SUMMARY, _('Summary')),
+    )
+    PENDING = 'p'
+    RUNNING = 'r'
+    DONE = 'd'
+    FAILED = 'f'
+    SKIPPED = 'k'
+    STATUS_CHOICES = (
+        (PENDING, _('Pending')),
+        (RUNNING, _('Running')),
+        (DONE, _('Done')),
+        (FAILED, _('Failed')),
+        (SKIPPED, _('Skipped')),
+    )
+    article = models.ForeignKey(Article, verbose_name=_('article'), on_delete=models.CASCADE)
+    kind = models.CharField(_('kind'), max_length=1, choices=KIND_CHOICES, default=SUMMARY)
+    # sha256 of the body the job was queued for
+    revision = models.CharField(_('revision'), max_length=64)
+    status = models.CharField(_('status'), max_length=1, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    run_after = models.DateTimeField(_('run after'), default=now)
+    locked_at = models.DateTimeField(_('locked at'), null=True, blank=True)
+    locked_by = models.CharField(_('locked by'), max_length=32, blank=True, default='')
+    last_error = models.TextField(_('last error'), blank=True, default='')
+    creation_time = models.DateTimeField(_('creation time'), default=now)
+    last_modify_time = models.DateTimeField(_('modify time'), default=now)
+
+    class Meta:
+        ordering = ['-id']
+        verbose_name = _('article enrichment job')
+        verbose_name_plural = verbose_name
+        constraints = [
+            models.UniqueConstraint(fields=['article', 'kind', 'revision'], name='unique_enrichment_revision'),
+        ]
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return '{kind} of {article}'.format(kind=self.get_kind_display(), article=self.article_id)
+
+    def finish(self, status, error='', update_fields=()):
+        self.status = status
+        self.last_error = error
+        self.locked_by = ''
+        self.last_modify_time = now()
+        self.save(update_fields=['status', 'last_error', 'locked_by', 'last_modify_time'] + list(update_fields))
+
+    def retry(self, run_after, error=''):
+        self.run_after = run_after
+        self.finish(self.PENDING, error, update_fields=['run_after'])
+
+
+
+class SearchQueueItem(models.Model):
+    """An indexed object that changed, see djangoblog/search_queue.py"""
+    model = models.CharField(_('model'), max_length=100)
+    object_id = models.CharField(_('object id'), max_length=64)
+    creation_time = models.DateTimeField(_('creation time'), default=now)
+
+    class Meta:
+        ordering = ['id']
+        verbose_name = _('search queue item')
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return '{model}.{id}'.format(model=self.model, id=self.object_id)
+
+
+class SearchGeneration(models.Model):
+    """Write counter of a search connection, see djangoblog/search_cache.py"""
+    using = models.CharField(_('connection'), max_length=100, unique=True)
+    generation = models.PositiveBigIntegerField(_('generation'), default=0)
+
+    class Meta:
+        verbose_name = _('search generation')
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return '{using}.{generation}'.format(using=self.using, generation=self.generation)
+
+
+class CategoryManager(models.Manager):
+    def get_article_counts(self):
+        """
+        Article count of every category including its descendant categories,
+        from one GROUP BY over the closure table
+        :return: {category id: count}
+        """
+
+        def compute():
+            return dict(self.annotate(
+                article_count=models.Count('descendant_paths__descendant__article')).values_list(
+                'id', 'article_count'))
+
+        return get_or_compute_cache('category_article_counts', compute, 60 * 60 * 10,
+                                    depends_on=['blog.category', 'blog.article'])
+
+    def get_tree(self):
+        """
+        All categories as a forest from one query, children are in `.children`
+        :return: root categories
+        """
+        categorys = list(self.all())
+        children = {}
+        for category in categorys:
+            children.setdefault(category.parent_category_id, []).append(category)
+        for category in categorys:
+            category.children = children.get(category.id, [])
+        return children.get(None, [])
+
+
 class Category(BaseModel):
     """Article category"""
     name = models.CharField(_('category name'), max_length=30, unique=True)
@@ -188,6 +332,8 @@ class Category(BaseModel):
     slug = models.SlugField(default='no-slug', max_length=60, blank=True)
     index = models.IntegerField(default=0, verbose_name=_('index'))
 
+    objects = CategoryManager()
+
     class Meta:
         ordering = ['-index']
         verbose_name = _('category')
@@ -199,40 +345,109 @@ class Category(BaseModel):
     def __str__(self):
         return self.name
 
-    @cache_decorator(60 * 60 * 10)
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        old_parent_id = None
+        if not adding:
+            old_parent_id = Category.objects.filter(pk=self.pk).values_list(
+                'parent_category_id', flat=True).first()
+        super().save(*args, **kwargs)
+        if adding:
+            CategoryClosure.add_leaf(self)
+        elif old_parent_id != self.parent_category_id:
+            CategoryClosure.rebuild()
+        else:
+            return
+        # post_save fired before the closure rows changed
+        from djangoblog.cache_dependency import invalidate_dependencies
+        invalidate_dependencies(Category)
+
+    @cache_decorator(60 * 60 * 10, depends_on=['blog.category'])
     def get_category_tree(self):
         """
-        Recursively get parent categories
+        Get the category and its parent categories, nearest first
         """
-        categorys = []
+        return list(Category.objects.filter(
+            descendant_paths__descendant=self).order_by('descendant_paths__depth'))
 
-        def parse(category):
-            categorys.append(category)
-            if category.parent_category:
-                parse(category.parent_category)
+    @cache_decorator(60 * 60 * 10, depends_on=['blog.category'])
+    def get_sub_categorys(self):
+        """
+        Get the category and all of its subcategories
+        """
+        return list(Category.objects.filter(
+            ancestor_paths__ancestor=self).order_by('ancestor_paths__depth'))
 
-        parse(self)
-        return categorys
+    def get_subtree_articles(self):
+        """
+        Articles in this category or any subcategory, one join through the closure table
+        """
+        return Article.objects.filter(category__ancestor_paths__ancestor=self)
 
-    @cache_decorator(60 * 60 * 10)
-    def get_sub_categorys(self):
+    def get_article_count(self):
+        return Category.objects.get_article_counts().get(self.id, 0)
+
+
+class CategoryClosure(models.Model):
+    """
+    Closure table of the category tree: one row per (ancestor, descendant)
+    pair, including each category with itself at depth 0.
+    Maintained by Category.save; deletes cascade.
+    """
+    ancestor = models.ForeignKey(Category, related_name='descendant_paths', on_delete=models.CASCADE)
+    descendant = models.ForeignKey(Category, related_name='ancestor_paths', on_delete=models.CASCADE)
+    depth = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = (('ancestor', 'descendant'),)
+        indexes = [models.Index(fields=['descendant', 'depth'])]
+
+    @staticmethod
+    def add_leaf(category):
+        paths = [CategoryClosure(ancestor_id=category.id, descendant_id=category.id, depth=0)]
+        if category.parent_category_id:
+            paths.extend(
+                CategoryClosure(ancestor_id=ancestor_id, descendant_id=category.id, depth=depth + 1)
+                for ancestor_id, depth in CategoryClosure.objects.filter(
+                    descendant_id=category.parent_category_id).values_list('ancestor_id', 'depth'))
+        CategoryClosure.objects.bulk_create(paths)
+
+    @staticmethod
+    def build_paths(parents):
+        """
+        :param parents: {category id: parent category id}
         """
-        Get all subcategories of the current category
+        paths = []
+        for pk in parents:
+            ancestor_id, depth, seen = pk, 0, set()
+            while ancestor_id is not None and ancestor_id not in seen:
+                seen.add(ancestor_id)
+                paths.append(CategoryClosure(ancestor_id=ancestor_id, descendant_id=pk, depth=depth))
+                ancestor_id = parents.get(ancestor_id)
+                depth += 1
+        return paths
+
+    @staticmethod
+    def rebuild():
+        parents = dict(Category.objects.values_list('id', 'parent_category_id'))
+        with transaction.atomic():
+            CategoryClosure.objects.all().delete()
+            CategoryClosure.objects.bulk_create(CategoryClosure.build_paths(parents), batch_size=1000)
+
+
+class TagManager(models.Manager):
+    def get_article_counts(self):
+        """
+        Article count of every tag from one GROUP BY query
+        :return: {tag id: count}
         """
-        categorys = []
-        all_categorys = Category.objects.all()
 
-        def parse(category):
-            if category not in categorys:
-                categorys.append(category)
-            childs = all_categorys.filter(parent_category=category)
-            for child in childs:
-                if category not in categorys:
-                    categorys.append(child)
-                parse(child)
+        def compute():
+            return dict(self.annotate(article_count=models.Count('article', distinct=True)).values_list(
+                'id', 'article_count'))
 
-        parse(self)
-        return categorys
+        return get_or_compute_cache('tag_article_counts', compute, 60 * 60 * 10,
+                                    depends_on=['blog.tag', 'blog.article'])
 
 
 class Tag(BaseModel):
@@ -240,15 +455,16 @@ class Tag(BaseModel):
     name = models.CharField(_('tag name'), max_length=30, unique=True)
     slug = models.SlugField(default='no-slug', max_length=60, blank=True)
 
+    objects = TagManager()
+
     def __str__(self):
         return self.name
 
     def get_absolute_url(self):
         return reverse('blog:tag_detail', kwargs={'tag_name': self.slug})
 
-    @cache_decorator(60 * 60 * 10)
     def get_article_count(self):
-        return Article.objects.filter(tags__name=self.name).distinct().count()
+        return Tag.objects.get_article_counts().get(self.id, 0)
 
     class Meta:
         ordering = ['name']
@@ -324,8 +540,3 @@ class BlogSettings(models.Model):
     def clean(self):
         if BlogSettings.objects.exclude(id=self.id).count():
             raise ValidationError(_('There can only be one configuration'))
-
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        from djangoblog.utils import cache
-        cache.clear()
@@ -0,0 +1,136 @@
+"""
+Pagination helpers for the article and comment lists.
+
+KeysetPaginator seeks from the last row of the previous page with a
+composite WHERE on the ordering columns instead of OFFSET, so deep pages
+cost the same as the first one and no COUNT is needed.
+CachedListPaginator pages over a cached id list and count.
+"""
+import base64
+import json
+
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+def encode_cursor(values):
+    data = json.dumps([v.isoformat() if hasattr(v, 'isoformat') else v for v in values])
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, fields):
+    """
+    :param fields: model fields the cursor values belong to
+    :return: list of values, None if the cursor is invalid
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        if not isinstance(values, list) or len(values) != len(fields):
+            return None
+        return [field.to_python(value) for field, value in zip(fields, values)]
+    except Exception:
+        return None
+
+
+class KeysetPage:
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        # set by the view, the pagination template uses them as is
+        self.next_url = ''
+        self.previous_url = ''
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+
+class KeysetPaginator:
+    def __init__(self, queryset, per_page, ordering):
+        """
+        :param ordering: unique ordering, e.g. ['-article_order', '-pub_time', '-id']
+        """
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = list(ordering)
+        opts = queryset.model._meta
+        self.names = [o.lstrip('-') for o in self.ordering]
+        self.fields = [opts.pk if n in ('pk', opts.pk.name) else opts.get_field(n) for n in self.names]
+
+    def _seek(self, values, forward):
+        """
+        Rows after values in ordering direction (forward) or before them
+        """
+        condition = Q()
+        for i, (order, name) in enumerate(zip(self.ordering, self.names)):
+            descending = order.startswith('-')
+            lookup = 'lt' if descending == forward else 'gt'
+            term = Q(**{'%s__%s' % (name, lookup): values[i]})
+            for prev_name, prev_value in zip(self.names[:i], values[:i]):
+                term &= Q(**{prev_name: prev_value})
+            condition |= term
+        return condition
+
+    def cursor_for(self, obj):
+        return encode_cursor([getattr(obj, field.attname) for field in self.fields])
+
+    def page(self, cursor=None, before=None):
+        """
+        :param cursor: page starts after this cursor
+        :param before: page ends before this cursor
+        """
+        before_values = decode_cursor(before, self.fields) if before else None
+        after_values = decode_cursor(cursor, self.fields) if cursor and not before_values else None
+        queryset = self.queryset
+        if before_values:
+            reverse_ordering = [o[1:] if o.startswith('-') else '-' + o for o in self.ordering]
+            rows = list(queryset.filter(self._seek(before_values, False))
+                        .order_by(*reverse_ordering)[:self.per_page + 1])
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page][::-1]
+            has_next = True
+        else:
+            if after_values:
+                queryset = queryset.filter(self._seek(after_values, True))
+            rows = list(queryset.order_by(*self.ordering)[:self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            has_previous = after_values is not None
+        next_cursor = self.cursor_for(rows[-1]) if rows and has_next else None
+        previous_cursor = self.cursor_for(rows[0]) if rows and has_previous else None
+        return KeysetPage(rows, has_next, has_previous, next_cursor, previous_cursor)
+
+
+class CachedListPaginator(Paginator):
+    """
+    Paginator for a cached list entry: the total count is known up front and
+    the rows of the requested page are supplied by the caller
+    """
+
+    def __init__(self, count, per_page, **kwargs):
+        super().__init__((), per_page, **kwargs)
+        self._count = count
+
+    @cached_property
+    def count(self):
+        return self._count
+
+    def page_with(self, number, object_list):
+        number = self.validate_number(number)
+        return self._get_page(object_list, number, self)
@@ -5,9 +5,20 @@ from blog.models import Article
 
 class ArticleIndex(indexes.SearchIndex, indexes.Indexable):
     text = indexes.CharField(document=True, use_template=True)
+    # stored only, the search page renders from them without loading articles
+    title = indexes.CharField(model_attr='title', indexed=False)
+    url = indexes.CharField(indexed=False)
+    pub_time = indexes.DateTimeField(model_attr='pub_time', indexed=False)
+    excerpt = indexes.CharField(indexed=False)
 
     def get_model(self):
         return Article
 
+    def prepare_url(self, obj):
+        return obj.get_absolute_url()
+
+    def prepare_excerpt(self, obj):
+        return obj.get_excerpt()
+
     def index_queryset(self, using=None):
         return self.get_model().objects.filter(status='p')
@@ -72,7 +72,23 @@ $(document).on('webkitAnimationEnd', function () {
 });
 
 
+// page render time, sent by OnlineMiddleware as the Server-Timing header
+function show_load_time() {
+  var target = document.getElementById("load-time");
+  if (!target || !window.performance || !performance.getEntriesByType) {
+    return;
+  }
+  var navigation = performance.getEntriesByType("navigation")[0];
+  var timings = (navigation && navigation.serverTiming) || [];
+  for (var i = 0; i < timings.length; i++) {
+    if (timings[i].name === "app") {
+      target.textContent = "| This page took " + (timings[i].duration / 1000).toFixed(3) + "s to load";
+    }
+  }
+}
+
 window.onload = function () {
+  show_load_time();
   var replyLinks = document.querySelectorAll(".comment-reply-link");
   for (var i = 0; i < replyLinks.length; i++) {
     replyLinks[i].onclick = function () {
@@ -88,4 +104,24 @@ window.onload = function () {
 //     selector.on('change', function () {
 //         form.submit();
 //     });
-// });
\ No newline at end of file
+// });
+/** 搜索框联想 */
+var searchInput = $('#q');
+
+searchInput.on('input', debounce(function () {
+    var query = searchInput.val().trim();
+    var suggestions = $('#q-suggestions');
+    if (!query) {
+        suggestions.empty();
+        return;
+    }
+    $.getJSON(searchInput.data('autocomplete-url'), {q: query}, function (data) {
+        if (data.query !== searchInput.val().trim()) {
+            return;
+        }
+        suggestions.empty();
+        $.each(data.suggestions, function (i, suggestion) {
+            suggestions.append($('<option>').attr('value', suggestion.text));
+        });
+    });
+}, 150));
@@ -3,7 +3,6 @@ import logging
 import random
 import urllib
 
-from django import template
 from django.conf import settings
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
@@ -12,16 +11,18 @@ from django.templatetags.static import static
 from django.urls import reverse
 from django.utils.safestring import mark_safe
 
-from blog.models import Article, Category, Tag, Links, SideBar, LinkShowType
+from blog.models import Article, Category, Tag, Links, SideBar, LinkShowType, BlogSettings
+from blog.pagination import KeysetPage
 from comments.models import Comment
-from djangoblog.utils import CommonMarkdown, sanitize_html
-from djangoblog.utils import cache
+from djangoblog.cache_dependency import get_cache, get_dependency_version, set_cache
+from djangoblog.instrumentation import TimedLibrary
+from djangoblog.utils import CommonMarkdown, get_or_compute_cache, sanitize_html
 from djangoblog.utils import get_current_site
 from oauth.models import OAuthUser
 
 logger = logging.getLogger(__name__)
 
-register = template.Library()
+register = TimedLibrary()
 
 
 @register.simple_tag
@@ -113,10 +114,11 @@ def load_articletags(article):
     :return:
     """
     tags = article.tags.all()
+    counts = Tag.objects.get_article_counts()
     tags_list = []
     for tag in tags:
         url = tag.get_absolute_url()
-        count = tag.get_article_count()
+        count = counts.get(tag.id, 0)
         tags_list.append((
             url, count, tag, random.choice(settings.BOOTSTRAP_COLOR_TYPES)
         ))
@@ -125,64 +127,97 @@ def load_articletags(article):
     }
 
 
+def get_most_read_articles(count):
+    """
+    Most read articles, with views still buffered in blog.viewcount merged in
+    """
+    from blog.viewcount import get_pending_views
+    candidates = list(Article.objects.filter(status='p').order_by('-views')[:count * 2])
+    pending = get_pending_views([a.id for a in candidates])
+    for article in candidates:
+        article.views += pending.get(article.id, 0)
+    candidates.sort(key=lambda a: a.views, reverse=True)
+    return candidates[:count]
+
+
+SIDEBAR_CACHE_TIMEOUT = 60 * 60 * 60 * 3
+# buffered view counts are flushed without signals, so most-read expires on its own
+SIDEBAR_MOST_READ_TIMEOUT = 60 * 10
+
+
+def get_sidebar_fragment(name, compute, depends_on, timeout=SIDEBAR_CACHE_TIMEOUT):
+    """
+    Cache one sidebar fragment under sidebar_<name>, invalidated only by depends_on
+    """
+    return get_or_compute_cache('sidebar_' + name, compute, timeout,
+                                depends_on=list(depends_on) + [BlogSettings])
+
+
+def get_sidebar_tags():
+    """
+    Tag cloud, counts come from Tag.objects.get_article_counts.
+    Size = (count / average) * step
+    """
+    increment = 5
+    tags = list(Tag.objects.all())
+    if not tags:
+        return None
+    counts = Tag.objects.get_article_counts()
+    s = [(t, counts[t.id]) for t in tags if counts.get(t.id)]
+    count = sum([t[1] for t in s])
+    dd = 1 if count == 0 else count / len(tags)
+    sidebar_tags = list(
+        map(lambda x: (x[0], x[1], (x[1] / dd) * increment + 10), s))
+    random.shuffle(sidebar_tags)
+    return sidebar_tags
+
+
 @register.inclusion_tag('blog/tags/sidebar.html')
 def load_sidebar(user, linktype):
     """
-    Load sidebar
+    Load sidebar. Every section is cached separately so a new comment or link
+    does not rebuild the others.
     :return:
     """
-    value = cache.get("sidebar" + linktype)
-    if value:
-        value['user'] = user
-        return value
-    else:
-        logger.info('load sidebar')
-        from djangoblog.utils import get_blog_setting
-        blogsetting = get_blog_setting()
-        recent_articles = Article.objects.filter(
-            status='p')[:blogsetting.sidebar_article_count]
-        sidebar_categorys = Category.objects.all()
-        extra_sidebars = SideBar.objects.filter(
-            is_enable=True).order_by('sequence')
-        most_read_articles = Article.objects.filter(status='p').order_by(
-            '-views')[:blogsetting.sidebar_article_count]
-        dates = Article.objects.datetimes('creation_time', 'month', order='DESC')
-        links = Links.objects.filter(is_enable=True).filter(
-            Q(show_type=str(linktype)) | Q(show_type=LinkShowType.A))
-        commment_list = Comment.objects.filter(is_enable=True).order_by(
-            '-id')[:blogsetting.sidebar_comment_count]
-        # Tag cloud font size calculation
-        # Size = (count / average) * step
-        increment = 5
-        tags = Tag.objects.all()
-        sidebar_tags = None
-        if tags and len(tags) > 0:
-            s = [t for t in [(t, t.get_article_count()) for t in tags] if t[1]]
-            count = sum([t[1] for t in s])
-            dd = 1 if (count == 0 or not len(tags)) else count / len(tags)
-            import random
-            sidebar_tags = list(
-                map(lambda x: (x[0], x[1], (x[1] / dd) * increment + 10), s))
-            random.shuffle(sidebar_tags)
-
-        value = {
-            'recent_articles': recent_articles,
-            'sidebar_categorys': sidebar_categorys,
-            'most_read_articles': most_read_articles,
-            'article_dates': dates,
-            'sidebar_comments': commment_list,
-            'sidabar_links': links,
-            'show_google_adsense': blogsetting.show_google_adsense,
-            'google_adsense_codes': blogsetting.google_adsense_codes,
-            'open_site_comment': blogsetting.open_site_comment,
-            'show_gongan_code': blogsetting.show_gongan_code,
-            'sidebar_tags': sidebar_tags,
-            'extra_sidebars': extra_sidebars
-        }
-        cache.set("sidebar" + linktype, value, 60 * 60 * 60 * 3)
-        logger.info('set sidebar cache.key:{key}'.format(key="sidebar" + linktype))
-        value['user'] = user
-        return value
+    from djangoblog.utils import get_blog_setting
+    blogsetting = get_blog_setting()
+    article_count = blogsetting.sidebar_article_count
+    comment_count = blogsetting.sidebar_comment_count
+    return {
+        'recent_articles': get_sidebar_fragment(
+            'recent_articles',
+            lambda: list(Article.objects.filter(status='p')[:article_count]),
+            [Article]),
+        'sidebar_categorys': get_sidebar_fragment(
+            'categorys', lambda: list(Category.objects.all()), [Category]),
+        'most_read_articles': get_sidebar_fragment(
+            'most_read_articles', lambda: get_most_read_articles(article_count),
+            [Article], SIDEBAR_MOST_READ_TIMEOUT),
+        'article_dates': get_sidebar_fragment(
+            'article_dates',
+            lambda: list(Article.objects.datetimes('creation_time', 'month', order='DESC')),
+            [Article]),
+        'sidebar_comments': get_sidebar_fragment(
+            'comments',
+            lambda: list(Comment.objects.filter(is_enable=True).select_related(
+                'author', 'article').order_by('-id')[:comment_count]),
+            [Comment, Article]),
+        'sidabar_links': get_sidebar_fragment(
+            'links_' + str(linktype),
+            lambda: list(Links.objects.filter(is_enable=True).filter(
+                Q(show_type=str(linktype)) | Q(show_type=LinkShowType.A))),
+            [Links]),
+        'show_google_adsense': blogsetting.show_google_adsense,
+        'google_adsense_codes': blogsetting.google_adsense_codes,
+        'open_site_comment': blogsetting.open_site_comment,
+        'show_gongan_code': blogsetting.show_gongan_code,
+        'sidebar_tags': get_sidebar_fragment('tags', get_sidebar_tags, [Tag, Article]),
+        'extra_sidebars': get_sidebar_fragment(
+            'extra_sidebars',
+            lambda: list(SideBar.objects.filter(is_enable=True).order_by('sequence')),
+            [SideBar]),
+        'user': user,
+    }
 
 
 @register.inclusion_tag('blog/tags/article_meta_info.html')
@@ -200,6 +235,13 @@ def load_article_metas(article, user):
 
 @register.inclusion_tag('blog/tags/article_pagination.html')
 def load_pagination_info(page_obj, page_type, tag_name):
+    if isinstance(page_obj, KeysetPage):
+        # cursor urls are built by the view
+        return {
+            'previous_url': page_obj.previous_url,
+            'next_url': page_obj.next_url,
+            'page_obj': page_obj
+        }
     previous_url = ''
     next_url = ''
     if page_type == '':
@@ -283,6 +325,8 @@ def load_article_detail(article, isindex, user):
         'isindex': isindex,
         'user': user,
         'open_site_comment': blogsetting.open_site_comment,
+        # part of the key of the `breadcrumb` template fragment cache
+        'breadcrumb_version': '' if isindex else get_dependency_version(article, Category, BlogSettings),
     }
 
 
@@ -292,7 +336,7 @@ def load_article_detail(article, isindex, user):
 def gravatar_url(email, size=40):
     """Get gravatar avatar"""
     cachekey = 'gravatat/' + email
-    url = cache.get(cachekey)
+    url = get_cache(cachekey)
     if url:
         return url
     else:
@@ -307,7 +351,7 @@ def gravatar_url(email, size=40):
 
         url = "https://www.gravatar.com/avatar/%s?%s" % (hashlib.md5(
             email.lower()).hexdigest(), urllib.parse.urlencode({'d': default, 's': str(size)}))
-        cache.set(cachekey, url, 60 * 60 * 10)
+        set_cache(cachekey, url, 60 * 60 * 10, depends_on=[OAuthUser])
         logger.info('set gravatar cache.key:{key}'.format(key=cachekey))
         return url
 
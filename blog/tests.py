@@ -1,30 +1,74 @@
+import json
 import os
+import pickle
+import queue
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
 import requests
 
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.core.paginator import Paginator
+from django.db import transaction
+from django.dispatch import receiver
+from django.template import Context, Engine
 from django.templatetags.static import static
-from django.test import Client, RequestFactory, TestCase
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.test.signals import setting_changed
 from django.urls import reverse
 from django.utils import timezone
+from haystack import connections as haystack_connections
+from haystack.query import SearchQuerySet
 
 from accounts.models import BlogUser
+from blog import viewcount
+from blog.autocomplete import VERSION_CACHE_KEY, prefix_index
+from blog.enrichment import process_jobs
 from blog.forms import BlogSearchForm
-from blog.models import Article, Category, Tag, SideBar, Links
-from blog.templatetags.blog_tags import load_pagination_info, load_articletags
-from djangoblog.utils import get_current_site, get_sha256, save_user_avatar, send_email
+from blog.models import Article, ArticleEnrichmentJob, Category, Tag, SearchGeneration, SearchQueueItem, SideBar, Links
+from blog.pagination import KeysetPaginator
+from blog.templatetags.blog_tags import load_pagination_info, load_articletags, load_sidebar
+from blog.viewcount import flush_view_counts, get_pending_views, get_view_count_key
+from comments.models import Comment
+from djangoblog.cache_dependency import get_cache, get_tag_versions
+from djangoblog.instrumentation import QueryBudgetTestMixin, QueryRecorder, TimedLibrary, get_recent_requests
+from djangoblog.search_cache import bump_generation, get_generation, normalize_query
+from djangoblog.search_queue import SearchWriter
+from djangoblog.sitemap import ArticleSiteMap
+from djangoblog.utils import cache, get_current_site, get_sha256, save_user_avatar, send_email
 from djangoblog.spider_notify import SpiderNotify
+from djangoblog.whoosh_cn_backend import ChineseAnalyzer, cached_jieba_tokens, preload_jieba
 from oauth.models import OAuthUser, OAuthConfig
+from servermanager.models import EmailSendLog
 from blog.templatetags.blog_tags import gravatar_url, gravatar
-from blog.documents import ELASTICSEARCH_ENABLED
+from blog.documents import ELASTICSEARCH_ENABLED, ElapsedTimeShipper, ElaspedTimeDocumentManager
+
+
+@receiver(setting_changed)
+def reload_search_connections(setting, value, **kwargs):
+    # haystack reads HAYSTACK_CONNECTIONS once, on import
+    if setting == 'HAYSTACK_CONNECTIONS':
+        haystack_connections.connections_info = value
+        for alias in value:
+            haystack_connections.reload(alias)
 
 
-class ArticleTest(TestCase):
+class ArticleTest(QueryBudgetTestMixin, TestCase):
     def setUp(self):
         self.client = Client()
         self.factory = RequestFactory()
+        # an empty whoosh index per test instead of djangoblog/whoosh_index
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path, ignore_errors=True)
+        search_index = override_settings(HAYSTACK_CONNECTIONS={
+            'default': dict(settings.HAYSTACK_CONNECTIONS['default'], PATH=path)})
+        search_index.enable()
+        self.addCleanup(search_index.disable)
         self.user = BlogUser.objects.get_or_create(
             email="liangliangyy@gmail.com",
             username="liangliangyy")[0]
@@ -179,3 +223,577 @@ class ArticleTest(TestCase):
         call_command("clear_cache")
         call_command("sync_user_avatar")
         call_command("build_search_words")
+
+    def test_view_count_buffer(self):
+        """Views are buffered in the cache and flushed in bulk."""
+        category = Category.objects.create(name="View Category")
+        article = Article.objects.create(title="View Title", body="View Content", author=self.user,
+                                         category=category, type='a', status='p')
+        # ids are reused between tests, drop views buffered by an earlier one
+        cache.delete(get_view_count_key(article.id))
+        for _ in range(3):
+            self.assertEqual(self.client.get(article.get_absolute_url()).status_code, 200)
+        self.assertEqual(Article.objects.get(pk=article.pk).views, 0)
+        self.assertEqual(get_pending_views([article.id]), {article.id: 3})
+
+        # nothing is subtracted when the UPDATE fails, the article is flushed again next time
+        with mock.patch('django.db.models.query.QuerySet.update', side_effect=IOError('database gone')):
+            with self.assertRaises(IOError):
+                flush_view_counts([article.id])
+        self.assertEqual(get_pending_views([article.id]), {article.id: 3})
+        self.assertIn(article.id, viewcount._dirty_ids)
+
+        self.assertEqual(flush_view_counts([article.id]), 3)
+        self.assertEqual(Article.objects.get(pk=article.pk).views, 3)
+        self.assertEqual(get_pending_views([article.id]), {})
+        err = StringIO()
+        call_command("flush_view_counts", stdout=StringIO(), stderr=err)
+        self.assertEqual(Article.objects.get(pk=article.pk).views, 3)
+        self.assertIn('local to each process', err.getvalue())
+
+    def test_elapsed_time_shipper_backpressure(self):
+        """The performance queue drops records instead of blocking when full."""
+        shipper = ElapsedTimeShipper()
+        shipper.queue = queue.Queue(maxsize=2)
+        with mock.patch.object(shipper, '_ensure_thread'):
+            results = [shipper.submit('/', 1.0, timezone.now(), 'ua', '127.0.0.1') for _ in range(3)]
+        self.assertEqual(results, [True, True, False])
+        self.assertEqual(shipper.dropped, 1)
+        records = shipper.drain(block=False)
+        self.assertEqual(len(records), 2)
+
+        with mock.patch.object(ElaspedTimeDocumentManager, 'build_index'), \
+                mock.patch('blog.documents.connections.get_connection'), \
+                mock.patch('elasticsearch.helpers.bulk', return_value=(2, [])) as bulk:
+            shipper.ship(records)
+        # documents of one batch share a millisecond, elasticsearch assigns their ids
+        self.assertTrue(all('_id' not in action for action in bulk.call_args[0][1]))
+
+    def test_sidebar_fragments(self):
+        """Sidebar sections are cached separately and invalidated independently."""
+        category = Category.objects.create(name="Sidebar Category")
+        tag = Tag.objects.create(name="Sidebar Tag")
+        Tag.objects.create(name="Unused Tag")
+        article = Article.objects.create(title="Sidebar Title", body="Sidebar Content", author=self.user,
+                                         category=category, type='a', status='p')
+        article.tags.add(tag)
+        value = load_sidebar(self.user, 'i')
+        self.assertEqual([(t[0], t[1]) for t in value['sidebar_tags']], [(tag, 1)])
+        self.assertIsNotNone(get_cache('sidebar_tags'))
+        self.assertIsNotNone(get_cache('sidebar_categorys'))
+
+        Links.objects.create(sequence=99, name="sidebar link", link='https://www.lylinux.net')
+        self.assertIsNone(get_cache('sidebar_links_i'))
+        self.assertIsNotNone(get_cache('sidebar_tags'))
+        self.assertIsNotNone(get_cache('sidebar_categorys'))
+        with self.assertNumQueries(1):
+            value = load_sidebar(self.user, 'i')
+        self.assertEqual(len(value['sidabar_links']), 1)
+
+    def test_article_counts(self):
+        """Tag and category counts come from one cached GROUP BY each."""
+        parent = Category.objects.create(name="Count Parent")
+        child = Category.objects.create(name="Count Child", parent_category=parent)
+        tag = Tag.objects.create(name="Count Tag")
+        for i in range(3):
+            article = Article.objects.create(title=f"Count Title {i}", body="Count Content", author=self.user,
+                                             category=child if i else parent, type='a', status='p')
+            article.tags.add(tag)
+        self.assertEqual(Tag.objects.get_article_counts()[tag.id], 3)
+        counts = Category.objects.get_article_counts()
+        self.assertEqual(counts[parent.id], 3)
+        self.assertEqual(counts[child.id], 2)
+        with self.assertNumQueries(0):
+            self.assertEqual(tag.get_article_count(), 3)
+            self.assertEqual(child.get_article_count(), 2)
+        article.tags.remove(tag)
+        self.assertEqual(tag.get_article_count(), 2)
+
+    def test_category_closure(self):
+        """The closure table follows category creation and re-parenting."""
+        root = Category.objects.create(name="Closure Root")
+        child = Category.objects.create(name="Closure Child", parent_category=root)
+        leaf = Category.objects.create(name="Closure Leaf", parent_category=child)
+        other = Category.objects.create(name="Closure Other")
+        Article.objects.create(title="Closure Title", body="Closure Content", author=self.user,
+                               category=leaf, type='a', status='p')
+
+        self.assertEqual(leaf.get_category_tree(), [leaf, child, root])
+        self.assertEqual(root.get_sub_categorys(), [root, child, leaf])
+        self.assertEqual(root.get_subtree_articles().count(), 1)
+
+        child.parent_category = other
+        child.save()
+        self.assertEqual(leaf.get_category_tree(), [leaf, child, other])
+        self.assertEqual(root.get_sub_categorys(), [root])
+        self.assertEqual(other.get_subtree_articles().count(), 1)
+        self.assertEqual(Category.objects.get_article_counts()[other.id], 1)
+        self.assertEqual(self.client.get(other.get_absolute_url()).status_code, 200)
+
+    def test_keyset_pagination(self):
+        """Cursor pages walk the same rows as offset pages, forwards and backwards."""
+        category = Category.objects.create(name="Keyset Category")
+        for i in range(settings.PAGINATE_BY + 2):
+            Article.objects.create(title="Keyset Title " + str(i), body="Keyset Content", author=self.user,
+                                   category=category, type='a', status='p', article_order=i % 2)
+        queryset = Article.objects.filter(category=category)
+        ordering = ['-article_order', '-pub_time', '-id']
+        expected = list(queryset.order_by(*ordering))
+        paginator = KeysetPaginator(queryset, 3, ordering)
+
+        seen = []
+        pages = []
+        page = paginator.page()
+        while True:
+            pages.append(page)
+            seen.extend(page.object_list)
+            if not page.has_next():
+                break
+            page = paginator.page(cursor=page.next_cursor)
+        self.assertEqual(seen, expected)
+        self.assertFalse(pages[0].has_previous())
+        self.assertEqual(paginator.page(before=pages[-1].previous_cursor).object_list, pages[-2].object_list)
+        self.assertEqual(paginator.page(cursor='not-a-cursor').object_list, pages[0].object_list)
+
+        response = self.client.get(category.get_absolute_url() + '?cursor=')
+        self.assertEqual(response.status_code, 200)
+        next_url = response.context['page_obj'].next_url
+        self.assertIn('cursor=', next_url)
+        response = self.client.get(next_url)
+        self.assertEqual(list(response.context['article_list']), expected[settings.PAGINATE_BY:])
+
+    def test_list_cache_entries(self):
+        """List pages cache page ids and counts, rows come from the article object cache."""
+        category = Category.objects.create(name="List Cache Category")
+        for i in range(settings.PAGINATE_BY + 3):
+            Article.objects.create(title="List Cache Title " + str(i), body="List Cache Content" * 500,
+                                   author=self.user, category=category, type='a', status='p')
+        response = self.client.get(reverse('blog:index_page', kwargs={'page': 2}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['paginator'].count, settings.PAGINATE_BY + 3)
+
+        entry = get_cache('index_2')
+        self.assertEqual(entry.value['count'], settings.PAGINATE_BY + 3)
+        self.assertEqual(entry.value['ids'], [a.id for a in response.context['article_list']])
+        self.assertLess(len(pickle.dumps(entry)), 1024)
+
+        ids = entry.value['ids']
+        with self.assertNumQueries(0):
+            articles = Article.objects.get_cached_in_bulk(ids)
+        self.assertEqual([a.id for a in articles], ids)
+        self.assertEqual(articles[0].category.name, "List Cache Category")
+
+        cache.delete_many([Article.objects.OBJECT_CACHE_PREFIX + str(i) for i in ids])
+        with mock.patch.object(cache, 'set_many', wraps=cache.set_many) as set_many, \
+                mock.patch('djangoblog.cache_dependency.get_tag_versions',
+                           wraps=get_tag_versions) as tag_versions:
+            Article.objects.get_cached_in_bulk(ids)
+        set_many.assert_called_once()
+        self.assertEqual(len(set_many.call_args[0][0]), len(ids))
+        self.assertEqual(tag_versions.call_count, 1)
+
+        response = self.client.get(reverse('blog:archives'))
+        archived = response.context['article_list']
+        self.assertEqual(len(archived), settings.PAGINATE_BY + 3)
+        self.assertEqual(archived[0]['url'], Article.objects.get(pk=archived[0]['id']).get_absolute_url())
+        self.assertContains(response, archived[0]['url'])
+
+        Article.objects.get(pk=ids[0]).delete()
+        self.assertNotIn(ids[0], [a.id for a in Article.objects.get_cached_in_bulk(ids)])
+        self.assertEqual(self.client.get(reverse('blog:index_page', kwargs={'page': 5})).status_code, 404)
+
+    def test_page_cache(self):
+        """Anonymous pages are served from the page cache until something they show changes."""
+        category = Category.objects.create(name="Page Cache Category")
+        article = Article.objects.create(title="Page Cache Title", body="Page Cache Content", author=self.user,
+                                         category=category, type='a', status='p')
+        url = article.get_absolute_url()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertIn('blog.article:pk={id}'.format(id=article.id), response['Surrogate-Key'].split())
+        self.assertIn('s-maxage', response['Cache-Control'])
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        self.assertContains(response, "Page Cache Content")
+
+        article.body = "Page Cache Edited"
+        article.save()
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertContains(response, "Page Cache Edited")
+
+        self.client.get(category.get_absolute_url())
+        self.assertEqual(self.client.get(category.get_absolute_url())['X-Page-Cache'], 'HIT')
+        Article.objects.create(title="Page Cache Other", body="Page Cache Content", author=self.user,
+                               category=category, type='a', status='p')
+        self.assertEqual(self.client.get(category.get_absolute_url())['X-Page-Cache'], 'MISS')
+
+        # the sidebar and prev/next links of every page show the newest articles
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Page-Cache'], 'HIT')
+        Article.objects.create(title="Page Cache Newest", body="Page Cache Content", author=self.user,
+                               category=Category.objects.create(name="Page Cache Unrelated"), type='a', status='p')
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertContains(response, "Page Cache Newest")
+
+        self.client.login(username='liangliangyy', password='liangliangyy')
+        response = self.client.get(url)
+        self.assertFalse(response.has_header('X-Page-Cache'))
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_conditional_get(self):
+        """Pages carry Server-Timing and are answered 304 from cached validators."""
+        category = Category.objects.create(name="Conditional Category")
+        article = Article.objects.create(title="Conditional Title", body="Conditional Content", author=self.user,
+                                         category=category, type='a', status='p')
+        url = article.get_absolute_url()
+        response = self.client.get(url)
+        self.assertTrue(response['Server-Timing'].startswith('app;dur='))
+        self.assertNotContains(response, 'LOAD_TIMES')
+        self.assertTrue(response.has_header('Last-Modified'))
+        etag = response['ETag']
+        cache.delete(get_view_count_key(article.id))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(get_pending_views([article.id]), {article.id: 1})
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        article.body = "Conditional Edited"
+        article.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        for page_url in (category.get_absolute_url(), '/feed/', '/sitemap.xml', '/'):
+            response = self.client.get(page_url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.get(page_url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        # validators are answered before the view runs
+        response = self.client.get('/feed/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/feed/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        other = Article.objects.create(title="Conditional Other", body="Conditional Content", author=self.user,
+                                       category=category, type='a', status='p')
+        self.assertEqual(self.client.get('/feed/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+        # the index shows comment counts
+        etag = self.client.get('/')['ETag']
+        Comment.objects.create(body="Conditional Comment", author=self.user, article=article)
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        # unpublishing and deleting leave no newer published article behind
+        category_url = category.get_absolute_url()
+        etag = self.client.get(category_url)['ETag']
+        other.status = 'd'
+        other.save()
+        self.assertEqual(self.client.get(category_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        etag = self.client.get(category_url)['ETag']
+        other.delete()
+        self.assertEqual(self.client.get(category_url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_sitemap_shards(self):
+        """The sitemap index links streamed, paged sections."""
+        category = Category.objects.create(name="Sitemap Category")
+        articles = [Article.objects.create(title="Sitemap Title " + str(i), body="Sitemap Content",
+                                           author=self.user, category=category, type='a', status='p')
+                    for i in range(3)]
+        response = self.client.get('/sitemap.xml')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '/sitemap-blog.xml')
+        self.assertContains(response, '/sitemap-User.xml')
+
+        response = self.client.get('/sitemap-blog.xml')
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        for article in articles:
+            self.assertIn(article.get_absolute_url(), content)
+        content = b''.join(self.client.get('/sitemap-User.xml').streaming_content).decode('utf-8')
+        self.assertEqual(content.count(self.user.get_absolute_url()), 1)
+
+        ArticleSiteMap.limit = 2
+        try:
+            with self.assertNumQueries(2):
+                content = b''.join(self.client.get('/sitemap-blog.xml?p=2').streaming_content)
+            self.assertEqual(content.count(b'<url>'), 1)
+            self.assertEqual(self.client.get('/sitemap-blog.xml?p=3').status_code, 404)
+        finally:
+            del ArticleSiteMap.limit
+
+    def test_query_budgets(self):
+        """Listing pages stay within their query budget however many articles they show."""
+        category = Category.objects.create(name="Budget Category")
+        tags = [Tag.objects.create(name="Budget Tag " + str(i)) for i in range(3)]
+        for i in range(settings.PAGINATE_BY + 2):
+            article = Article.objects.create(title="Budget Title " + str(i), body="Budget Content",
+                                             author=self.user, category=category, type='a', status='p')
+            article.tags.add(*tags)
+            Comment.objects.create(body="Budget Comment", author=self.user, article=article, is_enable=True)
+        for url in ['/', '/page/2/', article.get_absolute_url(), category.get_absolute_url(),
+                    tags[0].get_absolute_url(), self.user.get_absolute_url(), '/archives.html', '/links.html']:
+            cache.clear()
+            self.assertEqual(self.assertWithinQueryBudget(url).status_code, 200)
+
+        with QueryRecorder() as recorder:
+            self.client.get('/')
+        self.assertFalse(recorder.get_duplicates(settings.QUERY_DUPLICATE_THRESHOLD))
+
+        library = TimedLibrary()
+
+        @library.simple_tag(takes_context=True)
+        def context_title(context):
+            return Article.objects.get(pk=context['article_id']).title
+
+        @library.simple_tag
+        def plain_upper(value):
+            return value.upper()
+
+        engine = Engine()
+        engine.template_libraries['timed'] = library
+        template = engine.from_string('{% load timed %}{% context_title %} {% plain_upper "x" %}')
+        with QueryRecorder() as recorder:
+            self.assertEqual(template.render(Context({'article_id': article.pk})), article.title + ' X')
+        self.assertEqual(recorder.tags['context_title'][0], 1)
+        self.assertEqual(recorder.tags['context_title'][2], 1)
+        self.assertEqual(recorder.tags['plain_upper'][0], 1)
+
+        with self.settings(QUERY_INSTRUMENTATION=True):
+            cache.clear()
+            response = self.client.get(category.get_absolute_url())
+            self.assertIn('db;dur=', response['Server-Timing'])
+            self.assertEqual(get_recent_requests()[0]['view_name'], 'blog:category_detail')
+            self.client.login(username='liangliangyy', password='liangliangyy')
+            response = self.client.get(reverse('admin:query_budget'))
+            self.assertContains(response, 'blog:category_detail')
+
+    def test_benchmark_command(self):
+        """The benchmark reports every endpoint and compares against a saved baseline."""
+        category = Category.objects.create(name="Benchmark Category")
+        tag = Tag.objects.create(name="Benchmark Tag")
+        article = Article.objects.create(title="Benchmark Title", body="Benchmark Content",
+                                         author=self.user, category=category, type='a', status='p')
+        article.tags.add(tag)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            out = StringIO()
+            call_command('benchmark', requests=3, warmup=1, save_baseline=path, first_search=True, stdout=out)
+            self.assertIn('first search ms: lazy', out.getvalue())
+            with open(path) as f:
+                baseline = json.load(f)
+            self.assertEqual(set(baseline), {'index', 'detail', 'category', 'tag', 'search', 'autocomplete', 'feed',
+                                             'sitemap', 'comment_post'})
+            self.assertEqual(baseline['autocomplete']['queries'], 0)
+            self.assertEqual(baseline['detail']['statuses'], [200])
+            self.assertEqual(baseline['comment_post']['statuses'], [302])
+            self.assertFalse(Comment.objects.filter(article=article).exists())
+            self.assertFalse(EmailSendLog.objects.exists())
+            self.assertGreaterEqual(baseline['detail']['p99_ms'], baseline['detail']['p50_ms'])
+
+            baseline['index']['queries'] = -1
+            with open(path, 'w') as f:
+                json.dump(baseline, f)
+            with self.assertRaisesMessage(CommandError, 'index queries'):
+                call_command('benchmark', endpoints=['index'], requests=2, warmup=0, baseline=path,
+                             tolerance=1000, stdout=StringIO())
+
+    def test_create_testdata_bulk(self):
+        """The generator inserts in batches, without per-article saves, and can be rerun."""
+        options = dict(articles=25, tags=6, tags_per_article=3, categories=2, category_depth=3, comments=2,
+                       users=3, seed=7, batch_size=10, stdout=StringIO())
+        call_command('create_testdata', **options)
+        articles = Article.objects.filter(title__startswith='nice title ')
+        self.assertEqual(articles.count(), 25)
+        self.assertEqual(Article.tags.through.objects.filter(article__in=articles).count(), 75)
+        self.assertEqual(Comment.objects.filter(article__in=articles).count(), 50)
+        self.assertFalse(articles.filter(summary='').exists())
+        self.assertEqual(BlogUser.objects.filter(username__startswith='testuser').count(), 2)
+        root = Category.objects.get(name='我是父类目')
+        self.assertEqual(Category.objects.get_article_counts()[root.id],
+                         articles.filter(category__parent_category__parent_category=root).count())
+
+        call_command('create_testdata', **dict(options, stdout=StringIO()))
+        self.assertEqual(articles.count(), 25)
+        self.assertEqual(Comment.objects.filter(article__in=articles).count(), 50)
+
+    def test_enrichment_jobs(self):
+        """Saving queues one summary job per body revision, the worker fills it in and retries failures."""
+
+        class FailingClient(object):
+            def summarize(self, text):
+                raise IOError('unreachable')
+
+        category = Category.objects.create(name="Summary Category")
+        with self.settings(ARTICLE_SUMMARY_CLIENT='blog.enrichment.StubSummaryClient'):
+            article = Article.objects.create(title="Summary Title", body="Summary Content",
+                                             author=self.user, category=category, type='a', status='p')
+            article.save()
+            job = ArticleEnrichmentJob.objects.get(article=article)
+            self.assertEqual(job.status, ArticleEnrichmentJob.PENDING)
+            self.assertEqual(Article.objects.get(pk=article.pk).summary, '')
+
+            call_command('run_enrichment_worker', once=True, stdout=StringIO())
+            job.refresh_from_db()
+            self.assertEqual(job.status, ArticleEnrichmentJob.DONE)
+            self.assertEqual(Article.objects.get(pk=article.pk).summary, 'Summary Content')
+            self.assertGreater(Article.objects.get(pk=article.pk).last_modify_time, article.last_modify_time)
+
+            article.body = "Summary Content changed"
+            article.summary = ''
+            article.save()
+            Article.objects.filter(pk=article.pk).update(body="Summary Content changed again")
+            self.assertEqual(process_jobs(), 1)
+            skipped = ArticleEnrichmentJob.objects.get(article=article, status=ArticleEnrichmentJob.SKIPPED)
+            self.assertEqual(skipped.attempts, 1)
+
+            article.refresh_from_db()
+            article.save()
+            self.assertEqual(process_jobs(client=FailingClient()), 1)
+            job = ArticleEnrichmentJob.objects.get(article=article, status=ArticleEnrichmentJob.PENDING)
+            self.assertGreater(job.run_after, timezone.now())
+            self.assertEqual(job.last_error, 'unreachable')
+            self.assertEqual(process_jobs(client=FailingClient()), 0)
+            with self.settings(ENRICHMENT_MAX_ATTEMPTS=2):
+                ArticleEnrichmentJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+                process_jobs(client=FailingClient())
+                job.refresh_from_db()
+                self.assertEqual(job.status, ArticleEnrichmentJob.FAILED)
+
+    def test_search_queue(self):
+        """Saves only queue the article, the writer indexes and removes it in batches."""
+        word = 'queueword'
+        category = Category.objects.create(name="Queue Category")
+        with self.settings(SEARCH_QUEUE_EAGER=False):
+            article = Article.objects.create(title="Queue Title", body=word + " content",
+                                             author=self.user, category=category, type='a', status='p')
+            article.save()
+            self.assertEqual(SearchQueueItem.objects.filter(object_id=str(article.pk)).count(), 2)
+            self.assertEqual(SearchQuerySet().filter(content=word).count(), 0)
+
+            with SearchWriter(batch_size=1) as writer:
+                self.assertEqual(writer.drain(), 2)
+            self.assertFalse(SearchQueueItem.objects.exists())
+            self.assertEqual(SearchQuerySet().filter(content=word).count(), 1)
+
+            Article.objects.filter(pk=article.pk).update(status='d')
+            article.refresh_from_db()
+            article.save()
+            call_command('run_search_writer', once=True, stdout=StringIO())
+            self.assertEqual(SearchQuerySet().filter(content=word).count(), 0)
+
+            # rows of models that are gone or not indexed are dropped instead of failing every batch
+            SearchQueueItem.objects.create(model='blog.gone', object_id='1')
+            SearchQueueItem.objects.create(model='blog.tag', object_id='1')
+            article.save()
+            with SearchWriter() as writer:
+                self.assertEqual(writer.drain(), 3)
+            self.assertFalse(SearchQueueItem.objects.exists())
+            self.assertEqual(SearchQuerySet().filter(content=word).count(), 0)
+
+    def test_chinese_analyzer_query_cache(self):
+        """Query strings are tokenized by jieba once, documents every time."""
+        preload_jieba()
+        analyzer = ChineseAnalyzer()
+        cached_jieba_tokens.cache_clear()
+        query = '中文分词 Search'
+        terms = [t.text for t in analyzer(query, mode='query')]
+        self.assertIn('search', terms)
+        self.assertEqual([t.text for t in analyzer(query, mode='query')], terms)
+        self.assertEqual(cached_jieba_tokens.cache_info().hits, 1)
+        self.assertEqual([t.text for t in analyzer(query, mode='index')], terms)
+        analyzer('长文' * 200, mode='query')
+        self.assertEqual(cached_jieba_tokens.cache_info().currsize, 1)
+
+    def test_search_results_cache(self):
+        """Search pages are served from the cache until the index generation changes."""
+        self.assertEqual(normalize_query('  Python\tDJANGO '), normalize_query('python django'))
+        self.assertNotEqual(normalize_query('python -django'), normalize_query('python django'))
+        self.assertEqual(normalize_query('Ｃ语言'), 'c语言')
+        self.assertEqual(normalize_query('c'), 'c')
+        word = 'cacheword'
+        category = Category.objects.create(name="Search Cache Category")
+        Article.objects.create(title="Search Cache Title", body=word + " content",
+                               author=self.user, category=category, type='a', status='p')
+        response = self.client.get(reverse('search'), {'q': word})
+        self.assertContains(response, "Search Cache Title")
+
+        with mock.patch.object(SearchQuerySet, '_fill_cache', side_effect=AssertionError('searched')):
+            response = self.client.get(reverse('search'), {'q': ' ' + word.upper() + ' '})
+        self.assertContains(response, "Search Cache Title")
+
+        Article.objects.create(title="Search Cache Second", body=word + " more content",
+                               author=self.user, category=category, type='a', status='p')
+        response = self.client.get(reverse('search'), {'q': word})
+        self.assertContains(response, "Search Cache Title")
+        self.assertContains(response, "Search Cache Second")
+        self.assertEqual(self.client.get(reverse('search'), {'q': word, 'page': 3}).status_code, 404)
+
+        # the write count other backends use is shared through the database
+        generation = get_generation()
+        bump_generation()
+        self.assertNotEqual(get_generation(), generation)
+        self.assertEqual(SearchGeneration.objects.get(using='default').generation, 1)
+
+    def test_autocomplete(self):
+        """Suggestions come from the in-process prefix index, kept current by saves."""
+        category = Category.objects.create(name="中文分类")
+        tag = Tag.objects.create(name="Django")
+        article = Article.objects.create(title="Python 教程入门", body="content", author=self.user,
+                                         category=category, type='a', status='p')
+        prefix_index.built = False
+        url = reverse('blog:autocomplete')
+
+        def suggest(q):
+            return [s['text'] for s in self.client.get(url, {'q': q}).json()['suggestions']]
+
+        self.assertEqual(suggest('py'), ["Python 教程入门"])
+        with self.assertNumQueries(0):
+            self.assertEqual(suggest('JIAO'), ["Python 教程入门"])
+            self.assertEqual(suggest('zwfl'), ["中文分类"])
+            self.assertEqual(suggest('dj'), ["Django"])
+            self.assertEqual(suggest(''), [])
+        response = self.client.get(url, {'q': '教程'})
+        self.assertEqual(response.json()['suggestions'][0]['url'], article.get_absolute_url())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            tag.name = "Djangocms"
+            tag.save()
+            Tag.objects.create(name="Pyramid")
+            article.status = 'd'
+            article.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(suggest('py'), ["Pyramid"])
+            self.assertEqual(suggest('django'), ["Djangocms"])
+
+        # a change made by another process: the old index answers while one rebuild runs
+        Tag.objects.filter(name="Pyramid").update(name="Pylons")
+        cache.incr(VERSION_CACHE_KEY)
+        # a save of this process meanwhile doesn't make it current
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name="Pytest")
+        self.assertNotEqual(prefix_index.version, cache.get(VERSION_CACHE_KEY))
+        prefix_index.checked = 0
+        with prefix_index.build_lock, self.assertNumQueries(0):
+            self.assertEqual(suggest('py'), ["Pytest", "Pyramid"])
+        prefix_index.checked = 0
+        self.assertEqual(suggest('py'), ["Pylons", "Pytest"])
+        self.assertEqual(prefix_index.version, cache.get(VERSION_CACHE_KEY))
+
+        # an aborted save leaves nothing behind
+        with self.assertRaises(IOError), transaction.atomic():
+            Tag.objects.create(name="Pyphantom")
+            raise IOError('rolled back')
+        self.assertEqual(suggest('pyp'), [])
+
+    def test_search_excerpt_highlight(self):
+        """Search hits render from the stored plain text excerpt, highlighted by the backend."""
+        word = 'excerptword'
+        category = Category.objects.create(name="Excerpt Category")
+        body = "## Heading\n\n" + ("**" + word + "** & more ") * 5
+        article = Article.objects.create(title="Excerpt Title", body=body, author=self.user,
+                                         category=category, type='a', status='p')
+        excerpt = article.get_excerpt()
+        self.assertTrue(excerpt.startswith("Heading " + word + " & more"))
+        self.assertLessEqual(len(excerpt), settings.SEARCH_EXCERPT_LENGTH)
+
+        response = self.client.get(reverse('search'), {'q': word})
+        self.assertContains(response, '<em>' + word + '</em> &amp; more')
+        self.assertContains(response, article.get_absolute_url())
+        self.assertNotContains(response, '**')
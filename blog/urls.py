@@ -1,59 +1,62 @@
 from django.urls import path
-from django.views.decorators.cache import cache_page
 
 from . import views
+from .conditional import (article_validator, author_validator, category_validator,
+                          conditional_page, site_validator, tag_validator)
 
 app_name = "blog"
 urlpatterns = [
     path(
         r'',
-        views.IndexView.as_view(),
+        conditional_page(site_validator)(views.IndexView.as_view()),
         name='index'),
     path(
         r'page/<int:page>/',
-        views.IndexView.as_view(),
+        conditional_page(site_validator)(views.IndexView.as_view()),
         name='index_page'),
     
     
     path(
         r'article/<int:year>/<int:month>/<int:day>/<int:article_id>.html',
-        views.ArticleDetailView.as_view(),
+        conditional_page(article_validator)(views.ArticleDetailView.as_view()),
         name='detailbyid'),
     path(
         r'category/<slug:category_name>.html',
-        views.CategoryDetailView.as_view(),
+        conditional_page(category_validator)(views.CategoryDetailView.as_view()),
         name='category_detail'),
     path(
         r'category/<slug:category_name>/<int:page>.html',
-        views.CategoryDetailView.as_view(),
+        conditional_page(category_validator)(views.CategoryDetailView.as_view()),
         name='category_detail_page'),
     path('ai-generate/', views.ai_generate_article, name='ai_generate_article'),
     path(
         r'author/<author_name>.html',
-        views.AuthorDetailView.as_view(),
+        conditional_page(author_validator)(views.AuthorDetailView.as_view()),
         name='author_detail'),
     path(
         r'author/<author_name>/<int:page>.html',
-        views.AuthorDetailView.as_view(),
+        conditional_page(author_validator)(views.AuthorDetailView.as_view()),
         name='author_detail_page'),
     path(
         r'tag/<slug:tag_name>.html',
-        views.TagDetailView.as_view(),
+        conditional_page(tag_validator)(views.TagDetailView.as_view()),
         name='tag_detail'),
     path(
         r'tag/<slug:tag_name>/<int:page>.html',
-        views.TagDetailView.as_view(),
+        conditional_page(tag_validator)(views.TagDetailView.as_view()),
         name='tag_detail_page'),
     path(
         'archives.html',
-        cache_page(
-            60 * 60)(
-            views.ArchivesView.as_view()),
+        conditional_page(site_validator)(views.ArchivesView.as_view()),
         name='archives'),
     path(
         'links.html',
         views.LinkListView.as_view(),
         name='links'),
+    path(
+        'autocomplete',
+        views.autocomplete,
+        name='autocomplete'),
     path(
         r'upload',
         views.fileupload,
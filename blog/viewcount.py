@@ -0,0 +1,128 @@
+"""
+Buffered article view counts.
+
+Page views are accumulated with cache.incr (INCR on Redis) instead of one
+UPDATE per hit.  A per-process background thread flushes the articles it has
+seen, with one `UPDATE ... SET views = views + n` per distinct increment.
+With a shared cache (Redis, memcached) `manage.py flush_view_counts` flushes
+the counters of every process; with a LocMemCache each process only sees its
+own, so the command has nothing to flush and warns about it.  The counter is
+decremented only after the UPDATE committed: a crash in between counts views
+twice instead of losing them.  Counters expire COUNTER_TIMEOUT seconds after
+their last flush, so views of an article no process flushes for that long are
+lost, as they are when a LocMemCache culls the counter.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from djangoblog.utils import cache
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'article_views:'
+FLUSH_INTERVAL = getattr(settings, 'VIEW_COUNT_FLUSH_INTERVAL', 60)
+# well past the flush interval, the timeout only drops counters nothing flushes
+COUNTER_TIMEOUT = max(FLUSH_INTERVAL * 10, 24 * 60 * 60)
+
+_dirty_ids = set()
+_lock = threading.Lock()
+_flusher = None
+
+
+def get_view_count_key(article_id):
+    return KEY_PREFIX + str(article_id)
+
+
+def record_view(article_id):
+    '''
+    Add one view to the buffered counter
+    :return: views buffered for the article and not flushed yet
+    '''
+    key = get_view_count_key(article_id)
+    cache.add(key, 0, COUNTER_TIMEOUT)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        # evicted between add and incr
+        cache.add(key, 1, COUNTER_TIMEOUT)
+        count = 1
+    with _lock:
+        _dirty_ids.add(article_id)
+    _ensure_flusher()
+    return count
+
+
+def get_pending_views(article_ids):
+    '''
+    Buffered views per article id, for merging with Article.views
+    '''
+    keys = {get_view_count_key(i): i for i in article_ids}
+    values = cache.get_many(list(keys.keys()))
+    return {keys[k]: int(v) for k, v in values.items() if v}
+
+
+def flush_view_counts(article_ids=None, batch_size=1000):
+    '''
+    Write buffered views to the database
+    :param article_ids: ids to flush, defaults to the ids this process has seen
+    :return: number of views written
+    '''
+    from blog.models import Article
+    if article_ids is None:
+        with _lock:
+            article_ids = list(_dirty_ids)
+            _dirty_ids.clear()
+    article_ids = list(article_ids)
+    flushed = set()
+    total = 0
+    try:
+        for start in range(0, len(article_ids), batch_size):
+            pending = get_pending_views(article_ids[start:start + batch_size])
+            by_count = {}
+            for article_id, count in pending.items():
+                by_count.setdefault(count, []).append(article_id)
+            for count, ids in by_count.items():
+                with transaction.atomic():
+                    Article.objects.filter(pk__in=ids).update(views=F('views') + count)
+                flushed.update(ids)
+                total += count * len(ids)
+                for article_id in ids:
+                    key = get_view_count_key(article_id)
+                    try:
+                        # subtract only what is written, increments made meanwhile stay buffered
+                        cache.decr(key, count)
+                    except ValueError:
+                        continue
+                    cache.touch(key, COUNTER_TIMEOUT)
+    except Exception:
+        # flushed again next time
+        with _lock:
+            _dirty_ids.update(i for i in article_ids if i not in flushed)
+        raise
+    if total:
+        logger.info('flush article views:{total}'.format(total=total))
+    return total
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        try:
+            flush_view_counts()
+        except Exception as e:
+            logger.error('flush article views failed: %s' % e)
+
+
+def _ensure_flusher():
+    global _flusher
+    if settings.TESTING or (_flusher is not None and _flusher.is_alive()):
+        return
+    with _lock:
+        if _flusher is None or not _flusher.is_alive():
+            _flusher = threading.Thread(target=_flush_loop, name='view-count-flusher', daemon=True)
+            _flusher.start()
@@ -1,22 +1,31 @@
 import logging
 import os
+import pickle
 import uuid
 from blog.forms import ArticleForm
 from django.conf import settings
-from django.core.paginator import Paginator
-from django.http import HttpResponse, HttpResponseForbidden
+from django.contrib.auth import get_user_model
+from django.core.paginator import InvalidPage, Paginator
+from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
+from django.urls import reverse
+from django.utils.http import urlencode
 from django.shortcuts import get_object_or_404, render
 from django.templatetags.static import static
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
 from django.utils.translation import gettext_lazy as _
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.detail import DetailView
 from django.views.generic.list import ListView
 from haystack.views import SearchView
 from django.shortcuts import render, redirect
+from blog.autocomplete import prefix_index
 from blog.models import Article, Category, LinkShowType, Links, Tag
+from blog.pagination import CachedListPaginator, KeysetPaginator
 from comments.forms import CommentForm
-from djangoblog.utils import cache, get_blog_setting, get_sha256
+from djangoblog.cache_dependency import add_surrogate_keys, dependency_tag
+from djangoblog.search_cache import get_search_page
+from djangoblog.utils import cache, get_blog_setting, get_or_compute_cache, get_sha256
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 
@@ -67,7 +76,6 @@ def ai_generate_article(request):
                     article.category = Category.objects.first() or Category.objects.create(name="General", slug="general")
                 article.save()
                 form.save_m2m()  # Save many-to-many fields (e.g., tags)
-                cache.clear()
                 logger.info(f"AI-generated article created: {article.title} (ID: {article.id})")
                 messages.success(request, _('Article successfully generated and saved!'))
                 return redirect(article.get_absolute_url())
@@ -92,6 +100,8 @@ class ArticleListView(ListView):
     paginate_by = settings.PAGINATE_BY
     page_kwarg = 'page'
     link_type = LinkShowType.L
+    # unique ordering used by keyset pagination, matches Article.Meta.ordering
+    keyset_ordering = ['-article_order', '-pub_time', '-id']
 
     def get_view_cache_key(self):
         return self.request.GET.get(self.page_kwarg, '1')  # Fixed: Use GET and page_kwarg
@@ -117,34 +127,117 @@ class ArticleListView(ListView):
         """
         raise NotImplementedError()
 
+    def get_queryset_cache_dependencies(self):
+        """
+        Models the cached queryset is built from, see djangoblog.cache_dependency
+        """
+        return [Article]
+
     def get_queryset_from_cache(self, cache_key):
         """
-        Cache page data
+        Cache the ids of one page and the total count, rows are hydrated
+        through Article.objects.get_cached_in_bulk
         :param cache_key: cache key
-        :return:
+        :return: {'ids': [...], 'count': n}
         """
-        value = cache.get(cache_key)
-        if value:
-            logger.info('get view cache.key:{key}'.format(key=cache_key))
-            return value
-        else:
-            article_list = self.get_queryset_data()
-            cache.set(cache_key, article_list)
-            logger.info('set view cache.key:{key}'.format(key=cache_key))
-            return article_list
+        depends_on = self.get_queryset_cache_dependencies()
+
+        def compute():
+            queryset = self.get_queryset_data()
+            if not self.paginate_by:
+                ids = list(queryset.values_list('id', flat=True))
+                entry = {'ids': ids, 'count': len(ids)}
+            else:
+                count = get_or_compute_cache(self.get_count_cache_key(), queryset.count,
+                                             cache.default_timeout, depends_on=depends_on)
+                paginator = CachedListPaginator(count, self.paginate_by,
+                                                allow_empty_first_page=self.get_allow_empty())
+                try:
+                    number = paginator.validate_number(self.page_number)
+                except InvalidPage as e:
+                    raise Http404(str(e))
+                start = (number - 1) * self.paginate_by
+                entry = {'ids': list(queryset.values_list('id', flat=True)[start:start + self.paginate_by]),
+                         'count': count}
+            logger.info('set view cache.key:{key} size:{size}'.format(
+                key=cache_key, size=len(pickle.dumps(entry))))
+            return entry
+
+        return get_or_compute_cache(cache_key, compute, cache.default_timeout, depends_on=depends_on)
+
+    def use_keyset_pagination(self):
+        """
+        Keyset pagination is opt-in, site wide with ARTICLE_PAGINATION_MODE = 'keyset'
+        or per request with a cursor in the url
+        """
+        if not self.paginate_by:
+            return False
+        return settings.ARTICLE_PAGINATION_MODE == 'keyset' or \
+            'cursor' in self.request.GET or 'before' in self.request.GET
+
+    def get_count_cache_key(self):
+        kwargs = sorted((k, v) for k, v in self.kwargs.items() if k != self.page_kwarg)
+        return 'article_list_count_' + get_sha256('{view}{kwargs}'.format(view=type(self).__name__, kwargs=kwargs))
 
     def get_queryset(self):
         """
-        Override default method to get data from cache
+        Paginated lists only build the queryset here, the page is fetched in
+        paginate_queryset
         :return:
         """
-        key = self.get_queryset_cache_key()
-        value = self.get_queryset_from_cache(key)
-        return value
+        if self.paginate_by:
+            return self.get_queryset_data()
+        entry = self.get_queryset_from_cache(self.get_queryset_cache_key())
+        return Article.objects.get_cached_in_bulk(entry['ids'])
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.use_keyset_pagination():
+            return self.paginate_queryset_by_keyset(queryset, page_size)
+        entry = self.get_queryset_from_cache(self.get_queryset_cache_key())
+        paginator = CachedListPaginator(entry['count'], page_size, allow_empty_first_page=self.get_allow_empty())
+        try:
+            page = paginator.page_with(self.page_number, Article.objects.get_cached_in_bulk(entry['ids']))
+        except InvalidPage as e:
+            raise Http404(str(e))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def paginate_queryset_by_keyset(self, queryset, page_size):
+        cursor = self.request.GET.get('cursor')
+        before = self.request.GET.get('before')
+        paginator = KeysetPaginator(queryset, page_size, self.keyset_ordering)
+        # only the ordering columns are loaded and cached, rows come from the object cache
+        paginator.queryset = queryset.only(*paginator.names)
+        cache_key = 'article_keyset_' + get_sha256('{path}|{cursor}|{before}'.format(
+            path=self.request.path, cursor=cursor, before=before))
+
+        def compute():
+            keyset_page = paginator.page(cursor=cursor, before=before)
+            keyset_page.object_list = [article.id for article in keyset_page.object_list]
+            return keyset_page
+
+        page = get_or_compute_cache(cache_key, compute, cache.default_timeout,
+                                    depends_on=self.get_queryset_cache_dependencies())
+        page.object_list = Article.objects.get_cached_in_bulk(page.object_list)
+        if page.next_cursor:
+            page.next_url = self.request.path + '?' + urlencode({'cursor': page.next_cursor})
+        if page.previous_cursor:
+            page.previous_url = self.request.path + '?' + urlencode({'before': page.previous_cursor})
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_surrogate_keys(self):
+        """
+        Dependency tags of the page for the full-page cache, the articles on
+        the page are added by get_context_data
+        """
+        return [Article]
 
     def get_context_data(self, **kwargs):
         kwargs['linktype'] = self.link_type
-        return super(ArticleListView, self).get_context_data(**kwargs)
+        context = super(ArticleListView, self).get_context_data(**kwargs)
+        add_surrogate_keys(self.request, *self.get_surrogate_keys())
+        if self.paginate_by:
+            add_surrogate_keys(self.request, *context['object_list'])
+        return context
    
 class IndexView(ArticleListView):
     """
@@ -171,6 +264,10 @@ class ArticleDetailView(DetailView):
     pk_url_kwarg = 'article_id'
     context_object_name = "article"
 
+    def get_queryset(self):
+        return super(ArticleDetailView, self).get_queryset().select_related(
+            'category', 'author').prefetch_related('tags')
+
     def get_object(self, queryset=None):
         obj = super(ArticleDetailView, self).get_object()
         obj.viewed()
@@ -182,31 +279,46 @@ class ArticleDetailView(DetailView):
         article_comments = self.object.comment_list()
         parent_comments = article_comments.filter(parent_comment=None)
         blog_setting = get_blog_setting()
-        paginator = Paginator(parent_comments, blog_setting.article_comment_count)
-        page = self.request.GET.get('comment_page', '1')
-        if not page.isnumeric():
-            page = 1
+        comment_cursor = self.request.GET.get('comment_cursor')
+        comment_before = self.request.GET.get('comment_before')
+        if settings.ARTICLE_PAGINATION_MODE == 'keyset' or comment_cursor or comment_before:
+            paginator = KeysetPaginator(parent_comments, blog_setting.article_comment_count, ['-id'])
+            p_comments = paginator.page(cursor=comment_cursor, before=comment_before)
+            if p_comments.next_cursor:
+                kwargs['comment_next_page_url'] = self.object.get_absolute_url() + '?' + urlencode(
+                    {'comment_cursor': p_comments.next_cursor}) + '#commentlist-container'
+            if p_comments.previous_cursor:
+                kwargs['comment_prev_page_url'] = self.object.get_absolute_url() + '?' + urlencode(
+                    {'comment_before': p_comments.previous_cursor}) + '#commentlist-container'
         else:
-            page = int(page)
-            if page < 1:
+            paginator = Paginator(parent_comments, blog_setting.article_comment_count)
+            page = self.request.GET.get('comment_page', '1')
+            if not page.isnumeric():
                 page = 1
-            if page > paginator.num_pages:
-                page = paginator.num_pages
-
-        p_comments = paginator.page(page)
-        next_page = p_comments.next_page_number() if p_comments.has_next() else None
-        prev_page = p_comments.previous_page_number() if p_comments.has_previous() else None
-
-        if next_page:
-            kwargs['comment_next_page_url'] = self.object.get_absolute_url() + f'?comment_page={next_page}#commentlist-container'
-        if prev_page:
-            kwargs['comment_prev_page_url'] = self.object.get_absolute_url() + f'?comment_page={prev_page}#commentlist-container'
+            else:
+                page = int(page)
+                if page < 1:
+                    page = 1
+                if page > paginator.num_pages:
+                    page = paginator.num_pages
+
+            p_comments = paginator.page(page)
+            next_page = p_comments.next_page_number() if p_comments.has_next() else None
+            prev_page = p_comments.previous_page_number() if p_comments.has_previous() else None
+
+            if next_page:
+                kwargs['comment_next_page_url'] = self.object.get_absolute_url() + f'?comment_page={next_page}#commentlist-container'
+            if prev_page:
+                kwargs['comment_prev_page_url'] = self.object.get_absolute_url() + f'?comment_page={prev_page}#commentlist-container'
         kwargs['form'] = comment_form
         kwargs['article_comments'] = article_comments
         kwargs['p_comments'] = p_comments
         kwargs['comment_count'] = len(article_comments) if article_comments else 0
         kwargs['next_article'] = self.object.next_article
         kwargs['prev_article'] = self.object.prev_article
+        add_surrogate_keys(self.request, self.object, self.object.category, self.object.author,
+                           *self.object.tags.all(),
+                           'comments.comment:article_id={id}'.format(id=self.object.id))
 
         return super(ArticleDetailView, self).get_context_data(**kwargs)
 
@@ -220,10 +332,10 @@ class CategoryDetailView(ArticleListView):
     def get_queryset_data(self):
         slug = self.kwargs['category_name']
         category = get_object_or_404(Category, slug=slug)
+        self.category = category
         categoryname = category.name
         self.categoryname = categoryname
-        categorynames = list(map(lambda c: c.name, category.get_sub_categorys()))
-        article_list = Article.objects.filter(category__name__in=categorynames, status='p')
+        article_list = category.get_subtree_articles().filter(status='p')
         return article_list
 
     def get_queryset_cache_key(self):
@@ -234,6 +346,13 @@ class CategoryDetailView(ArticleListView):
         cache_key = 'category_list_{categoryname}_{page}'.format(categoryname=categoryname, page=self.page_number)
         return cache_key
 
+    def get_queryset_cache_dependencies(self):
+        return [Article, Category]
+
+    def get_surrogate_keys(self):
+        return [self.category] + [dependency_tag(Article, category_id=category.id)
+                                  for category in self.category.get_sub_categorys()]
+
     def get_context_data(self, **kwargs):
         categoryname = self.categoryname
         try:
@@ -257,6 +376,16 @@ class AuthorDetailView(ArticleListView):
         cache_key = 'author_{author_name}_{page}'.format(author_name=author_name, page=self.page_number)
         return cache_key
 
+    def get_queryset_cache_dependencies(self):
+        return [Article, get_user_model()]
+
+    def get_surrogate_keys(self):
+        author_id = get_user_model().objects.filter(
+            username=self.kwargs['author_name']).values_list('id', flat=True).first()
+        if author_id is None:
+            return [Article]
+        return [dependency_tag(get_user_model(), pk=author_id), dependency_tag(Article, author_id=author_id)]
+
     def get_queryset_data(self):
         author_name = self.kwargs['author_name']
         article_list = Article.objects.filter(author__username=author_name, type='a', status='p')
@@ -278,6 +407,7 @@ class TagDetailView(ArticleListView):
     def get_queryset_data(self):
         slug = self.kwargs['tag_name']
         tag = get_object_or_404(Tag, slug=slug)
+        self.tag = tag
         tag_name = tag.name
         self.name = tag_name
         article_list = Article.objects.filter(tags__name=tag_name, type='a', status='p')
@@ -291,6 +421,12 @@ class TagDetailView(ArticleListView):
         cache_key = 'tag_{tag_name}_{page}'.format(tag_name=tag_name, page=self.page_number)
         return cache_key
 
+    def get_queryset_cache_dependencies(self):
+        return [Article, Tag]
+
+    def get_surrogate_keys(self):
+        return [self.tag]
+
     def get_context_data(self, **kwargs):
         tag_name = self.name
         kwargs['page_type'] = TagDetailView.page_type
@@ -314,6 +450,23 @@ class ArchivesView(ArticleListView):
         cache_key = 'archives'
         return cache_key
 
+    def get_queryset(self):
+        """
+        The page lists every article by title, so it is built from a values()
+        query cached as a whole instead of the per-article object cache
+        """
+
+        def compute():
+            articles = list(self.get_queryset_data().values('id', 'title', 'pub_time', 'creation_time'))
+            for article in articles:
+                created = article.pop('creation_time')
+                article['url'] = reverse('blog:detailbyid', kwargs={
+                    'article_id': article['id'], 'year': created.year, 'month': created.month, 'day': created.day})
+            return articles
+
+        return get_or_compute_cache(self.get_queryset_cache_key(), compute, cache.default_timeout,
+                                    depends_on=self.get_queryset_cache_dependencies())
+
 
 class LinkListView(ListView):
     model = Links
@@ -324,6 +477,38 @@ class LinkListView(ListView):
 
 
 class EsSearchView(SearchView):
+    def __init__(self, *args, **kwargs):
+        # the page renders from the stored fields of the hits, see build_page
+        kwargs['load_all'] = False
+        super().__init__(*args, **kwargs)
+
+    def get_search_options(self):
+        return ['models=' + ','.join(sorted(self.request.GET.getlist('models'))),
+                'is_suggest=' + self.request.GET.get('is_suggest', '')]
+
+    def build_page(self):
+        """
+        Page through djangoblog.search_cache, the hits hold what the template
+        shows so no article is loaded
+        """
+        try:
+            page_no = int(self.request.GET.get("page", 1))
+        except (TypeError, ValueError):
+            raise Http404("Not a valid number for page.")
+        if page_no < 1:
+            raise Http404("Pages should be 1 or greater.")
+        if self.query:
+            self.entry = get_search_page(self.results, self.query, page_no, self.results_per_page,
+                                         self.get_search_options())
+        else:
+            self.entry = {'hits': [], 'count': 0, 'suggestion': None}
+        paginator = CachedListPaginator(self.entry['count'], self.results_per_page)
+        try:
+            page = paginator.page_with(page_no, self.entry['hits'])
+        except InvalidPage:
+            raise Http404("No such page!")
+        return paginator, page
+
     def get_context(self):
         paginator, page = self.build_page()
         context = {
@@ -331,14 +516,26 @@ class EsSearchView(SearchView):
             "form": self.form,
             "page": page,
             "paginator": paginator,
-            "suggestion": None,
+            "suggestion": self.entry['suggestion'],
         }
-        if hasattr(self.results, "query") and self.results.query.backend.include_spelling:
-            context["suggestion"] = self.results.query.get_spelling_suggestion()
         context.update(self.extra_context())
         return context
 
 
+def autocomplete(request):
+    """
+    Search box suggestions as json, answered from blog.autocomplete.prefix_index
+    """
+    query = request.GET.get('q', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', 10)), 1), 20)
+    except ValueError:
+        limit = 10
+    response = JsonResponse({'query': query, 'suggestions': prefix_index.lookup(query, limit)})
+    patch_cache_control(response, public=True, max_age=settings.AUTOCOMPLETE_REFRESH_INTERVAL)
+    return response
+
+
 @csrf_exempt
 def fileupload(request):
     """
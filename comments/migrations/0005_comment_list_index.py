@@ -0,0 +1,20 @@
+# Generated by Django 5.1.8 on 2026-10-18 09:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0010_article_list_indexes'),
+        ('comments', '0004_alter_comment_body'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['article', 'is_enable', 'parent_comment', 'id'], name='comments_co_article_cccba2_idx'),
+        ),
+    ]
@@ -34,6 +34,12 @@ class Comment(models.Model):
         verbose_name = _('comment')
         verbose_name_plural = verbose_name
         get_latest_by = 'id'
+        indexes = [models.Index(fields=['article', 'is_enable', 'parent_comment', 'id'])]
 
     def __str__(self):
         return self.body
+
+    def save(self, *args, **kwargs):
+        # drives Last-Modified of the article page, see blog.conditional
+        self.last_modify_time = now()
+        super().save(*args, **kwargs)
@@ -1,6 +1,6 @@
-from django import template
+from djangoblog.instrumentation import TimedLibrary
 
-register = template.Library()
+register = TimedLibrary()
 
 
 @register.simple_tag
@@ -2,12 +2,14 @@ from django.contrib.admin import AdminSite
 from django.contrib.admin.models import LogEntry
 from django.contrib.sites.admin import SiteAdmin
 from django.contrib.sites.models import Site
+from django.template.response import TemplateResponse
 
 from accounts.admin import *
 from blog.admin import *
 from blog.models import *
 from comments.admin import *
 from comments.models import *
+from djangoblog.instrumentation import get_recent_requests
 from djangoblog.logentryadmin import LogEntryAdmin
 from oauth.admin import *
 from oauth.models import *
@@ -27,15 +29,37 @@ class DjangoBlogAdminSite(AdminSite):
     def has_permission(self, request):
         return request.user.is_superuser
 
-    # def get_urls(self):
-    #     urls = super().get_urls()
-    #     from django.urls import path
-    #     from blog.views import refresh_memcache
-    #
-    #     my_urls = [
-    #         path('refresh/', self.admin_view(refresh_memcache), name="refresh"),
-    #     ]
-    #     return urls + my_urls
+    def get_urls(self):
+        urls = super().get_urls()
+        from django.urls import path
+
+        my_urls = [
+            path('query-budget/', self.admin_view(self.query_budget_view), name='query_budget'),
+        ]
+        return my_urls + urls
+
+    def query_budget_view(self, request):
+        """
+        Recent requests recorded by QueryBudgetMiddleware, and their totals per view
+        """
+        recent = get_recent_requests()
+        views = {}
+        for summary in recent:
+            stats = views.setdefault(summary['view_name'], {
+                'view_name': summary['view_name'], 'budget': summary['budget'],
+                'requests': 0, 'queries': 0, 'max_queries': 0})
+            stats['requests'] += 1
+            stats['queries'] += summary['queries']
+            stats['max_queries'] = max(stats['max_queries'], summary['queries'])
+        for stats in views.values():
+            stats['avg_queries'] = round(stats['queries'] / stats['requests'], 1)
+        context = dict(
+            self.each_context(request),
+            title='Query budget',
+            recent=recent,
+            views=sorted(views.values(), key=lambda v: -v['max_queries']),
+        )
+        return TemplateResponse(request, 'admin/query_budget.html', context)
 
 
 admin_site = DjangoBlogAdminSite(name='admin')
@@ -46,6 +70,7 @@ admin_site.register(Tag, TagAdmin)
 admin_site.register(Links, LinksAdmin)
 admin_site.register(SideBar, SideBarAdmin)
 admin_site.register(BlogSettings, BlogSettingsAdmin)
+admin_site.register(ArticleEnrichmentJob, ArticleEnrichmentJobAdmin)
 
 admin_site.register(commands, CommandsAdmin)
 admin_site.register(EmailSendLog, EmailSendLogAdmin)
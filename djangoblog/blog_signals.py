@@ -1,19 +1,20 @@
-import _thread
 import logging
 
 import django.dispatch
 from django.conf import settings
 from django.contrib.admin.models import LogEntry
 from django.contrib.auth.signals import user_logged_in, user_logged_out
-from django.core.mail import EmailMultiAlternatives
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 
+from blog import autocomplete
+from blog.models import Article
 from comments.models import Comment
 from comments.utils import send_comment_email
+from djangoblog.cache_dependency import invalidate_dependencies, invalidate_instance
 from djangoblog.spider_notify import SpiderNotify
-from djangoblog.utils import cache, expire_view_cache, delete_sidebar_cache, delete_view_cache
-from djangoblog.utils import get_current_site
+from djangoblog.utils import expire_view_cache, delete_view_cache
+from djangoblog.utils import get_current_site, CommonMarkdown
 from oauth.models import OAuthUser
 
 logger = logging.getLogger(__name__)
@@ -25,30 +26,9 @@ send_email_signal = django.dispatch.Signal(
 
 @receiver(send_email_signal)
 def send_email_signal_handler(sender, **kwargs):
-    emailto = kwargs['emailto']
-    title = kwargs['title']
-    content = kwargs['content']
-
-    msg = EmailMultiAlternatives(
-        title,
-        content,
-        from_email=settings.DEFAULT_FROM_EMAIL,
-        to=emailto)
-    msg.content_subtype = "html"
-
-    from servermanager.models import EmailSendLog
-    log = EmailSendLog()
-    log.title = title
-    log.content = content
-    log.emailto = ','.join(emailto)
-
-    try:
-        result = msg.send()
-        log.send_result = result > 0
-    except Exception as e:
-        logger.error(f"失败邮箱号: {emailto}, {e}")
-        log.send_result = False
-    log.save()
+    # queued in the outbox, manage.py run_email_worker sends it
+    from servermanager.outbox import queue_email
+    queue_email(kwargs['emailto'], kwargs['title'], kwargs['content'])
 
 
 @receiver(oauth_user_login_signal)
@@ -61,8 +41,6 @@ def oauth_user_login_signal_handler(sender, **kwargs):
         oauthuser.picture = save_user_avatar(oauthuser.picture)
         oauthuser.save()
 
-    delete_sidebar_cache()
-
 
 @receiver(post_save)
 def model_post_save_callback(
@@ -73,44 +51,51 @@ def model_post_save_callback(
         using,
         update_fields,
         **kwargs):
-    clearcache = False
     if isinstance(instance, LogEntry):
         return
+    is_update_views = update_fields == {'views'}
     if 'get_full_url' in dir(instance):
-        is_update_views = update_fields == {'views'}
         if not settings.TESTING and not is_update_views:
             try:
                 notify_url = instance.get_full_url()
                 SpiderNotify.baidu_notify([notify_url])
             except Exception as ex:
                 logger.error("notify sipder", ex)
-        if not is_update_views:
-            clearcache = True
+
+    if not is_update_views:
+        invalidate_instance(instance)
+        autocomplete.object_changed(instance)
+
+    if isinstance(instance, Article) and not is_update_views:
+        # warm the render cache so the first reader doesn't pay for it
+        CommonMarkdown.get_markdown_with_toc(instance.body)
 
     if isinstance(instance, Comment):
         if instance.is_enable:
-            path = instance.article.get_absolute_url()
-            site = get_current_site().domain
-            if site.find(':') > 0:
-                site = site[0:site.find(':')]
-
-            expire_view_cache(
-                path,
-                servername=site,
-                serverport=80,
-                key_prefix='blogdetail')
-            if cache.get('seo_processor'):
-                cache.delete('seo_processor')
-            comment_cache_key = 'article_comments_{id}'.format(
-                id=instance.article.id)
-            cache.delete(comment_cache_key)
-            delete_sidebar_cache()
+            expire_view_cache(instance.article.get_absolute_url())
             delete_view_cache('article_comments', [str(instance.article.pk)])
 
-            _thread.start_new_thread(send_comment_email, (instance,))
+            # only writes outbox rows, in the transaction of the comment
+            send_comment_email(instance)
 
-    if clearcache:
-        cache.clear()
+
+@receiver(post_delete)
+def model_post_delete_callback(sender, instance, using, **kwargs):
+    if isinstance(instance, LogEntry):
+        return
+    invalidate_instance(instance)
+    autocomplete.object_changed(instance, deleted=True)
+
+
+@receiver(m2m_changed)
+def model_m2m_changed_callback(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    dependencies = [model]
+    if pk_set:
+        dependencies.extend(model(pk=pk) for pk in pk_set)
+    invalidate_dependencies(*dependencies)
+    invalidate_instance(instance)
 
 
 @receiver(user_logged_in)
@@ -118,5 +103,3 @@ def model_post_save_callback(
 def user_auth_callback(sender, request, user, **kwargs):
     if user and user.username:
         logger.info(user)
-        delete_sidebar_cache()
-        # cache.clear()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Dependency tracking for cache entries.
+
+Cache entries are stamped with the generation of the dependency tags built
+from the models and model instances their values were computed from.  Saving
+or deleting an instance moves its tags to a new generation with cache.incr,
+so the entries stamped with the old one read as misses instead of clearing
+the whole cache; nothing keeps a list of keys per tag.  Entries written by
+set_cache are read back with get_cache and get_many_cache, keys that can't
+be read through them (template fragments) put get_dependency_version in the
+key instead.
+
+Tags look like:
+    blog.article                 any article (querysets over the table)
+    blog.article:pk=5            a single article
+    comments.comment:article_id=5  comments pointing at article 5
+    page:path=/links.html        full-page cache entries of a URL path
+
+The page cache sends the tags of a page as its Surrogate-Key header.
+"""
+
+import logging
+import random
+from collections import namedtuple
+
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db import models
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY_PREFIX = 'cache_dependency:'
+
+# value stored by set_cache with the ((tag, generation), ...) it was computed at
+DependentValue = namedtuple('DependentValue', ['value', 'versions'])
+
+
+def dependency_tag(obj, **lookup):
+    '''
+    Build the dependency tag of a model class, model instance or plain string
+    :param obj: model class, model instance or tag string
+    :param lookup: single field=value pair narrowing a model class tag
+    :return: tag string
+    '''
+    if isinstance(obj, str):
+        return obj
+    if isinstance(obj, models.Model):
+        return '{label}:pk={pk}'.format(label=obj._meta.label_lower, pk=obj.pk)
+    tag = obj._meta.label_lower
+    for field, value in sorted(lookup.items()):
+        tag += ':{field}={value}'.format(field=field, value=value)
+    return tag
+
+
+def get_dependency_tags(depends_on):
+    tags = []
+    for obj in depends_on or ():
+        tag = dependency_tag(obj)
+        if tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def get_instance_tags(instance):
+    '''
+    All tags touched by a change of instance: its model, itself and every
+    foreign key it points at.
+    '''
+    model = type(instance)
+    tags = [dependency_tag(model), dependency_tag(instance)]
+    for field in instance._meta.concrete_fields:
+        if field.many_to_one:
+            value = getattr(instance, field.attname)
+            if value is not None:
+                tags.append(dependency_tag(model, **{field.attname: value}))
+    return tags
+
+
+def get_tag_versions(tags):
+    '''
+    Current generation of each tag
+    :return: dict of tag to generation
+    '''
+    version_keys = {VERSION_KEY_PREFIX + tag: tag for tag in tags}
+    found = cache.get_many(list(version_keys.keys()))
+    versions = {}
+    for version_key, tag in version_keys.items():
+        version = found.get(version_key)
+        if version is None:
+            # a random start: a tag the cache evicted doesn't come back at a generation entries were stamped with
+            cache.add(version_key, random.randrange(1 << 62), None)
+            version = cache.get(version_key)
+        versions[tag] = version
+    return versions
+
+
+def get_dependency_versions(depends_on):
+    '''
+    Stamp for a value computed from the given dependencies, take it before
+    reading them so a change while computing is not missed
+    :param depends_on: iterable of model classes, instances or tags
+    :return: tuple of (tag, generation)
+    '''
+    tags = get_dependency_tags(depends_on)
+    if not tags:
+        return ()
+    versions = get_tag_versions(tags)
+    return tuple((tag, versions[tag]) for tag in tags)
+
+
+def get_dependency_version(*depends_on):
+    '''
+    Generations of the given dependencies as one string, for cache keys
+    '''
+    return '.'.join(str(version) for tag, version in get_dependency_versions(depends_on))
+
+
+def set_cache(key, value, timeout=DEFAULT_TIMEOUT, depends_on=None, versions=None):
+    '''
+    cache.set that stamps the value with the generation of its dependencies,
+    read it back with get_cache
+    :param versions: stamp taken by get_dependency_versions before computing value
+    '''
+    if versions is None:
+        versions = get_dependency_versions(depends_on)
+    if versions:
+        value = DependentValue(value, versions)
+    cache.set(key, value, timeout)
+
+
+def set_many_cache(values, timeout=DEFAULT_TIMEOUT, depends_on=None):
+    '''
+    set_cache for many keys at once: one lookup of the generations and one
+    cache.set_many
+    :param values: dict of key to value
+    :param depends_on: dict of key to the dependencies of its value
+    '''
+    depends_on = depends_on or {}
+    key_tags = {key: get_dependency_tags(depends_on.get(key)) for key in values}
+    tags = set(tag for tags in key_tags.values() for tag in tags)
+    current = get_tag_versions(tags) if tags else {}
+    stamped = {}
+    for key, value in values.items():
+        if key_tags[key]:
+            value = DependentValue(value, tuple((tag, current[tag]) for tag in key_tags[key]))
+        stamped[key] = value
+    cache.set_many(stamped, timeout)
+
+
+def get_many_cache(keys):
+    '''
+    cache.get_many dropping the values a dependency changed since they were set
+    '''
+    found = cache.get_many(list(keys))
+    tags = set()
+    for value in found.values():
+        if isinstance(value, DependentValue):
+            tags.update(tag for tag, version in value.versions)
+    current = get_tag_versions(tags) if tags else {}
+    values = {}
+    for key, value in found.items():
+        if isinstance(value, DependentValue):
+            if any(current[tag] != version for tag, version in value.versions):
+                continue
+            value = value.value
+        values[key] = value
+    return values
+
+
+def get_cache(key, default=None):
+    '''
+    cache.get of a value stored by set_cache, default once a dependency changed
+    '''
+    return get_many_cache([key]).get(key, default)
+
+
+def invalidate_dependencies(*depends_on):
+    '''
+    Move the given dependencies to a new generation, the values stamped with
+    the old one read as misses
+    :return: the tags
+    '''
+    tags = get_dependency_tags(depends_on)
+    for tag in tags:
+        try:
+            cache.incr(VERSION_KEY_PREFIX + tag)
+        except ValueError:
+            # not in the cache: the next read starts a new generation anyway
+            pass
+    if tags:
+        logger.info('invalidate cache tags:{tags}'.format(tags=tags))
+    return tags
+
+
+def invalidate_instance(instance):
+    return invalidate_dependencies(*get_instance_tags(instance))
+
+
+def page_path_tag(path):
+    return 'page:path=' + path
+
+
+def add_surrogate_keys(request, *depends_on):
+    '''
+    Tag the page rendered for request, see blog.middleware.PageCacheMiddleware
+    :param depends_on: model classes, instances or tags the page shows
+    '''
+    keys = getattr(request, 'surrogate_keys', None)
+    if keys is None:
+        keys = request.surrogate_keys = []
+    for tag in get_dependency_tags(depends_on):
+        if tag not in keys:
+            keys.append(tag)
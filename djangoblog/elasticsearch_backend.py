@@ -1,3 +1,4 @@
+from django.utils.dateparse import parse_datetime
 from django.utils.encoding import force_str
 from elasticsearch_dsl import Q
 from haystack.backends import BaseEngine, BaseSearchBackend, BaseSearchQuery, log_query
@@ -7,11 +8,15 @@ from haystack.utils import log as logging
 
 from blog.documents import ArticleDocument, ArticleDocumentManager
 from blog.models import Article
+from djangoblog.search_cache import bump_generation
 
 logger = logging.getLogger(__name__)
 
 
 class ElasticSearchBackend(BaseSearchBackend):
+    # returned with the hits, enough for the search page without loading articles
+    STORED_FIELDS = ['title', 'url', 'pub_time', 'excerpt']
+
     def __init__(self, connection_alias, **connection_options):
         super(
             ElasticSearchBackend,
@@ -28,8 +33,7 @@ class ElasticSearchBackend(BaseSearchBackend):
 
     def _create(self, models):
         self.manager.create_index()
-        docs = self._get_models(models)
-        self.manager.rebuild(docs)
+        self.manager.rebuild(models if models else None)
 
     def _delete(self, models):
         for m in models:
@@ -45,10 +49,12 @@ class ElasticSearchBackend(BaseSearchBackend):
 
         models = self._get_models(iterable)
         self.manager.update_docs(models)
+        bump_generation(self.connection_alias)
 
     def remove(self, obj_or_string):
         models = self._get_models([obj_or_string])
         self._delete(models)
+        bump_generation(self.connection_alias)
 
     def clear(self, models=None, commit=True):
         self.remove(None)
@@ -92,7 +98,11 @@ class ElasticSearchBackend(BaseSearchBackend):
                      .query('bool', filter=[q]) \
                      .filter('term', status='p') \
                      .filter('term', type='a') \
-                     .source(False)[start_offset: end_offset]
+                     .source(self.STORED_FIELDS)[start_offset: end_offset]
+        if kwargs.get('highlight'):
+            # terms matched in body or title are marked in the short excerpt
+            search = search.highlight('excerpt', number_of_fragments=0, require_field_match=False) \
+                .highlight_options(encoder='html', pre_tags=['<em>'], post_tags=['</em>'])
 
         results = search.execute()
         hits = results['hits'].total
@@ -100,7 +110,11 @@ class ElasticSearchBackend(BaseSearchBackend):
         for raw_result in results['hits']['hits']:
             app_label = 'blog'
             model_name = 'Article'
-            additional_fields = {}
+            additional_fields = raw_result['_source'].to_dict() if '_source' in raw_result else {}
+            if additional_fields.get('pub_time'):
+                additional_fields['pub_time'] = parse_datetime(additional_fields['pub_time'])
+            if 'highlight' in raw_result:
+                additional_fields['highlighted'] = raw_result['highlight'].to_dict()
 
             result_class = SearchResult
 
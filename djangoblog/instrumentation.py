@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+"""
+Per-request query instrumentation.
+
+QueryRecorder wraps every database connection with execute_wrapper and
+records each query with a fingerprint (the SQL with its IN lists folded), so
+the same statement run in a loop shows up as a duplicate - the N+1 pattern.
+Template tags registered through TimedLibrary report their time and query
+count to the active recorder.  blog.middleware.QueryBudgetMiddleware records
+requests, QueryBudgetTestMixin asserts the QUERY_BUDGETS of settings in tests.
+"""
+
+import contextvars
+import functools
+import logging
+import re
+import time
+from collections import Counter
+
+from django import template
+from django.conf import settings
+from django.db import connections
+from django.urls import resolve
+
+from djangoblog.utils import cache
+
+logger = logging.getLogger(__name__)
+
+RECENT_KEY = 'query_budget_recent'
+RECENT_SIZE = 200
+
+_current_recorder = contextvars.ContextVar('query_recorder', default=None)
+_in_clause = re.compile(r'IN \((?:%s, )*%s\)')
+
+
+def fingerprint(sql):
+    return _in_clause.sub('IN (...)', sql)
+
+
+def get_query_budget(view_name):
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+
+
+def add_server_timing(response, metric, duration, description=None):
+    value = '{metric};dur={dur:.2f}'.format(metric=metric, dur=duration * 1000)
+    if description:
+        value += ';desc="{desc}"'.format(desc=description)
+    if response.has_header('Server-Timing'):
+        value = response['Server-Timing'] + ', ' + value
+    response['Server-Timing'] = value
+
+
+class QueryRecorder(object):
+    def __init__(self):
+        self.queries = []
+        self.tags = {}
+        self._wrappers = []
+        self._token = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((fingerprint(sql), time.perf_counter() - start))
+
+    def __enter__(self):
+        self._token = _current_recorder.set(self)
+        for connection in connections.all():
+            wrapper = connection.execute_wrapper(self)
+            wrapper.__enter__()
+            self._wrappers.append(wrapper)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        while self._wrappers:
+            self._wrappers.pop().__exit__(exc_type, exc_value, traceback)
+        _current_recorder.reset(self._token)
+
+    def add_tag_timing(self, name, duration, queries):
+        stats = self.tags.setdefault(name, [0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += duration
+        stats[2] += queries
+
+    @property
+    def query_count(self):
+        return len(self.queries)
+
+    @property
+    def query_time(self):
+        return sum(duration for _, duration in self.queries)
+
+    def get_duplicates(self, threshold=2):
+        """
+        :return: [(fingerprint, count)] of statements run at least threshold times
+        """
+        counts = Counter(sql for sql, _ in self.queries)
+        return [(sql, count) for sql, count in counts.most_common() if count >= threshold]
+
+    def summary(self, path='', view_name=''):
+        return {
+            'path': path,
+            'view_name': view_name,
+            'queries': self.query_count,
+            'query_time': round(self.query_time * 1000, 2),
+            'budget': get_query_budget(view_name),
+            'duplicates': self.get_duplicates()[:5],
+            'tags': sorted(((name, calls, round(total * 1000, 2), queries)
+                            for name, (calls, total, queries) in self.tags.items()),
+                           key=lambda t: -t[2])[:10],
+        }
+
+
+def get_current_recorder():
+    return _current_recorder.get()
+
+
+def timed(func):
+    """
+    Report the time and queries of a template tag to the active recorder
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        recorder = get_current_recorder()
+        if recorder is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        queries = recorder.query_count
+        try:
+            return func(*args, **kwargs)
+        finally:
+            recorder.add_tag_timing(func.__name__, time.perf_counter() - start, recorder.query_count - queries)
+
+    return wrapper
+
+
+class TimedLibrary(template.Library):
+    """
+    template.Library whose simple and inclusion tags are timed
+    """
+
+    def simple_tag(self, func=None, takes_context=None, name=None):
+        if callable(func):
+            return super().simple_tag(timed(func), takes_context, name)
+        # @register.simple_tag(takes_context=True) hands over the function later
+        dec = super().simple_tag(func, takes_context, name)
+        return lambda f: dec(timed(f))
+
+    def inclusion_tag(self, filename, func=None, takes_context=None, name=None):
+        dec = super().inclusion_tag(filename, func, takes_context, name)
+        return lambda f: dec(timed(f))
+
+
+def remember_request(summary):
+    """
+    Keep the summary for the admin page, newest first
+    """
+    recent = cache.get(RECENT_KEY) or []
+    recent.insert(0, summary)
+    cache.set(RECENT_KEY, recent[:RECENT_SIZE], None)
+
+
+def get_recent_requests():
+    return cache.get(RECENT_KEY) or []
+
+
+class QueryBudgetTestMixin(object):
+    """
+    TestCase mixin: request a url and fail when its view runs more queries
+    than settings.QUERY_BUDGETS allows
+    """
+
+    def assertWithinQueryBudget(self, url, budget=None, **extra):
+        view_name = resolve(url.split('?')[0]).view_name
+        if budget is None:
+            budget = get_query_budget(view_name)
+        with QueryRecorder() as recorder:
+            response = self.client.get(url, **extra)
+        if budget is not None and recorder.query_count > budget:
+            duplicates = '\n'.join('{count}x {sql}'.format(count=count, sql=sql)
+                                   for sql, count in recorder.get_duplicates())
+            self.fail('{url} ({view}) ran {count} queries, budget is {budget}\n{duplicates}'.format(
+                url=url, view=view_name, count=recorder.query_count, budget=budget, duplicates=duplicates))
+        return response
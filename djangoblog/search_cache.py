@@ -0,0 +1,88 @@
+"""
+Cache of search result pages.
+
+An entry holds one page of a query as the search page shows it, from the
+fields the index stores: title, url, publish time and the excerpt the engine
+highlighted, along with the hit count and the spelling suggestion, so the
+page renders without loading an article.  It is keyed on the normalized
+query, the page, the backend and the generation of its index, so a write to
+the index makes the old entries unreachable instead of waiting for a TTL.
+The whoosh backend reports the generation of its last commit; other
+backends count their writes in a SearchGeneration row, which every process
+reads, unlike a cache that may be local to the process.
+"""
+import unicodedata
+
+from django.conf import settings
+from django.db.models import F
+from django.utils.html import escape
+from haystack import connections
+from haystack.constants import DEFAULT_ALIAS
+
+from djangoblog.utils import cache, get_sha256
+
+
+def normalize_query(query):
+    """
+    Queries differing only in case, width or spacing share one key
+    """
+    return ' '.join(unicodedata.normalize('NFKC', query).lower().split())
+
+
+def get_generation(using=DEFAULT_ALIAS):
+    from blog.models import SearchGeneration
+    count = SearchGeneration.objects.filter(using=using).values_list('generation', flat=True).first() or 0
+    backend = connections[using].get_backend()
+    if hasattr(backend, 'get_generation'):
+        # the count still changes when the index is deleted and numbering restarts
+        return '{count}.{generation}'.format(count=count, generation=backend.get_generation())
+    return str(count)
+
+
+def bump_generation(using=DEFAULT_ALIAS):
+    from blog.models import SearchGeneration
+    if SearchGeneration.objects.filter(using=using).update(generation=F('generation') + 1):
+        return
+    generation, created = SearchGeneration.objects.get_or_create(using=using, defaults={'generation': 1})
+    if not created:
+        SearchGeneration.objects.filter(using=using).update(generation=F('generation') + 1)
+
+
+def get_hit(result):
+    """
+    What the search page shows of a result, from the fields the index stores
+    """
+    highlighted = (getattr(result, 'highlighted', None) or {}).get('excerpt')
+    return {
+        'id': int(result.pk),
+        'title': getattr(result, 'title', ''),
+        'url': getattr(result, 'url', ''),
+        'pub_time': getattr(result, 'pub_time', None),
+        # html either way, the engine escapes the text around its marks
+        'excerpt': highlighted[0] if highlighted and highlighted[0] else escape(getattr(result, 'excerpt', '')),
+    }
+
+
+def get_search_page(sqs, query, page, per_page, options=()):
+    """
+    One page of a search through the cache
+    :param sqs: SearchQuerySet of the query, only run on a miss
+    :param options: other request parameters the results depend on
+    :return: dict with the hits of the page, the hit count and the suggestion
+    """
+    using = sqs.query._using
+    key = 'search_page_' + get_sha256('|'.join(
+        [using, get_generation(using), normalize_query(query), str(page), str(per_page)] + list(options)))
+    entry = cache.get(key)
+    if entry is None:
+        sqs = sqs.highlight()
+        start = (page - 1) * per_page
+        entry = {
+            'hits': [get_hit(result) for result in sqs[start:start + per_page]],
+            'count': sqs.count(),
+            'suggestion': None,
+        }
+        if sqs.query.backend.include_spelling:
+            entry['suggestion'] = sqs.query.get_spelling_suggestion()
+        cache.set(key, entry, settings.SEARCH_RESULTS_CACHE_TIMEOUT)
+    return entry
@@ -0,0 +1,181 @@
+"""
+Queued search indexing, opted in with SEARCH_QUEUE_ENABLED
+(DJANGO_SEARCH_QUEUE=True) for a Whoosh index shared by several web processes.
+
+QueuedSignalProcessor replaces haystack's RealtimeSignalProcessor: saving or
+deleting an indexed object only inserts a SearchQueueItem row, which every
+web process shares through the database.  manage.py run_search_writer is the
+single writer and must be running.  It keeps one Whoosh writer, and with it
+the index lock, drains the queue in batches and commits every
+SEARCH_QUEUE_COMMIT_SIZE objects or SEARCH_QUEUE_COMMIT_INTERVAL seconds,
+merging only the small segments; the whole index is optimized every
+SEARCH_QUEUE_OPTIMIZE_INTERVAL seconds.  Queue rows are deleted after the
+commit that indexed them, so the rows of a crashed writer are indexed by the
+next one.  With SEARCH_QUEUE_EAGER, on while testing, the queue is drained
+right after every save.
+"""
+import logging
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models
+from haystack import connections
+from haystack.constants import DEFAULT_ALIAS, ID
+from haystack.exceptions import NotHandled
+from haystack.signals import BaseSignalProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class QueuedSignalProcessor(BaseSignalProcessor):
+    def setup(self):
+        models.signals.post_save.connect(self.handle_save)
+        models.signals.post_delete.connect(self.handle_delete)
+
+    def teardown(self):
+        models.signals.post_save.disconnect(self.handle_save)
+        models.signals.post_delete.disconnect(self.handle_delete)
+
+    def handle_save(self, sender, instance, **kwargs):
+        self.enqueue(sender, instance)
+
+    def handle_delete(self, sender, instance, **kwargs):
+        self.enqueue(sender, instance)
+
+    def enqueue(self, sender, instance):
+        """
+        Queue the object once for all backends, the writer decides
+        whether it is updated or removed from what the database holds then
+        """
+        for using in self.connection_router.for_write(instance=instance):
+            try:
+                self.connections[using].get_unified_index().get_index(sender)
+            except NotHandled:
+                continue
+            from blog.models import SearchQueueItem
+            SearchQueueItem.objects.create(model=sender._meta.label_lower, object_id=str(instance.pk))
+            if settings.SEARCH_QUEUE_EAGER:
+                with SearchWriter(optimize_interval=0) as writer:
+                    writer.drain()
+            return
+
+
+class SearchWriter(object):
+    """
+    Drains the queue into one backend, use as a context manager so the last
+    batch is committed
+    """
+
+    def __init__(self, using=DEFAULT_ALIAS, batch_size=None, optimize_interval=None):
+        self.using = using
+        self.batch_size = batch_size or settings.SEARCH_QUEUE_BATCH_SIZE
+        self.optimize_interval = (settings.SEARCH_QUEUE_OPTIMIZE_INTERVAL if optimize_interval is None
+                                  else optimize_interval)
+        self.backend = connections[using].get_backend()
+        self.unified_index = connections[using].get_unified_index()
+        # backends without a persistent writer (elasticsearch) are updated per batch
+        self.persistent = hasattr(self.backend, 'get_writer')
+        self.writer = None
+        # queue rows waiting for the commit, rows are read past last_id until then
+        self.indexed = []
+        self.written = set()
+        self.last_id = 0
+        self.last_commit = self.last_optimize = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        elif self.writer is not None:
+            self.writer.cancel()
+            self.writer = None
+
+    def get_writer(self):
+        if self.writer is None:
+            self.writer = self.backend.get_writer(timeout=settings.SEARCH_QUEUE_LOCK_TIMEOUT)
+        return self.writer
+
+    def index_batch(self):
+        """
+        :return: number of queue rows handled
+        """
+        from blog.models import SearchQueueItem
+        rows = list(SearchQueueItem.objects.filter(id__gt=self.last_id).order_by('id')[:self.batch_size])
+        if not rows:
+            return 0
+        changed = {}
+        for row in rows:
+            changed.setdefault(row.model, set()).add(row.object_id)
+        identifiers = {'{label}.{id}'.format(label=row.model, id=row.object_id) for row in rows}
+        if self.written & identifiers:
+            # update_document only replaces committed documents
+            self.commit()
+        self.written |= identifiers
+        for label, ids in changed.items():
+            try:
+                index = self.unified_index.get_index(apps.get_model(label))
+            except (LookupError, ValueError, NotHandled) as e:
+                # the model went away or is no longer indexed, its rows would fail every batch
+                logger.error('dropping queued objects of %s %s: %s', label, sorted(ids), e)
+                SearchQueueItem.objects.filter(id__in=[row.id for row in rows if row.model == label]).delete()
+                continue
+            objects = [obj for obj in index.index_queryset(using=self.using).filter(pk__in=ids)
+                       if index.should_update(obj)]
+            removed = ids - {str(obj.pk) for obj in objects}
+            identifiers = ['{label}.{id}'.format(label=label, id=pk) for pk in removed]
+            if self.persistent:
+                writer = self.get_writer()
+                self.backend.write_documents(writer, index, objects)
+                for identifier in identifiers:
+                    writer.delete_by_term(ID, identifier)
+            else:
+                if objects:
+                    self.backend.update(index, objects)
+                for identifier in identifiers:
+                    self.backend.remove(identifier)
+        self.indexed.extend(row.id for row in rows)
+        self.last_id = rows[-1].id
+        return len(rows)
+
+    def commit(self):
+        """
+        Commit the indexed objects, then forget their queue rows
+        """
+        from blog.models import SearchQueueItem
+        now = time.monotonic()
+        if self.writer is not None:
+            optimize = bool(self.optimize_interval) and now - self.last_optimize >= self.optimize_interval
+            # whoosh loses the deletions in older segments on commit(merge=False)
+            self.writer.commit(optimize=optimize)
+            self.writer = None
+            self.written = set()
+            if optimize:
+                self.last_optimize = now
+        if self.indexed:
+            SearchQueueItem.objects.filter(id__in=self.indexed).delete()
+            logger.info('indexed %d queued objects', len(self.indexed))
+            self.indexed = []
+        # rows committed late by their transaction may sit below last_id
+        self.last_id = 0
+        self.last_commit = now
+
+    def should_commit(self):
+        return self.indexed and (len(self.indexed) >= settings.SEARCH_QUEUE_COMMIT_SIZE or
+                                 time.monotonic() - self.last_commit >= settings.SEARCH_QUEUE_COMMIT_INTERVAL)
+
+    def drain(self):
+        """
+        Index until the queue is empty, committing on the thresholds
+        :return: number of queue rows handled
+        """
+        total = 0
+        while True:
+            count = self.index_batch()
+            total += count
+            if self.should_commit():
+                self.commit()
+            if not count:
+                return total
@@ -76,15 +76,15 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
 
     'django.middleware.security.SecurityMiddleware',
+    'blog.middleware.QueryBudgetMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.gzip.GZipMiddleware',
-    # 'django.middleware.cache.UpdateCacheMiddleware',
     'django.middleware.common.CommonMiddleware',
-    # 'django.middleware.cache.FetchFromCacheMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'blog.middleware.PageCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.http.ConditionalGetMiddleware',
     'blog.middleware.OnlineMiddleware'
@@ -174,8 +174,34 @@ HAYSTACK_CONNECTIONS = {
         'PATH': os.path.join(os.path.dirname(__file__), 'whoosh_index'),
     },
 }
-# Automatically update searching index
-HAYSTACK_SIGNAL_PROCESSOR = 'haystack.signals.RealtimeSignalProcessor'
+# characters of plain text stored with every indexed article and shown as its search result
+SEARCH_EXCERPT_LENGTH = 200
+# search result pages are keyed on the index generation, the timeout only frees memory
+SEARCH_RESULTS_CACHE_TIMEOUT = 60 * 60 * 24
+# seconds between checks whether another process changed the autocomplete index
+AUTOCOMPLETE_REFRESH_INTERVAL = 30
+# Opt in to queued indexing: saves only queue the changed objects and
+# manage.py run_search_writer, which must be running, indexes them.  Otherwise
+# every save updates the index itself.
+SEARCH_QUEUE_ENABLED = env_to_bool('DJANGO_SEARCH_QUEUE', TESTING)
+HAYSTACK_SIGNAL_PROCESSOR = ('djangoblog.search_queue.QueuedSignalProcessor' if SEARCH_QUEUE_ENABLED
+                             else 'haystack.signals.RealtimeSignalProcessor')
+# with the queue, drain it right after every save instead of in a writer process
+SEARCH_QUEUE_EAGER = env_to_bool('DJANGO_SEARCH_QUEUE_EAGER', TESTING)
+SEARCH_QUEUE_BATCH_SIZE = 100
+# commit after this many objects or seconds, whichever comes first
+SEARCH_QUEUE_COMMIT_SIZE = 500
+SEARCH_QUEUE_COMMIT_INTERVAL = 5
+# seconds between commits that merge the whole index into one segment, 0 never
+SEARCH_QUEUE_OPTIMIZE_INTERVAL = 60 * 60
+# seconds to wait for the Whoosh index lock
+SEARCH_QUEUE_LOCK_TIMEOUT = 10
+# load jieba's dictionary when a wsgi worker boots instead of on its first search
+JIEBA_PRELOAD = env_to_bool('DJANGO_JIEBA_PRELOAD', True)
+# where jieba keeps its serialized dictionary, the system temp dir by default
+JIEBA_CACHE_DIR = os.environ.get('DJANGO_JIEBA_CACHE_DIR') or None
+# analyzed query strings kept per process
+JIEBA_QUERY_CACHE_SIZE = 1024
 # Allow user login with username and password
 AUTHENTICATION_BACKENDS = [
     'accounts.user_login_backend.EmailOrUsernameModelBackend']
@@ -198,6 +224,8 @@ BOOTSTRAP_COLOR_TYPES = [
 
 # paginate
 PAGINATE_BY = 10
+# 'offset' (page numbers) or 'keyset' (cursor urls, constant cost on deep pages)
+ARTICLE_PAGINATION_MODE = os.environ.get('DJANGO_ARTICLE_PAGINATION_MODE') or 'offset'
 # http cache timeout
 CACHE_CONTROL_MAX_AGE = 2592000
 # cache setting
@@ -217,6 +245,46 @@ if os.environ.get("DJANGO_REDIS_URL"):
         }
     }
 
+# full-page cache of anonymous blog pages, see blog/middleware.py
+PAGE_CACHE_TIMEOUT = int(os.environ.get('DJANGO_PAGE_CACHE_TIMEOUT') or 60 * 10)
+# s-maxage sent to the nginx front, it can't be purged by surrogate key
+PAGE_CACHE_SHARED_MAX_AGE = int(os.environ.get('DJANGO_PAGE_CACHE_SHARED_MAX_AGE') or 60)
+
+# per-request query recording, see djangoblog/instrumentation.py
+QUERY_INSTRUMENTATION = env_to_bool('DJANGO_QUERY_INSTRUMENTATION', DEBUG)
+# same statement this many times in one request is logged as a likely N+1
+QUERY_DUPLICATE_THRESHOLD = 5
+# max queries per url name, exceeding it is logged and fails QueryBudgetTestMixin
+QUERY_BUDGETS = {
+    'blog:index': 30,
+    'blog:index_page': 30,
+    'blog:detailbyid': 40,
+    'blog:category_detail': 30,
+    'blog:category_detail_page': 30,
+    'blog:tag_detail': 30,
+    'blog:tag_detail_page': 30,
+    'blog:author_detail': 30,
+    'blog:author_detail_page': 30,
+    'blog:archives': 25,
+    'blog:links': 20,
+    'sitemap': 20,
+    'sitemap_section': 10,
+}
+
+# seconds between flushes of buffered article view counts, see blog/viewcount.py
+VIEW_COUNT_FLUSH_INTERVAL = int(os.environ.get('DJANGO_VIEW_COUNT_FLUSH_INTERVAL') or 60)
+
+# article summaries are generated by manage.py run_enrichment_worker, see blog/enrichment.py
+ARTICLE_SUMMARY_CLIENT = os.environ.get('DJANGO_ARTICLE_SUMMARY_CLIENT') or (
+    'blog.enrichment.OpenAISummaryClient' if OPENAI_API_KEY else 'blog.enrichment.StubSummaryClient')
+ENRICHMENT_CLIENT_TIMEOUT = 30
+ENRICHMENT_MAX_ATTEMPTS = 5
+# seconds before the first retry, doubled on every further attempt
+ENRICHMENT_RETRY_DELAY = 30
+ENRICHMENT_MAX_RETRY_DELAY = 60 * 60
+# seconds after which a running job of a dead worker is picked up again
+ENRICHMENT_LEASE = 10 * 60
+
 SITE_ID = 1
 BAIDU_NOTIFY_URL = os.environ.get('DJANGO_BAIDU_NOTIFY_URL') \
                    or 'http://data.zz.baidu.com/urls?site=https://www.lylinux.net&token=1uAOGrMsUm5syDGn'
@@ -231,6 +299,24 @@ EMAIL_HOST_USER = os.environ.get('DJANGO_EMAIL_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('DJANGO_EMAIL_PASSWORD')
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 SERVER_EMAIL = EMAIL_HOST_USER
+if TESTING:
+    EMAIL_BACKEND = 'django.core.mail.backends.locmem.EmailBackend'
+# mail is queued in EmailSendLog, see servermanager/outbox.py.  With
+# DJANGO_EMAIL_WORKER=True manage.py run_email_worker, which must be running,
+# sends it; otherwise a background thread of the queuing process does.
+EMAIL_WORKER_ENABLED = env_to_bool('DJANGO_EMAIL_WORKER', False)
+# send right after queuing, in the request
+EMAIL_OUTBOX_EAGER = env_to_bool('DJANGO_EMAIL_OUTBOX_EAGER', TESTING)
+# seconds between the checks of the background thread for due retries
+EMAIL_OUTBOX_POLL_INTERVAL = 30
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+# seconds before the first retry, doubled on every further attempt
+EMAIL_OUTBOX_RETRY_DELAY = 60
+EMAIL_OUTBOX_MAX_RETRY_DELAY = 6 * 60 * 60
+# seconds after which a batch of a dead worker is sent again
+EMAIL_OUTBOX_LEASE = 10 * 60
+
 # Setting debug=false did NOT handle except email notifications
 ADMINS = [('admin', os.environ.get('DJANGO_ADMIN_EMAIL') or 'admin@admin.com')]
 # WX ADMIN password(Two times md5)
@@ -339,3 +425,5 @@ if os.environ.get('DJANGO_ELASTICSEARCH_HOST'):
             'ENGINE': 'djangoblog.elasticsearch_backend.ElasticSearchEngine',
         },
     }
+    # the elasticsearch backend does not use jieba
+    JIEBA_PRELOAD = False
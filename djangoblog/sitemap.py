@@ -1,7 +1,41 @@
+from xml.sax.saxutils import escape
+
+from django.contrib.auth import get_user_model
 from django.contrib.sitemaps import Sitemap
+from django.core.paginator import InvalidPage
+from django.db.models import Max
+from django.http import Http404, StreamingHttpResponse
 from django.urls import reverse
 
 from blog.models import Article, Category, Tag
+from djangoblog.utils import get_current_site, get_or_compute_cache
+
+
+class StreamingSitemap(Sitemap):
+    """
+    Sitemap over a values() queryset: shards of `limit` urls are streamed
+    with iterator() by sitemap_section, and the latest lastmod shown in the
+    sitemap index is one cached aggregate.
+    """
+    limit = 5000
+    lastmod_field = None
+    depends_on = None
+
+    def get_values(self):
+        raise NotImplementedError()
+
+    def items(self):
+        return self.get_values()
+
+    def lastmod(self, item):
+        return item[self.lastmod_field]
+
+    def get_latest_lastmod(self):
+        def compute():
+            return self.get_values().aggregate(newest=Max(self.lastmod_field))['newest']
+
+        return get_or_compute_cache('sitemap_lastmod_' + type(self).__name__, compute, 60 * 60 * 10,
+                                    depends_on=self.depends_on)
 
 
 class StaticViewSitemap(Sitemap):
@@ -15,45 +49,105 @@ class StaticViewSitemap(Sitemap):
         return reverse(item)
 
 
-class ArticleSiteMap(Sitemap):
+class ArticleSiteMap(StreamingSitemap):
     changefreq = "monthly"
     priority = "0.6"
+    lastmod_field = 'last_modify_time'
+    depends_on = [Article]
 
-    def items(self):
-        return Article.objects.filter(status='p')
+    def get_values(self):
+        return Article.objects.filter(status='p').order_by('id').values('id', 'creation_time', 'last_modify_time')
 
-    def lastmod(self, obj):
-        return obj.last_modify_time
+    def location(self, item):
+        creation_time = item['creation_time']
+        return reverse('blog:detailbyid', kwargs={
+            'article_id': item['id'],
+            'year': creation_time.year,
+            'month': creation_time.month,
+            'day': creation_time.day
+        })
 
 
-class CategorySiteMap(Sitemap):
+class CategorySiteMap(StreamingSitemap):
     changefreq = "Weekly"
     priority = "0.6"
+    lastmod_field = 'last_modify_time'
+    depends_on = [Category]
 
-    def items(self):
-        return Category.objects.all()
+    def get_values(self):
+        return Category.objects.order_by('id').values('slug', 'last_modify_time')
 
-    def lastmod(self, obj):
-        return obj.last_modify_time
+    def location(self, item):
+        return reverse('blog:category_detail', kwargs={'category_name': item['slug']})
 
 
-class TagSiteMap(Sitemap):
+class TagSiteMap(StreamingSitemap):
     changefreq = "Weekly"
     priority = "0.3"
+    lastmod_field = 'last_modify_time'
+    depends_on = [Tag]
 
-    def items(self):
-        return Tag.objects.all()
+    def get_values(self):
+        return Tag.objects.order_by('id').values('slug', 'last_modify_time')
 
-    def lastmod(self, obj):
-        return obj.last_modify_time
+    def location(self, item):
+        return reverse('blog:tag_detail', kwargs={'tag_name': item['slug']})
 
 
-class UserSiteMap(Sitemap):
+class UserSiteMap(StreamingSitemap):
     changefreq = "Weekly"
     priority = "0.3"
+    lastmod_field = 'date_joined'
+    depends_on = [Article, get_user_model()]
 
-    def items(self):
-        return list(set(map(lambda x: x.author, Article.objects.all())))
+    def get_values(self):
+        # users with at least one article, deduplicated by the database
+        return get_user_model().objects.filter(article__isnull=False).distinct().order_by('id').values(
+            'id', 'username', 'date_joined')
 
-    def lastmod(self, obj):
-        return obj.date_joined
+    def location(self, item):
+        return reverse('blog:author_detail', kwargs={'author_name': item['username']})
+
+
+def iter_sitemap_xml(site, object_list, protocol, domain):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n'
+    yield '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    has_lastmod = callable(getattr(site, 'lastmod', None))
+    if hasattr(object_list, 'iterator'):
+        object_list = object_list.iterator()
+    for item in object_list:
+        parts = ['<url><loc>{loc}</loc>'.format(
+            loc=escape('{protocol}://{domain}{path}'.format(
+                protocol=protocol, domain=domain, path=site.location(item))))]
+        lastmod = site.lastmod(item) if has_lastmod else None
+        if lastmod:
+            parts.append('<lastmod>{date}</lastmod>'.format(date=lastmod.strftime('%Y-%m-%d')))
+        if site.changefreq:
+            parts.append('<changefreq>{freq}</changefreq>'.format(freq=site.changefreq))
+        if site.priority:
+            parts.append('<priority>{priority}</priority>'.format(priority=site.priority))
+        parts.append('</url>\n')
+        yield ''.join(parts)
+    yield '</urlset>\n'
+
+
+def sitemap_section(request, sitemaps, section):
+    """
+    One shard (?p=N) of a sitemap section, streamed
+    """
+    if section not in sitemaps:
+        raise Http404('No sitemap available for section: %r' % section)
+    site = sitemaps[section]
+    if callable(site):
+        site = site()
+    # Sitemap.paginator builds a new paginator, and a new COUNT, on every access
+    paginator = site.paginator
+    try:
+        object_list = paginator.page(request.GET.get('p', 1)).object_list
+    except InvalidPage:
+        raise Http404('Page %s empty' % request.GET.get('p'))
+    protocol = request.scheme if site.protocol is None else site.protocol
+    response = StreamingHttpResponse(
+        iter_sitemap_xml(site, object_list, protocol, get_current_site().domain), content_type='application/xml')
+    response['X-Robots-Tag'] = 'noindex, noodp, noarchive'
+    return response
@@ -30,3 +30,84 @@ class DjangoBlogTest(TestCase):
         }
         data = parse_dict_to_url(d)
         self.assertIsNotNone(data)
+
+    def test_cache_dependency(self):
+        from accounts.models import BlogUser
+        from blog.models import Article, Category, Tag
+        from djangoblog.cache_dependency import VERSION_KEY_PREFIX, get_cache, set_cache
+        user = BlogUser.objects.create(username='dependency', email='dependency@test.com')
+        category = Category.objects.create(name='dependency category')
+        article = Article.objects.create(title='dependency title', body='body', author=user, category=category)
+        tag = Tag.objects.create(name='dependency tag')
+
+        set_cache('dependency_article', 1, depends_on=[article])
+        set_cache('dependency_category', 1, depends_on=[Category])
+        set_cache('dependency_tag', 1, depends_on=[tag])
+        set_cache('dependency_comments', 1, depends_on=['comments.comment:article_id=%d' % article.id])
+
+        tag.name = 'dependency tag renamed'
+        tag.save()
+        self.assertIsNone(get_cache('dependency_tag'))
+        self.assertEqual(get_cache('dependency_article'), 1)
+        self.assertEqual(get_cache('dependency_category'), 1)
+
+        article.tags.add(tag)
+        self.assertIsNone(get_cache('dependency_article'))
+        self.assertEqual(get_cache('dependency_category'), 1)
+
+        from comments.models import Comment
+        Comment.objects.create(body='comment', author=user, article=article)
+        self.assertIsNone(get_cache('dependency_comments'))
+        self.assertEqual(get_cache('dependency_category'), 1)
+
+        category.delete()
+        self.assertIsNone(get_cache('dependency_category'))
+
+        # a generation the cache evicted starts over at another one
+        set_cache('dependency_tag', 1, depends_on=[tag])
+        cache.delete(VERSION_KEY_PREFIX + 'blog.tag:pk=%d' % tag.pk)
+        self.assertIsNone(get_cache('dependency_tag'))
+
+    def test_cache_single_flight(self):
+        from unittest import mock
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return len(calls)
+
+        self.assertEqual(get_or_compute_cache('single_flight', compute, 60, beta=0), 1)
+        self.assertEqual(get_or_compute_cache('single_flight', compute, 60, beta=0), 1)
+        self.assertEqual(len(calls), 1)
+
+        # soft expired while another worker holds the lock: serve stale value
+        with mock.patch('djangoblog.utils.time.time', return_value=time.time() + 90):
+            cache.add('cache_lock:single_flight', 'other', 10)
+            self.assertEqual(get_or_compute_cache('single_flight', compute, 60, beta=0), 1)
+            self.assertEqual(len(calls), 1)
+            cache.delete('cache_lock:single_flight')
+            self.assertEqual(get_or_compute_cache('single_flight', compute, 60, beta=0), 2)
+        self.assertIsNone(cache.get('cache_lock:single_flight'))
+
+        @cache_decorator(60)
+        def returns_none():
+            calls.append(1)
+            return None
+
+        count = len(calls)
+        self.assertIsNone(returns_none())
+        self.assertIsNone(returns_none())
+        self.assertEqual(len(calls), count + 1)
+
+    def test_markdown_render_cache(self):
+        from unittest import mock
+        value = '# Title\n\n[TOC]\n\n## Section\n\n```python\nimport os\n```\n'
+        body, toc = CommonMarkdown.get_markdown_with_toc(value)
+        self.assertIn('Section', toc)
+        with mock.patch.object(CommonMarkdown, '_convert_markdown') as convert:
+            self.assertEqual(CommonMarkdown.get_markdown(value), body)
+            self.assertEqual(CommonMarkdown.get_markdown_with_toc(value), (body, toc))
+            convert.assert_not_called()
+        # the reused Markdown instance must not leak state between documents
+        _, other_toc = CommonMarkdown.get_markdown_with_toc('## Other')
+        self.assertNotIn('Section', other_toc)
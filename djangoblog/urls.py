@@ -16,16 +16,18 @@ Including another URLconf
 from django.conf import settings
 from django.conf.urls.i18n import i18n_patterns
 from django.conf.urls.static import static
-from django.contrib.sitemaps.views import sitemap
+from django.contrib.sitemaps.views import index as sitemap_index
 from django.urls import path, include
 from django.urls import re_path
 from haystack.views import search_view_factory
 
+from blog.conditional import conditional_page, site_validator
 from blog.views import EsSearchView
 from djangoblog.admin_site import admin_site
 from djangoblog.elasticsearch_backend import ElasticSearchModelSearchForm
 from djangoblog.feeds import DjangoBlogFeed
-from djangoblog.sitemap import ArticleSiteMap, CategorySiteMap, StaticViewSitemap, TagSiteMap, UserSiteMap
+from djangoblog.sitemap import ArticleSiteMap, CategorySiteMap, StaticViewSitemap, TagSiteMap, UserSiteMap, \
+    sitemap_section
 
 sitemaps = {
 
@@ -50,10 +52,12 @@ urlpatterns += i18n_patterns(
     re_path(r'', include('comments.urls', namespace='comment')),
     re_path(r'', include('accounts.urls', namespace='account')),
     re_path(r'', include('oauth.urls', namespace='oauth')),
-    re_path(r'^sitemap\.xml$', sitemap, {'sitemaps': sitemaps},
-            name='django.contrib.sitemaps.views.sitemap'),
-    re_path(r'^feed/$', DjangoBlogFeed()),
-    re_path(r'^rss/$', DjangoBlogFeed()),
+    re_path(r'^sitemap\.xml$', conditional_page(site_validator)(sitemap_index),
+            {'sitemaps': sitemaps, 'sitemap_url_name': 'sitemap_section'}, name='sitemap'),
+    re_path(r'^sitemap-(?P<section>[\w-]+)\.xml$', conditional_page(site_validator)(sitemap_section),
+            {'sitemaps': sitemaps}, name='sitemap_section'),
+    re_path(r'^feed/$', conditional_page(site_validator)(DjangoBlogFeed())),
+    re_path(r'^rss/$', conditional_page(site_validator)(DjangoBlogFeed())),
     re_path('^search', search_view_factory(view_class=EsSearchView, form_class=ElasticSearchModelSearchForm),
             name='search'),
     re_path(r'', include('servermanager.urls', namespace='servermanager')),
@@ -2,11 +2,16 @@
 # encoding: utf-8
 
 
+import datetime
 import logging
+import math
 import os
 import random
 import string
+import threading
+import time
 import uuid
+from collections import namedtuple
 from hashlib import sha256
 
 import bleach
@@ -15,8 +20,12 @@ import requests
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.core.cache import cache
+from django.db import models
 from django.templatetags.static import static
 
+from djangoblog.cache_dependency import get_cache, get_dependency_versions, invalidate_dependencies, page_path_tag, \
+    set_cache
+
 logger = logging.getLogger(__name__)
 
 
@@ -31,7 +40,96 @@ def get_sha256(str):
     return m.hexdigest()
 
 
-def cache_decorator(expiration=3 * 60):
+CacheEntry = namedtuple('CacheEntry', ['value', 'soft_expire_at', 'delta'])
+
+
+def _acquire_cache_lock(key, timeout):
+    token = uuid.uuid4().hex
+    if cache.add(key, token, timeout):
+        return token
+    return None
+
+
+def _release_cache_lock(key, token):
+    if cache.get(key) == token:
+        cache.delete(key)
+
+
+def get_or_compute_cache(key, compute, expiration=3 * 60, stale_expiration=None,
+                         depends_on=None, beta=1.0, lock_timeout=10, wait_timeout=3):
+    '''
+    Stampede-proof get-or-set.
+
+    The value is stored with a soft TTL (expiration) inside a hard TTL
+    (expiration + stale_expiration).  Once the soft TTL has passed, or earlier
+    with a probability that grows as it approaches (XFetch, scaled by beta and
+    the last compute time), one worker takes a lock through cache.add and
+    recomputes while the others keep serving the stale value.  On a cold miss
+    the workers that lose the lock wait up to wait_timeout for the winner.
+    cache.add is atomic on both LocMemCache and RedisCache.
+    :param key: cache key
+    :param compute: callable producing the value
+    :param expiration: soft TTL in seconds, None for no expiry
+    :param stale_expiration: extra seconds a stale value may be served, defaults to expiration
+    :param depends_on: models, instances or tags, see djangoblog.cache_dependency
+    :return: value
+    '''
+    entry = get_cache(key)
+    if entry is not None and not isinstance(entry, CacheEntry):
+        # plain value written by cache.set
+        return None if entry == '__default_cache_value__' else entry
+
+    now = time.time()
+    if entry is not None:
+        if entry.soft_expire_at is None:
+            return entry.value
+        early = entry.delta * beta * math.log(random.random() or 1e-12)
+        if now - early < entry.soft_expire_at:
+            return entry.value
+
+    lock_key = 'cache_lock:' + key
+    token = _acquire_cache_lock(lock_key, lock_timeout)
+    if token is None:
+        if entry is not None:
+            return entry.value
+        deadline = now + wait_timeout
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = get_cache(key)
+            if isinstance(entry, CacheEntry):
+                return entry.value
+        logger.warning('cache lock wait timeout, compute key:%s' % key)
+
+    try:
+        versions = get_dependency_versions(depends_on)
+        start = time.time()
+        value = compute()
+        delta = time.time() - start
+        if expiration is None:
+            entry = CacheEntry(value, None, delta)
+            timeout = None
+        else:
+            if stale_expiration is None:
+                stale_expiration = expiration
+            entry = CacheEntry(value, time.time() + expiration, delta)
+            timeout = expiration + stale_expiration
+        set_cache(key, entry, timeout, versions=versions)
+        return value
+    finally:
+        if token is not None:
+            _release_cache_lock(lock_key, token)
+
+
+def cache_decorator(expiration=3 * 60, depends_on=None, stale_expiration=None, beta=1.0):
+    '''
+    Cache the return value of func, see get_or_compute_cache
+    :param expiration: soft timeout in seconds
+    :param depends_on: models, instances or tags the value is built from.
+        When decorating a model method the instance is added automatically.
+    :param stale_expiration: seconds a stale value is served while one worker recomputes
+    :param beta: early refresh factor, 0 disables early refresh
+    '''
+
     def wrapper(func):
         def news(*args, **kwargs):
             try:
@@ -44,83 +142,94 @@ def cache_decorator(expiration=3 * 60):
 
                 m = sha256(unique_str.encode('utf-8'))
                 key = m.hexdigest()
-            value = cache.get(key)
-            if value is not None:
-                # logger.info('cache_decorator get cache:%s key:%s' % (func.__name__, key))
-                if str(value) == '__default_cache_value__':
-                    return None
-                else:
-                    return value
-            else:
+
+            def compute():
                 logger.debug(
                     'cache_decorator set cache:%s key:%s' %
                     (func.__name__, key))
-                value = func(*args, **kwargs)
-                if value is None:
-                    cache.set(key, '__default_cache_value__', expiration)
-                else:
-                    cache.set(key, value, expiration)
-                return value
+                return func(*args, **kwargs)
+
+            dependencies = list(depends_on or [])
+            if args and isinstance(args[0], models.Model):
+                dependencies.append(args[0])
+            return get_or_compute_cache(key, compute, expiration,
+                                        stale_expiration=stale_expiration,
+                                        depends_on=dependencies, beta=beta)
 
         return news
 
     return wrapper
 
 
-def expire_view_cache(path, servername, serverport, key_prefix=None):
+def expire_view_cache(path, servername=None, serverport=None, key_prefix=None):
     '''
-    Refresh view cache
+    Purge the full-page cache of a URL path, in every language
     :param path: URL path
-    :param servername: host
-    :param serverport: port
-    :param key_prefix: prefix
+    :param servername: unused, pages are purged for every host
+    :param serverport: unused
+    :param key_prefix: unused
     :return: success status
     '''
-    from django.http import HttpRequest
-    from django.utils.cache import get_cache_key
-
-    request = HttpRequest()
-    request.META = {'SERVER_NAME': servername, 'SERVER_PORT': serverport}
-    request.path = path
+    tags = [page_path_tag(path)]
+    tags.extend(page_path_tag('/' + code + path) for code, _ in settings.LANGUAGES)
+    invalidate_dependencies(*tags)
+    logger.info('expire_view_cache:{path}'.format(path=path))
+    return True
 
-    key = get_cache_key(request, key_prefix=key_prefix, cache=cache)
-    if key:
-        logger.info('expire_view_cache:get key:{path}'.format(path=path))
-        if cache.get(key):
-            cache.delete(key)
-        return True
-    return False
 
-
-@cache_decorator()
+@cache_decorator(depends_on=[Site])
 def get_current_site():
     site = Site.objects.get_current()
     return site
 
 
 class CommonMarkdown:
+    # rendered html is keyed by a hash of the source, so entries never go stale
+    cache_timeout = 60 * 60 * 24 * 7
+    _local = threading.local()
+
+    @staticmethod
+    def _get_markdown_instance():
+        md = getattr(CommonMarkdown._local, 'md', None)
+        if md is None:
+            md = markdown.Markdown(
+                extensions=[
+                    'extra',
+                    'codehilite',
+                    'toc',
+                    'tables',
+                ]
+            )
+            CommonMarkdown._local.md = md
+        return md
+
     @staticmethod
     def _convert_markdown(value):
-        md = markdown.Markdown(
-            extensions=[
-                'extra',
-                'codehilite',
-                'toc',
-                'tables',
-            ]
-        )
-        body = md.convert(value)
-        toc = md.toc
+        md = CommonMarkdown._get_markdown_instance()
+        try:
+            body = md.convert(value)
+            toc = md.toc
+        finally:
+            md.reset()
         return body, toc
 
+    @staticmethod
+    def get_cache_key(value):
+        return 'markdown:' + get_sha256(value)
+
     @staticmethod
     def get_markdown_with_toc(value):
-        body, toc = CommonMarkdown._convert_markdown(value)
+        key = CommonMarkdown.get_cache_key(value)
+        result = cache.get(key)
+        if result is None:
+            result = CommonMarkdown._convert_markdown(value)
+            cache.set(key, result, CommonMarkdown.cache_timeout)
+        body, toc = result
         return body, toc
 
     @staticmethod
     def get_markdown(value):
-        body, toc = CommonMarkdown._convert_markdown(value)
+        body, toc = CommonMarkdown.get_markdown_with_toc(value)
         return body
 
 
@@ -146,7 +255,7 @@ def parse_dict_to_url(dict):
 
 
 def get_blog_setting():
-    value = cache.get('get_blog_setting')
+    value = get_cache('get_blog_setting')
     if value:
         return value
     else:
@@ -169,7 +278,7 @@ def get_blog_setting():
             setting.save()
         value = BlogSettings.objects.first()
         logger.info('set cache get_blog_setting')
-        cache.set('get_blog_setting', value)
+        set_cache('get_blog_setting', value, depends_on=[BlogSettings])
         return value
 
 
@@ -203,10 +312,39 @@ def save_user_avatar(url):
 
 def delete_sidebar_cache():
     from blog.models import LinkShowType
-    keys = ["sidebar" + x for x in LinkShowType.values]
-    for k in keys:
-        logger.info('delete sidebar key:' + k)
-        cache.delete(k)
+    names = ['recent_articles', 'categorys', 'most_read_articles', 'article_dates',
+             'comments', 'tags', 'extra_sidebars'] + ['links_' + x for x in LinkShowType.values]
+    keys = ['sidebar_' + x for x in names]
+    logger.info('delete sidebar keys:' + ','.join(keys))
+    cache.delete_many(keys)
+
+
+def claim_due_rows(queryset, batch_size, lease, pending='p', running='r'):
+    """
+    Lock up to batch_size due rows of a job table for this worker.
+    The table has status, run_after, attempts, locked_at and locked_by columns,
+    running rows whose lease (seconds) expired belong to a dead worker and are due again.
+    """
+    from django.db.models import F, Q
+    from django.utils.timezone import now
+    current = now()
+    due = queryset.filter(
+        Q(status=pending, run_after__lte=current) |
+        Q(status=running, locked_at__lt=current - datetime.timedelta(seconds=lease))).order_by('run_after', 'id')
+    ids = list(due.values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    # another worker may have claimed some of them in between, the token tells ours apart
+    due.filter(id__in=ids).update(status=running, locked_at=current, locked_by=token, attempts=F('attempts') + 1)
+    return list(queryset.filter(locked_by=token))
+
+
+def get_retry_delay(attempts, delay, max_delay):
+    """
+    exponential backoff: delay seconds before the first retry, doubled on every further attempt
+    """
+    return datetime.timedelta(seconds=min(delay * 2 ** (attempts - 1), max_delay))
 
 
 def delete_view_cache(prefix, keys):
@@ -8,6 +8,7 @@ import re
 import shutil
 import threading
 import warnings
+from functools import lru_cache
 
 import six
 from django.conf import settings
@@ -22,18 +23,22 @@ from haystack.models import SearchResult
 from haystack.utils import get_identifier, get_model_ct
 from haystack.utils import log as logging
 from haystack.utils.app_loading import haystack_get_model
-from jieba.analyse import ChineseAnalyzer
+import jieba
+from jieba.analyse.analyzer import STOP_WORDS, accepted_chars
 from whoosh import index
-from whoosh.analysis import StemmingAnalyzer
-from whoosh.fields import BOOLEAN, DATETIME, IDLIST, KEYWORD, NGRAM, NGRAMWORDS, NUMERIC, Schema, TEXT
+from whoosh.analysis import LowercaseFilter, StemFilter, StopFilter, Token, Tokenizer
+from whoosh.fields import BOOLEAN, DATETIME, IDLIST, KEYWORD, NGRAM, NGRAMWORDS, NUMERIC, Schema, STORED, TEXT
 from whoosh.fields import ID as WHOOSH_ID
 from whoosh.filedb.filestore import FileStorage, RamStorage
-from whoosh.highlight import ContextFragmenter, HtmlFormatter
+from whoosh.highlight import ContextFragmenter, HtmlFormatter, WholeFragmenter
 from whoosh.highlight import highlight as whoosh_highlight
+from whoosh.lang.porter import stem
 from whoosh.qparser import QueryParser
 from whoosh.searching import ResultsPage
 from whoosh.writing import AsyncWriter
 
+from djangoblog.search_cache import bump_generation
+
 try:
     import whoosh
 except ImportError:
@@ -53,6 +58,56 @@ LOCALS = threading.local()
 LOCALS.RAM_STORE = None
 
 
+if settings.JIEBA_CACHE_DIR:
+    jieba.dt.tmp_dir = settings.JIEBA_CACHE_DIR
+
+
+def preload_jieba():
+    """
+    Build jieba's prefix dictionary now rather than on the first search or
+    index update, it is loaded from the marshal cache in JIEBA_CACHE_DIR
+    once a process has written it
+    """
+    jieba.initialize()
+
+
+def jieba_tokens(text):
+    return [(w, start_pos, stop_pos) for (w, start_pos, stop_pos) in jieba.tokenize(text, mode="search")
+            if accepted_chars.match(w) or len(w) > 1]
+
+
+@lru_cache(maxsize=settings.JIEBA_QUERY_CACHE_SIZE)
+def cached_jieba_tokens(text):
+    return tuple(jieba_tokens(text))
+
+
+class ChineseTokenizer(Tokenizer):
+    """
+    jieba.analyse's tokenizer, remembering the tokens of recent query strings
+    """
+    # highlighting analyzes whole documents in query mode
+    max_cached_length = 200
+
+    def __call__(self, text, mode='', **kwargs):
+        if mode == 'query' and len(text) <= self.max_cached_length:
+            words = cached_jieba_tokens(text)
+        else:
+            words = jieba_tokens(text)
+        token = Token()
+        for (w, start_pos, stop_pos) in words:
+            token.original = token.text = w
+            token.pos = start_pos
+            token.startchar = start_pos
+            token.endchar = stop_pos
+            yield token
+
+
+def ChineseAnalyzer(stoplist=STOP_WORDS, minsize=1, stemfn=stem, cachesize=50000):
+    return (ChineseTokenizer() | LowercaseFilter() |
+            StopFilter(stoplist=stoplist, minsize=minsize) |
+            StemFilter(stemfn=stemfn, ignore=None, cachesize=cachesize))
+
+
 class WhooshHtmlFormatter(HtmlFormatter):
     """
     This is a HtmlFormatter simpler than the whoosh.HtmlFormatter.
@@ -79,6 +134,9 @@ class WhooshSearchBackend(BaseSearchBackend):
         '[', ']', '^', '"', '~', '*', '?', ':', '.',
     )
 
+    # stored field highlighted instead of the document, when an index has it
+    excerpt_field_name = 'excerpt'
+
     def __init__(self, connection_alias, **connection_options):
         super(
             WhooshSearchBackend,
@@ -183,6 +241,8 @@ class WhooshSearchBackend(BaseSearchBackend):
                 schema_fields[field_class.index_fieldname] = NGRAMWORDS(minsize=2, maxsize=15, at='start',
                                                                         stored=field_class.stored,
                                                                         field_boost=field_class.boost)
+            elif field_class.indexed is False:
+                schema_fields[field_class.index_fieldname] = STORED()
             else:
                 # schema_fields[field_class.index_fieldname] = TEXT(stored=True, analyzer=StemmingAnalyzer(), field_boost=field_class.boost, sortable=True)
                 schema_fields[field_class.index_fieldname] = TEXT(
@@ -206,6 +266,24 @@ class WhooshSearchBackend(BaseSearchBackend):
         self.index = self.index.refresh()
         writer = AsyncWriter(self.index)
 
+        self.write_documents(writer, index, iterable)
+
+        if len(iterable) > 0:
+            # For now, commit no matter what, as we run into locking issues
+            # otherwise.
+            writer.commit()
+
+    def get_writer(self, timeout=0.0):
+        """
+        A writer holding the index lock, see djangoblog/search_queue.py
+        """
+        if not self.setup_complete:
+            self.setup()
+
+        self.index = self.index.refresh()
+        return self.index.writer(timeout=timeout)
+
+    def write_documents(self, writer, index, iterable):
         for obj in iterable:
             try:
                 doc = index.full_prepare(obj)
@@ -239,11 +317,6 @@ class WhooshSearchBackend(BaseSearchBackend):
                                 "index": index,
                                 "object": get_identifier(obj)}})
 
-        if len(iterable) > 0:
-            # For now, commit no matter what, as we run into locking issues
-            # otherwise.
-            writer.commit()
-
     def remove(self, obj_or_string, commit=True):
         if not self.setup_complete:
             self.setup()
@@ -313,6 +386,17 @@ class WhooshSearchBackend(BaseSearchBackend):
 
         # Recreate everything.
         self.setup()
+        # commit numbers restart with the new index
+        bump_generation(self.connection_alias)
+
+    def get_generation(self):
+        """
+        Number of the last commit to the index, see djangoblog/search_cache.py
+        """
+        if not self.setup_complete:
+            self.setup()
+
+        return self.index.latest_generation()
 
     def optimize(self):
         if not self.setup_complete:
@@ -727,19 +811,26 @@ class WhooshSearchBackend(BaseSearchBackend):
                 del (additional_fields[DJANGO_ID])
 
                 if highlight:
-                    sa = StemmingAnalyzer()
+                    # the stored excerpt is short, the whole document is not re-read
+                    if self.excerpt_field_name in additional_fields:
+                        field_name, fragmenter = self.excerpt_field_name, WholeFragmenter()
+                    else:
+                        field_name, fragmenter = self.content_field_name, ContextFragmenter()
+                    analyzer = self.schema[self.content_field_name].analyzer
                     formatter = WhooshHtmlFormatter('em')
-                    terms = [token.text for token in sa(query_string)]
+                    terms = [token.text for token in analyzer(query_string, mode='query')]
 
+                    # index mode keeps documents out of the query token cache
                     whoosh_result = whoosh_highlight(
-                        additional_fields.get(self.content_field_name),
+                        additional_fields.get(field_name) or '',
                         terms,
-                        sa,
-                        ContextFragmenter(),
-                        formatter
+                        analyzer,
+                        fragmenter,
+                        formatter,
+                        mode='index'
                     )
                     additional_fields['highlighted'] = {
-                        self.content_field_name: [whoosh_result],
+                        field_name: [whoosh_result],
                     }
 
                 result = result_class(
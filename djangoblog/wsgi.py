@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/1.10/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "djangoblog.settings")
 
 application = get_wsgi_application()
+
+if settings.JIEBA_PRELOAD:
+    from djangoblog.whoosh_cn_backend import preload_jieba
+
+    preload_jieba()
@@ -1,9 +1,9 @@
-from django import template
 from django.urls import reverse
 
+from djangoblog.instrumentation import TimedLibrary
 from oauth.oauthmanager import get_oauth_apps
 
-register = template.Library()
+register = TimedLibrary()
 
 
 @register.inclusion_tag('oauth/oauth_applications.html')
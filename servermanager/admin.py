@@ -7,12 +7,17 @@ class CommandsAdmin(admin.ModelAdmin):
 
 
 class EmailSendLogAdmin(admin.ModelAdmin):
-    list_display = ('title', 'emailto', 'send_result', 'creation_time')
+    list_display = ('title', 'emailto', 'status', 'attempts', 'creation_time', 'send_time')
+    list_filter = ('status',)
     readonly_fields = (
         'title',
         'emailto',
         'send_result',
+        'status',
+        'attempts',
+        'last_error',
         'creation_time',
+        'send_time',
         'content')
 
     def has_add_permission(self, request):
@@ -0,0 +1,49 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from servermanager.outbox import send_queued
+
+
+def send_queued_in_thread(batch_size):
+    try:
+        return send_queued(batch_size)
+    finally:
+        # every thread has its own database connection
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = 'send the mail queued in EmailSendLog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='messages per SMTP connection, EMAIL_OUTBOX_BATCH_SIZE by default')
+        parser.add_argument('--concurrency', type=int, default=1, help='SMTP connections open at once')
+        parser.add_argument('--sleep', type=float, default=5, help='seconds to wait when no message is due')
+        parser.add_argument('--once', action='store_true', help='exit when no message is due')
+
+    def handle(self, *args, **options):
+        concurrency = max(options['concurrency'], 1)
+        executor = ThreadPoolExecutor(max_workers=concurrency) if concurrency > 1 else None
+        total = 0
+        try:
+            while True:
+                if executor:
+                    count = sum(executor.map(send_queued_in_thread, [options['batch_size']] * concurrency))
+                else:
+                    count = send_queued(options['batch_size'])
+                total += count
+                if count:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if executor:
+                executor.shutdown()
+        self.stdout.write(self.style.SUCCESS('processed %d queued messages\n' % total))
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.8 on 2026-10-18 09:43
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def mark_logged_mail(apps, schema_editor):
+    # rows written before the outbox were sent synchronously, keep them out of the queue
+    EmailSendLog = apps.get_model('servermanager', 'EmailSendLog')
+    EmailSendLog.objects.filter(send_result=True).update(status='s')
+    EmailSendLog.objects.filter(send_result=False).update(status='f')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('servermanager', '0003_alter_commands_options_alter_emailsendlog_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailsendlog',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='Attempts'),
+        ),
+        migrations.AddField(
+            model_name='emailsendlog',
+            name='last_error',
+            field=models.TextField(blank=True, default='', verbose_name='Last Error'),
+        ),
+        migrations.AddField(
+            model_name='emailsendlog',
+            name='locked_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Locked At'),
+        ),
+        migrations.AddField(
+            model_name='emailsendlog',
+            name='locked_by',
+            field=models.CharField(blank=True, default='', max_length=32, verbose_name='Locked By'),
+        ),
+        migrations.AddField(
+            model_name='emailsendlog',
+            name='run_after',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Run After'),
+        ),
+        migrations.AddField(
+            model_name='emailsendlog',
+            name='send_time',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Send Time'),
+        ),
+        migrations.AddField(
+            model_name='emailsendlog',
+            name='status',
+            field=models.CharField(choices=[('p', 'Pending'), ('r', 'Sending'), ('s', 'Sent'), ('f', 'Failed')], default='p', max_length=1, verbose_name='Status'),
+        ),
+        migrations.AddIndex(
+            model_name='emailsendlog',
+            index=models.Index(fields=['status', 'run_after'], name='servermanag_status_5a2475_idx'),
+        ),
+        migrations.RunPython(mark_logged_mail, migrations.RunPython.noop),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils.timezone import now
 
 
 # Create your models here.
@@ -18,11 +19,29 @@ class commands(models.Model):
 
 
 class EmailSendLog(models.Model):
+    """Outbox of the site mail, drained by manage.py run_email_worker"""
+    PENDING = 'p'
+    SENDING = 'r'
+    SENT = 's'
+    FAILED = 'f'
+    STATUS_CHOICES = (
+        (PENDING, 'Pending'),
+        (SENDING, 'Sending'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
     emailto = models.CharField('Recipient', max_length=300)  # 收件人
     title = models.CharField('Email Title', max_length=2000)  # 邮件标题
     content = models.TextField('Email Content')  # 邮件内容
     send_result = models.BooleanField('Result', default=False)  # 结果
+    status = models.CharField('Status', max_length=1, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField('Attempts', default=0)
+    run_after = models.DateTimeField('Run After', default=now)
+    locked_at = models.DateTimeField('Locked At', null=True, blank=True)
+    locked_by = models.CharField('Locked By', max_length=32, blank=True, default='')
+    last_error = models.TextField('Last Error', blank=True, default='')
     creation_time = models.DateTimeField('Creation Time', auto_now_add=True)  # 创建时间
+    send_time = models.DateTimeField('Send Time', null=True, blank=True)
 
     def __str__(self):
         return self.title
@@ -31,3 +50,4 @@ class EmailSendLog(models.Model):
         verbose_name = 'Email Send Log'  # 邮件发送log
         verbose_name_plural = verbose_name
         ordering = ['-creation_time']
+        indexes = [models.Index(fields=['status', 'run_after'])]
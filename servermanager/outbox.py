@@ -0,0 +1,146 @@
+"""
+Outbound mail queue on top of EmailSendLog.
+
+send_email only writes a pending EmailSendLog row, in the transaction of the
+request.  manage.py run_email_worker claims due rows in batches and sends
+each batch over a single SMTP connection; with --concurrency N there are at
+most N batches, and N connections, in flight.  Failed messages are retried
+with an exponential backoff up to EMAIL_OUTBOX_MAX_ATTEMPTS.  Without a
+worker (DJANGO_EMAIL_WORKER) every process sends from a background thread,
+woken when its request commits a message and every EMAIL_OUTBOX_POLL_INTERVAL
+seconds for the retries; rows left by a stopped process are picked up by the
+next thread that runs.  With EMAIL_OUTBOX_EAGER, on while testing, a queued
+message is sent right away through the same path.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from djangoblog.utils import claim_due_rows, get_retry_delay
+from servermanager.models import EmailSendLog
+
+logger = logging.getLogger(__name__)
+
+_wakeup = threading.Event()
+_lock = threading.Lock()
+_sender = None
+
+
+def claim(queryset, batch_size):
+    return claim_due_rows(queryset, batch_size, settings.EMAIL_OUTBOX_LEASE, EmailSendLog.PENDING,
+                          EmailSendLog.SENDING)
+
+
+def queue_email(emailto, title, content):
+    log = EmailSendLog.objects.create(emailto=','.join(emailto), title=title, content=content)
+    if settings.EMAIL_OUTBOX_EAGER:
+        send_batch(claim(EmailSendLog.objects.filter(pk=log.pk), 1))
+    elif not settings.EMAIL_WORKER_ENABLED:
+        transaction.on_commit(wake_sender)
+    return log
+
+
+def _send_loop():
+    while True:
+        _wakeup.wait(settings.EMAIL_OUTBOX_POLL_INTERVAL)
+        _wakeup.clear()
+        try:
+            send_queued()
+        except Exception as e:
+            logger.error('sending queued mail failed: %s' % e)
+        finally:
+            # the connection of this thread
+            connection.close()
+
+
+def wake_sender():
+    """
+    Have the background thread of this process send what is due
+    """
+    global _sender
+    if settings.TESTING:
+        return
+    with _lock:
+        if _sender is None or not _sender.is_alive():
+            _sender = threading.Thread(target=_send_loop, name='email-sender', daemon=True)
+            _sender.start()
+    _wakeup.set()
+
+
+def _sent(log):
+    log.status = EmailSendLog.SENT
+    log.send_result = True
+    log.send_time = now()
+    log.locked_by = ''
+    log.last_error = ''
+    log.save(update_fields=['status', 'send_result', 'send_time', 'locked_by', 'last_error'])
+
+
+def _failed(log, error):
+    logger.error(f"失败邮箱号: {log.emailto}, {error}")
+    if log.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+        log.status = EmailSendLog.FAILED
+    else:
+        log.status = EmailSendLog.PENDING
+        log.run_after = now() + get_retry_delay(log.attempts, settings.EMAIL_OUTBOX_RETRY_DELAY,
+                                                settings.EMAIL_OUTBOX_MAX_RETRY_DELAY)
+    log.send_result = False
+    log.locked_by = ''
+    log.last_error = str(error)
+    log.save(update_fields=['status', 'run_after', 'send_result', 'locked_by', 'last_error'])
+
+
+def send_batch(logs):
+    """
+    Send claimed rows over one connection
+    :return: number of messages sent
+    """
+    if not logs:
+        return 0
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception as e:
+        for log in logs:
+            _failed(log, e)
+        return 0
+    sent = 0
+    try:
+        for log in logs:
+            msg = EmailMultiAlternatives(log.title, log.content, from_email=settings.DEFAULT_FROM_EMAIL,
+                                         to=log.emailto.split(','), connection=connection)
+            msg.content_subtype = "html"
+            try:
+                result = msg.send()
+            except Exception as e:
+                # the session may be broken, the backend reconnects for the next message
+                connection.close()
+                _failed(log, e)
+                continue
+            if result:
+                _sent(log)
+                sent += 1
+            else:
+                _failed(log, 'not accepted')
+    finally:
+        connection.close()
+    return sent
+
+
+def send_queued(batch_size=None):
+    """
+    Claim and send batches until no message is due
+    :return: number of messages claimed
+    """
+    batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+    total = 0
+    while True:
+        logs = claim(EmailSendLog.objects.all(), batch_size)
+        if not logs:
+            return total
+        send_batch(logs)
+        total += len(logs)
@@ -1,3 +1,9 @@
+from io import StringIO
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
 from django.test import Client, RequestFactory, TestCase
 from django.utils import timezone
 from werobot.messages.messages import TextMessage
@@ -5,7 +11,7 @@ from werobot.messages.messages import TextMessage
 from accounts.models import BlogUser
 from blog.models import Category, Article
 from servermanager.api.commonapi import ChatGPT
-from .models import commands
+from .models import commands, EmailSendLog
 from .robot import MessageHandler, CommandHandler
 from .robot import search, category, recents
 
@@ -77,3 +83,53 @@ class ServerManagerTest(TestCase):
 
         s.content = 'exit'
         msghandler.handler()
+
+    def test_email_outbox(self):
+        from djangoblog.utils import send_email
+        with self.settings(EMAIL_OUTBOX_EAGER=True):
+            send_email(['eager@test.com'], 'eager title', 'eager content')
+        self.assertEqual(mail.outbox[-1].to, ['eager@test.com'])
+        self.assertEqual(EmailSendLog.objects.get(title='eager title').status, EmailSendLog.SENT)
+
+        mail.outbox = []
+        with self.settings(EMAIL_OUTBOX_EAGER=False):
+            for i in range(3):
+                send_email(['queued%d@test.com' % i], 'queued title', 'queued content')
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailSendLog.objects.filter(status=EmailSendLog.PENDING).count(), 3)
+        # claiming the batch, one update per message, two empty polls
+        with self.assertNumQueries(3 + 3 + 2):
+            call_command('run_email_worker', once=True, batch_size=5, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(EmailSendLog.objects.filter(status=EmailSendLog.SENT, send_result=True).count(), 4)
+
+        # without a worker the request only queues, the sender thread is woken after the commit
+        with self.settings(EMAIL_OUTBOX_EAGER=False, EMAIL_WORKER_ENABLED=False), \
+                mock.patch('servermanager.outbox.wake_sender') as wake_sender:
+            with self.captureOnCommitCallbacks(execute=True):
+                send_email(['thread@test.com'], 'thread title', 'thread content')
+                wake_sender.assert_not_called()
+        wake_sender.assert_called_once_with()
+        self.assertEqual(EmailSendLog.objects.get(title='thread title').status, EmailSendLog.PENDING)
+
+    def test_email_outbox_retry(self):
+        from servermanager.outbox import send_queued
+        log = EmailSendLog.objects.create(emailto='retry@test.com', title='retry title', content='retry content')
+        with self.settings(EMAIL_BACKEND='servermanager.tests.FailingEmailBackend'):
+            self.assertEqual(send_queued(), 1)
+        log.refresh_from_db()
+        self.assertEqual(log.status, EmailSendLog.PENDING)
+        self.assertEqual(log.attempts, 1)
+        self.assertGreater(log.run_after, timezone.now())
+        self.assertEqual(send_queued(), 0)
+
+        EmailSendLog.objects.filter(pk=log.pk).update(run_after=timezone.now())
+        self.assertEqual(send_queued(), 1)
+        log.refresh_from_db()
+        self.assertEqual(log.status, EmailSendLog.SENT)
+        self.assertEqual(log.attempts, 2)
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise IOError('smtp down')